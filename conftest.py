@@ -11,6 +11,7 @@ import pytest
 
 import tests.helpers
 from octoprint_authentise import AuthentisePlugin
+from octoprint_authentise.settings import SettingsPlugin
 
 LOGGER = logging.getLogger(__name__)
 logging.basicConfig()
@@ -26,8 +27,12 @@ def settings(mocker):
     default_settings = octoprint.settings.default_settings
     default_settings['plugins']['authentise'] = plugin_settings
     mocker.patch('octoprint.settings.Settings.save')
+    # Rate limiters are shared by host, every test starts with a full bucket
+    mocker.patch.dict('octoprint_authentise.transport._limiters', clear=True)
     octoprint.settings.settings(init=True, basedir='.')
-    _settings = octoprint.plugin.plugin_settings('authentise', defaults=plugin_settings)
+    defaults = SettingsPlugin().get_settings_defaults()
+    defaults.update(plugin_settings)
+    _settings = octoprint.plugin.plugin_settings('authentise', defaults=defaults)
     yield _settings
     octoprint.settings._instance = None #pylint: disable=protected-access
 
@@ -86,6 +91,8 @@ def connect_printer(comm, printer, mocker, event_manager): #pylint: disable=rede
 
     comm.connect(port=printer['port'], baudrate=printer['baud_rate'])
 
+    comm._connecting.result(5) #pylint: disable=protected-access
+
 @pytest.fixture
 def node_uuid():
     return uuid.uuid4()
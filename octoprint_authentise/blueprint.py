@@ -3,14 +3,19 @@
 from __future__ import absolute_import
 
 import json
+import threading
 
 import flask
 import octoprint.plugin
+from octoprint.server import admin_permission
 
-from octoprint_authentise import helpers
+from octoprint_authentise import control, helpers, transport
 
 
 class BlueprintPlugin(octoprint.plugin.BlueprintPlugin):
+    _connection_code_cache = None
+    _connection_code_cache_lock = threading.Lock()
+
     @octoprint.plugin.BlueprintPlugin.route("/connect/", methods=["POST"])
     def blueprint_connect(self):
         username = flask.request.json.get('username')
@@ -25,7 +30,8 @@ class BlueprintPlugin(octoprint.plugin.BlueprintPlugin):
 
     @octoprint.plugin.BlueprintPlugin.route("/node/", methods=["GET"])
     def get_node(self):
-        connection_code = helpers.run_client_and_wait(self._settings, args=['--connection-code'], logger=self._logger)
+        refresh = flask.request.args.get('refresh', '').lower() in ['1', 'true', 'yes']
+        connection_code = self._connection_code(refresh)
         if connection_code:
             self._logger.info("Found node connection code: %s", connection_code)
             results = {
@@ -38,3 +44,42 @@ class BlueprintPlugin(octoprint.plugin.BlueprintPlugin):
         else:
             self._logger.warning("Could not find node connection code")
             return json.dumps({"message": "Could not find node connection code"}), 500
+
+    def _connection_code(self, refresh=False):
+        # The settings page asks for the code on every load, so page loads share one client run
+        with self._connection_code_cache_lock:
+            if not self._connection_code_cache:
+                self._connection_code_cache = helpers.SingleFlightCache(
+                    lambda: control.query_client(self._settings, 'connection-code', self._logger),
+                    ttl=self._settings.get_float(['connection_code_ttl']),
+                )
+        return self._connection_code_cache.get(refresh)
+
+    @octoprint.plugin.BlueprintPlugin.route("/client/", methods=["GET"])
+    def get_client(self):
+        metrics = self.client_metrics()
+        if not metrics:
+            return json.dumps({"message": "The Authentise client has not been started"}), 404
+        return json.dumps(metrics), 200
+
+    @octoprint.plugin.BlueprintPlugin.route("/rate-limit/", methods=["GET"])
+    def get_rate_limit(self): #pylint: disable=no-self-use
+        return json.dumps(transport.rate_limit_metrics()), 200
+
+    @octoprint.plugin.BlueprintPlugin.route("/printers/", methods=["GET"])
+    def get_printers(self):
+        return json.dumps({"resources": self.printer_statuses()}), 200
+
+    @octoprint.plugin.BlueprintPlugin.route("/printers/command/", methods=["POST"])
+    @admin_permission.require(403)
+    def post_printer_command(self):
+        printer_uri = flask.request.json.get('printer_uri')
+        command = flask.request.json.get('command')
+
+        if not printer_uri or not command:
+            return json.dumps({"message": "A printer_uri and a command are required"}), 400
+
+        if not self.send_printer_command(printer_uri, command):
+            return json.dumps({"message": "Could not send command to printer {}".format(printer_uri)}), 409
+
+        return json.dumps({"printer_uri": printer_uri, "command": command}), 202
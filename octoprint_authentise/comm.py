@@ -1,10 +1,10 @@
 # coding=utf-8
 from __future__ import absolute_import
 
+import collections
+import itertools
 import logging
 import os
-import Queue
-import re
 import threading
 import time
 import urlparse
@@ -12,11 +12,15 @@ from urllib import quote_plus
 
 import octoprint.plugin
 import requests
+from concurrent import futures
 from octoprint.events import Events, eventManager
 from octoprint.settings import settings
 from octoprint.util import RepeatedTimer, comm_helpers
 
-from octoprint_authentise import helpers
+from octoprint_authentise import (control, decoding, helpers, lines, pipeline,
+                                  printers, stream, supervisor, tracker,
+                                  transport)
+from octoprint_authentise.temperature import format_temps, parse_temps
 
 __author__ = "Scott Lemmon <scott@authentise.com> based on work by Gina Häußge"
 __license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
@@ -34,45 +38,19 @@ PRINTER_STATE = {
     }
 PRINTER_STATE_REVERSE = dict((v,k) for k,v in PRINTER_STATE.items())
 
-FLOAT_RE = r'[-+]?\d*\.?\d+'
-JUNK_RE = r'(?:\s+.*?\s*)?'
-TEMP_RE = re.compile(
-        r'^(?:ok)?\s*T:\s*(?P<T>{float})(?:\s*/(?P<TT>{float}))?'
-        r'(?:{junk}\s*B:\s*(?P<B>{float})(?:\s*/(?P<TB>{float}))?)?'
-        r'(?:{junk}\s*T0:\s*(?P<T0>{float})(?:\s*/(?P<TT0>{float}))?)?'
-        r'(?:{junk}\s*T1:\s*(?P<T1>{float})(?:\s*/(?P<TT1>{float}))?)?'
-        r'{junk}$'.format(float=FLOAT_RE, junk=JUNK_RE)
-)
-def parse_temps(line):
-    def _cast_to_float(value):
-        if value:
-            try:
-                return float(value)
-            except ValueError:
-                return
-
-    match = TEMP_RE.match(line)
-    if not match:
-        return
+# Seconds the monitor backs off after an unexpected error so a persistent failure can't spin
+MONITOR_ERROR_DELAY = 1
 
-    tools = []
-    bed = None
+# Seconds of fast status polling after a state change or a job control request
+STATUS_TRANSITION_WINDOW = 15
+# Factor the status interval grows by on every poll while the printer is idle or offline
+STATUS_IDLE_BACKOFF = 2
 
-    tool0_actual = _cast_to_float(match.group('T0') or match.group('T'))
-    tool0_target = _cast_to_float(match.group('TT0') or match.group('TT'))
-    tools.append({'actual': tool0_actual, 'target': tool0_target})
+# Responses from the batch command endpoint that mean the server can only take one command at a time
+BATCH_UNSUPPORTED_STATUS_CODES = [404, 405, 501]
 
-    tool1_actual = _cast_to_float(match.group('T1'))
-    tool1_target = _cast_to_float(match.group('TT1'))
-    if tool1_actual:
-        tools.append({'actual': tool1_actual, 'target': tool1_target})
-
-    bed_actual = _cast_to_float(match.group('B'))
-    bed_target = _cast_to_float(match.group('TB'))
-    if bed_actual:
-        bed = {'actual': bed_actual, 'target': bed_target}
-
-    return {'tools': tools, 'bed': bed}
+# Most command uris asked about in one status request, keeping the query string short enough for the server
+COMMAND_STATUS_CHUNK_SIZE = 50
 
 
 class MachineCom(octoprint.plugin.MachineComPlugin): #pylint: disable=too-many-instance-attributes, too-many-public-methods
@@ -85,21 +63,47 @@ class MachineCom(octoprint.plugin.MachineComPlugin): #pylint: disable=too-many-i
     _baudrate = None
     _printer_uri = None
     _print_job_uri = None
+    _printers = None
+    # Printer uri resolved for each (node uuid, port, baud rate), kept across reconnects
+    _printer_uris = None
 
-    _authentise_process = None
+    _client_supervisor = None
+    _connect_attempt = None
+    _connecting = None
     _authentise_model = None
 
     _authentise_url = None
     _session = None
+    _http = None
 
-    _command_uri_queue = None
+    _command_tracker = None
+    _command_pipeline = None
+    _control_dispatcher = None
+    _command_batching = True
 
     _printer_status_timer = None
+    _printer_status_stream = None
+    _status_interval = None
+    _status_fast_until = 0
+    _current_print_status = None
     _tool_tempuratures = None
     _bed_tempurature = None
+    # When the temperatures were last known to match the printer's
+    _temperatures_updated = None
 
     _print_progress = None
 
+    # Number of response lines handled per type, see `lines.LINE_TYPES`
+    _line_counts = None
+    _line_handlers = None
+
+    # Last representation of the printer and the last values handed to OctoPrint, so unchanged
+    # status polls cost neither a download nor a callback
+    _printer_etag = None
+    _client_printers_etag = None
+    _last_temperature_update = None
+    _last_progress_update = None
+
     _callback = None
     _printer_profile_manager = None
 
@@ -112,7 +116,14 @@ class MachineCom(octoprint.plugin.MachineComPlugin): #pylint: disable=too-many-i
         self._logger = logging.getLogger(__name__)
         self._serialLogger = logging.getLogger("SERIAL")
 
-        self._command_uri_queue = comm_helpers.TypedQueue()
+        self._command_tracker = tracker.CommandTracker()
+        self._printers = {}
+        self._printer_uris = {}
+        self._line_counts = collections.Counter()
+        self._line_handlers = {
+            lines.TEMPERATURE   : self._handle_temperature_line,
+            lines.ERROR         : self._handle_error_line,
+        }
 
         self._state = self.STATE_NONE
 
@@ -127,14 +138,6 @@ class MachineCom(octoprint.plugin.MachineComPlugin): #pylint: disable=too-many-i
         self._authentise_url = self._settings.get(['authentise_url']) #pylint: disable=no-member
 
     def connect(self, port=None, baudrate=None):
-        try:
-            self._session = helpers.session(self._settings) #pylint: disable=no-member
-            helpers.claim_node(self.node_uuid, self._settings, self._logger) #pylint: disable=no-member
-        except (helpers.ClaimNodeException, helpers.SessionException) as e:
-            self._errorValue = e.message
-            self._change_state(PRINTER_STATE['ERROR'])
-            return
-
         if port == None:
             port = settings().get(["serial", "port"])
         if baudrate == None:
@@ -146,9 +149,116 @@ class MachineCom(octoprint.plugin.MachineComPlugin): #pylint: disable=too-many-i
 
         self._port = port
         self._baudrate = baudrate
+
+        # Talking to Authentise can be slow, so the caller only waits for the state change and the
+        # rest of the connection is set up in the background
+        attempt = self._connect_attempt = object()
+        self._change_state(PRINTER_STATE['CONNECTING'])
+
+        executor = futures.ThreadPoolExecutor(max_workers=1)
+        self._connecting = executor.submit(self._connect, attempt, port, baudrate)
+        executor.shutdown(wait=False)
+
+        timeout = self._settings.get_float(['connect_timeout']) #pylint: disable=no-member
+        if timeout:
+            watchdog = threading.Timer(timeout, self._on_connect_timeout, args=(attempt, timeout))
+            watchdog.daemon = True
+            watchdog.start()
+
+    def _connect(self, attempt, port, baudrate):
+        steps = [
+            ('Claiming Authentise node', self._claim_node),
+            ('Finding Authentise printer', lambda: self._find_printer(port, baudrate)),
+            ('Starting Authentise client', self._start_client),
+            ('Starting printer monitor', self._start_monitoring),
+        ]
+        for description, step in steps:
+            if self._connect_attempt is not attempt:
+                break
+
+            self._log('{}...'.format(description))
+            started = time.time()
+            try:
+                step()
+            except (helpers.ClaimNodeException, helpers.SessionException) as e:
+                self._on_connect_error(attempt, e.message)
+                return
+            except Exception as e: #pylint: disable=broad-except
+                self._logger.exception("Error connecting to Authentise")
+                self._on_connect_error(attempt, 'Could not connect to Authentise: {}'.format(e))
+                return
+            self._logger.debug("%s took %.2fs", description, time.time() - started)
+
+        # Anything started after the attempt was closed or timed out has to be stopped again
+        if self._connect_attempt is not attempt:
+            self._log('Connection attempt abandoned')
+            self._stop_connection(wait=False)
+
+    def _on_connect_error(self, attempt, message):
+        if self._connect_attempt is attempt:
+            self._connect_attempt = None
+            self._stop_connection(wait=False)
+            self._errorValue = message
+            self._change_state(PRINTER_STATE['ERROR'])
+
+    def _on_connect_timeout(self, attempt, timeout):
+        if not self._connecting.done():
+            self._on_connect_error(attempt, 'Timed out connecting to Authentise after {}s'.format(timeout))
+
+    def _claim_node(self):
+        self._session = helpers.session(self._settings) #pylint: disable=no-member
+        self._http = transport.RequestPolicy(self._session, self._settings) #pylint: disable=no-member
+        get_claim_code = lambda: control.query_client(self._settings, 'connection-code', self._logger) #pylint: disable=no-member
+        helpers.claim_node(self.node_uuid, self._settings, self._logger, get_claim_code) #pylint: disable=no-member
+
+    def _find_printer(self, port, baudrate):
+        self._printers = {}
         self._printer_uri = self._get_or_create_printer(port, baudrate)
+        if self._printer_uri not in self._printers:
+            self._printers[self._printer_uri] = printers.PrinterStatus(self._printer_uri, port, baudrate)
+
+    def _start_client(self):
+        self._client_supervisor = supervisor.ClientSupervisor(
+            helpers.client_command(self._settings), #pylint: disable=no-member
+            on_exit=self._on_client_exit,
+            backoff=self._settings.get_float(['client_restart_backoff']), #pylint: disable=no-member
+            max_backoff=self._settings.get_float(['client_restart_max_backoff']), #pylint: disable=no-member
+            stderr_lines=self._settings.get_int(['client_stderr_lines']), #pylint: disable=no-member
+        )
+        self._client_supervisor.start()
+
+    def _start_monitoring(self):
+        self._printer_etag = None
+        self._client_printers_etag = None
+        self._status_interval = None
+        self._last_temperature_update = None
+        self._last_progress_update = None
+        self._temperatures_updated = None
+        self._line_counts.clear()
+
+        self._command_tracker = tracker.CommandTracker(
+            poll_interval=self._settings.get_float(['command_poll_interval']), #pylint: disable=no-member
+            backoff=self._settings.get_float(['command_poll_backoff']), #pylint: disable=no-member
+            max_interval=self._settings.get_float(['command_poll_max_interval']), #pylint: disable=no-member
+            expiry=self._settings.get_float(['command_expiry']), #pylint: disable=no-member
+        )
+
+        self._command_batching = True
+        self._command_pipeline = pipeline.CommandPipeline(
+            self._post_commands,
+            on_error=self._on_command_error,
+            workers=self._settings.get_int(['command_workers']), #pylint: disable=no-member
+            max_size=self._settings.get_int(['command_queue_size']), #pylint: disable=no-member
+            batch_window=self._settings.get_float(['command_batch_window']), #pylint: disable=no-member
+            batch_size=self._settings.get_int(['command_batch_size']), #pylint: disable=no-member
+        )
+        self._command_pipeline.start()
 
-        self._authentise_process = helpers.run_client(self._settings) #pylint: disable=no-member
+        self._control_dispatcher = pipeline.PriorityDispatcher(
+            workers=self._settings.get_int(['control_workers']), #pylint: disable=no-member
+            on_error=self._on_control_error,
+        )
+        self._control_dispatcher.start()
 
         # monitoring thread
         self._monitoring_active = True
@@ -156,26 +266,112 @@ class MachineCom(octoprint.plugin.MachineComPlugin): #pylint: disable=too-many-i
         self.monitoring_thread.daemon = True
         self.monitoring_thread.start()
 
+        if self._settings.get_boolean(['status_streaming']): #pylint: disable=no-member
+            self._start_status_stream()
+        else:
+            self._start_status_polling()
+
+    def _start_status_polling(self):
         self._printer_status_timer = RepeatedTimer(
-            lambda: comm_helpers.get_interval("temperature", default_value=10.0),
+            self._status_poll_interval,
             self._update_printer_data,
             run_first=True
         )
         self._printer_status_timer.start()
 
-        self._change_state(PRINTER_STATE['CONNECTING'])
+    def _status_poll_interval(self):
+        minimum = self._settings.get_float(['status_interval_min']) #pylint: disable=no-member
+        maximum = self._settings.get_float(['status_interval_max']) #pylint: disable=no-member
+        default = comm_helpers.get_interval("temperature", default_value=10.0)
 
-    def _get_or_create_printer(self, port, baud_rate):
-        client_url = urlparse.urljoin(self._authentise_url, '/client/{}/'.format(self.node_uuid)) #pylint: disable=no-member
+        if time.time() < self._status_fast_until or self._current_print_status == 'warming_up':
+            interval = minimum
+        elif self.isBusy():
+            interval = default
+        else:
+            interval = max(default, (self._status_interval or default) * STATUS_IDLE_BACKOFF)
 
-        url = urlparse.urljoin(self._authentise_url,
-                               '/printer/instance/?filter[client]={}'.format(quote_plus(client_url)))
-        target_printer = None
-        self._log('Getting printer list from: {}'.format(url))
+        self._status_interval = min(max(interval, minimum), maximum)
+        return self._status_interval
 
-        printer_get_resp = self._session.get(url=url)
+    def _poll_status_soon(self):
+        # A transition is expected, so poll fast for a while and cut short a long idle wait
+        self._status_fast_until = time.time() + STATUS_TRANSITION_WINDOW
+        # Only a running poll is restarted, never one stopped by close or replaced by the stream
+        if not self._monitoring_active or self._printer_status_stream or not self._printer_status_timer:
+            return
+        if self._status_interval > self._settings.get_float(['status_interval_min']): #pylint: disable=no-member
+            self._printer_status_timer.cancel()
+            self._start_status_polling()
+
+    def _start_status_stream(self):
+        self._printer_status_stream = stream.PrinterStatusStream(
+            self._session,
+            self._printer_uri,
+            on_data=self._handle_printer_data,
+            on_failure=self._on_status_stream_failure,
+            read_timeout=self._settings.get_float(['status_stream_timeout']), #pylint: disable=no-member
+        )
+        self._printer_status_stream.start()
+
+    def _on_status_stream_failure(self, reason):
+        self._log('{}, falling back to polling printer status'.format(reason))
+        self._printer_status_stream = None
+        if self._monitoring_active:
+            self._start_status_polling()
+
+    def _on_client_exit(self, returncode, stderr):
+        self._log('Authentise client exited with {}, restarting it'.format(returncode))
+        if stderr:
+            self._log('Last client output: {}'.format(stderr[-1]))
+
+    def client_metrics(self):
+        return self._client_supervisor.metrics() if self._client_supervisor else None
+
+    def _client_url(self):
+        return urlparse.urljoin(self._authentise_url, '/client/{}/'.format(self.node_uuid)) #pylint: disable=no-member
+
+    def _client_printers_url(self):
+        return urlparse.urljoin(self._authentise_url,
+                                '/printer/instance/?filter[client]={}'.format(quote_plus(self._client_url())))
+
+    def _iter_client_printers(self, params=None, url=None, endpoint='printers', hedge=False):
+        # Pages are only fetched as the caller gets to them, following each page's next link
+        url = url or self._client_printers_url()
+        while url:
+            response = self._http.get(endpoint, url, hedge=hedge, params=params)
+            response.raise_for_status()
+            page = decoding.decode(response)
+            for printer in decoding.printer_resources(page):
+                yield printer
+            url = (page.get('links') or {}).get('next')
+            params = None
+
+    def _forget_printer_uri(self, printer_uri):
+        for key, uri in self._printer_uris.items():
+            if uri == printer_uri:
+                del self._printer_uris[key]
+
+    def _get_or_create_printer(self, port, baud_rate):
+        cache_key = (self.node_uuid, port, baud_rate) #pylint: disable=no-member
+
+        if self._settings.get_boolean(['multi_printer']): #pylint: disable=no-member
+            self._log('Getting printer list from: {}'.format(self._client_printers_url()))
+            client_printers = list(self._iter_client_printers())
+            for printer in client_printers:
+                self._printers[printer['uri']] = printers.PrinterStatus(
+                    printer['uri'], printer['port'], printer['baud_rate'], printer.get('name'))
+            self._log('Managing {} printers for this node'.format(len(self._printers)))
+        elif cache_key in self._printer_uris:
+            self._log('Using printer {} for port {}'.format(self._printer_uris[cache_key], port))
+            return self._printer_uris[cache_key]
+        else:
+            # The server filters by port when it can, anything else it sends is skipped here
+            self._log('Getting printer list from: {}'.format(self._client_printers_url()))
+            client_printers = self._iter_client_printers(params={'filter[port]': port}) #pylint: disable=redefined-variable-type
 
-        for printer in printer_get_resp.json()["resources"]:
+        target_printer = None
+        for printer in client_printers:
             if printer['port'] == port:
                 target_printer = printer
                 self._log('Printer {} matches selected port {}'.format(printer, port))
@@ -183,8 +379,9 @@ class MachineCom(octoprint.plugin.MachineComPlugin): #pylint: disable=too-many-i
 
         if target_printer:
             if target_printer['baud_rate'] != baud_rate:
-                self._session.put(target_printer["uri"], json={'baud_rate': baud_rate})
+                self._http.put('printers', target_printer["uri"], json={'baud_rate': baud_rate})
 
+            self._printer_uris[cache_key] = target_printer['uri']
             return target_printer['uri']
         else:
             self._log('No printer found for port {}. Creating it.'.format(port))
@@ -196,14 +393,15 @@ class MachineCom(octoprint.plugin.MachineComPlugin): #pylint: disable=too-many-i
 
             payload = {
                 'baud_rate'         : baud_rate,
-                'client'            : client_url,
+                'client'            : self._client_url(),
                 'name'              : 'Octoprint Printer',
                 'port'              : port,
                 'printer_model'     : 'https://print.dev-auth.com/printer/model/{}/'.format(model),
             }
-            create_printer_resp = self._session.post(urlparse.urljoin(self._authentise_url,
-                                                                 '/printer/instance/'),
-                                                json=payload)
+            create_printer_resp = self._http.post('printers',
+                                                  urlparse.urljoin(self._authentise_url, '/printer/instance/'),
+                                                  json=payload)
+            self._printer_uris[cache_key] = create_printer_resp.headers["Location"]
             return create_printer_resp.headers["Location"]
 
     # #~~ internal state management
@@ -216,6 +414,7 @@ class MachineCom(octoprint.plugin.MachineComPlugin): #pylint: disable=too-many-i
         old_state = self._state
         old_state_string = self.getStateString()
         self._state = new_state
+        self._status_fast_until = time.time() + STATUS_TRANSITION_WINDOW
         self._log("Changed printer state from '{}' to '{}'".format(old_state_string, self.getStateString()))
         self._callback.on_comm_state_change(new_state)
 
@@ -346,23 +545,43 @@ class MachineCom(octoprint.plugin.MachineComPlugin): #pylint: disable=too-many-i
     ##~~ external interface
 
     def close(self, is_error=False, wait=True, *args, **kwargs): #pylint: disable=unused-argument
-        if self._printer_status_timer:
-            self._printer_status_timer.cancel()
-
-        self._monitoring_active = False
+        self._connect_attempt = None
+        self._stop_connection(wait)
 
         printing = self.isPrinting() or self.isPaused()
 
         if printing:
             eventManager().fire(Events.PRINT_FAILED, None)
 
-        # close the Authentise client if it is open
-        if self._authentise_process:
-            self._authentise_process.send_signal(2) #send the SIGINT signal
-
+        self._command_tracker.clear()
         self._print_job_uri = None
         self._change_state(PRINTER_STATE['CLOSED'])
 
+    def _stop_connection(self, wait=True):
+        if self._printer_status_stream:
+            self._printer_status_stream.stop()
+            self._printer_status_stream = None
+
+        if self._printer_status_timer:
+            self._printer_status_timer.cancel()
+            self._printer_status_timer = None
+
+        if self._command_pipeline:
+            self._command_pipeline.stop()
+
+        if self._control_dispatcher:
+            self._control_dispatcher.stop()
+
+        self._monitoring_active = False
+        self._command_tracker.stop()
+
+        if self._http:
+            self._http.close()
+
+        # close the Authentise client if it is open
+        if self._client_supervisor:
+            self._client_supervisor.stop(self._settings.get_float(['client_stop_timeout']) if wait else None) #pylint: disable=no-member
+
     def setTemperatureOffset(self, offsets):
         pass
 
@@ -377,31 +596,136 @@ class MachineCom(octoprint.plugin.MachineComPlugin): #pylint: disable=too-many-i
                 return
 
         if self.isOperational():
-            data = {'command': cmd}
-            printer_command_url = urlparse.urljoin(self._printer_uri, 'command/')
-
-            response = self._session.post(printer_command_url, json=data)
-            if not response.ok:
-                self._log(
-                    'Warning: Got invalid response {}: {} for {}: {}'.format(
-                        response.status_code,
-                        response.content,
-                        response.request.url,
-                        response.request.body))
+            if self._answer_temperature_query(cmd):
+                return
+
+            if pipeline.is_emergency_stop(cmd):
+                self._emergency_stop(self._printer_uri, cmd)
                 return
 
+            try:
+                self._command_pipeline.submit(self._printer_uri, cmd)
+            except pipeline.PipelineFullException as e:
+                self._log('Warning: {}'.format(e.message))
+
+    def _answer_temperature_query(self, cmd):
+        # OctoPrint polls temperatures with M105, which the status updates already keep current
+        max_age = self._settings.get_float(['temperature_cache_max_age']) #pylint: disable=no-member
+        parts = cmd.split(None, 1)
+        if not max_age or not parts or parts[0].upper() != 'M105':
+            return False
+        if self._temperatures_updated is None or time.time() - self._temperatures_updated > max_age:
+            return False
+        # A local answer would overtake the commands the pipeline hasn't handed to the tracker yet
+        if self._command_pipeline.pending(self._printer_uri):
+            return False
+
+        report = format_temps(self._tool_tempuratures, self._bed_tempurature)
+        if not report:
+            return False
+
+        self._command_tracker.add_resolved({'command': cmd, 'response': report})
+        return True
+
+    def _emergency_stop(self, printer_uri, cmd):
+        # Whatever was queued for the printer is moot once it has been stopped
+        dropped = self._command_pipeline.discard(printer_uri)
+        if dropped:
+            self._log('Dropped {} queued commands for {}'.format(dropped, printer_uri))
+        return self._control_dispatcher.dispatch(pipeline.EMERGENCY, self._post_command, printer_uri, cmd,
+                                                 transport.CONTROL)
+
+    def _on_control_error(self, call, error):
+        self._log('Error running {}: {}'.format(call.__name__, error))
+
+    def _post_commands(self, printer_uri, cmds):
+        if len(cmds) > 1 and self._command_batching and self._post_command_batch(printer_uri, cmds):
+            return
+
+        for cmd in cmds:
+            self._post_command(printer_uri, cmd)
+
+    def _post_command_batch(self, printer_uri, cmds):
+        printer_batch_url = urlparse.urljoin(printer_uri, 'command/batch/')
+
+        response = self._http.post('command', printer_batch_url, json={'commands': cmds})
+        if response.status_code in BATCH_UNSUPPORTED_STATUS_CODES:
+            self._log('Batched commands are not supported by {}, sending commands one at a time'.format(
+                response.request.url))
+            self._command_batching = False
+            return False
+
+        if not response.ok:
             self._log(
-                'Sent {} to {} with response {}: {}'.format(
-                    response.request.body,
+                'Warning: Got invalid response {}: {} for {}: {}'.format(
+                    response.status_code,
+                    response.content,
                     response.request.url,
+                    response.request.body))
+            return True
+
+        self._log(
+            'Sent {} to {} with response {}: {}'.format(
+                response.request.body,
+                response.request.url,
+                response.status_code,
+                response.content))
+        for command in decoding.command_resources(decoding.decode(response)):
+            self._track_command(printer_uri, command['uri'])
+        return True
+
+    def _post_command(self, printer_uri, cmd, priority=None):
+        data = {'command': cmd}
+        printer_command_url = urlparse.urljoin(printer_uri, 'command/')
+
+        response = self._http.post('command', printer_command_url, priority=priority, json=data)
+        if not response.ok:
+            self._log(
+                'Warning: Got invalid response {}: {} for {}: {}'.format(
                     response.status_code,
-                    response.content))
-            command_uri = response.headers['Location']
-            self._command_uri_queue.put({
-                'uri'           : command_uri,
-                'start_time'    : time.time(),
-                'previous_time' : None,
-            })
+                    response.content,
+                    response.request.url,
+                    response.request.body))
+            return
+
+        self._log(
+            'Sent {} to {} with response {}: {}'.format(
+                response.request.body,
+                response.request.url,
+                response.status_code,
+                response.content))
+        self._track_command(printer_uri, response.headers['Location'])
+
+    def _track_command(self, printer_uri, command_uri):
+        # Only responses from the printer OctoPrint is connected to belong in its terminal
+        if printer_uri == self._printer_uri:
+            self._command_tracker.add(command_uri, time.time())
+
+    def _on_command_error(self, printer_uri, cmds, error):
+        self._log('Error sending {} to {}: {}'.format(', '.join(cmds), printer_uri, error))
+
+    ##~~ multiple printers
+
+    def printer_statuses(self):
+        return [status.as_dict() for status in self._printers.values()]
+
+    def send_printer_command(self, printer_uri, cmd):
+        if not self.isOperational() or printer_uri not in self._printers or not self._command_pipeline:
+            return False
+
+        cmd = comm_helpers.process_gcode_line(cmd.encode('ascii', 'replace'))
+        if not cmd:
+            return False
+
+        if pipeline.is_emergency_stop(cmd):
+            return self._emergency_stop(printer_uri, cmd)
+
+        try:
+            self._command_pipeline.submit(printer_uri, cmd)
+        except pipeline.PipelineFullException as e:
+            self._log('Warning: {}'.format(e.message))
+            return False
+        return True
 
     def startPrint(self):
         pass
@@ -414,30 +738,34 @@ class MachineCom(octoprint.plugin.MachineComPlugin): #pylint: disable=too-many-i
 
     def _send_pause_cancel_request(self, status):
         try:
-            response = self._session.put(self._print_job_uri, json={'status':status})
-        except (requests.exceptions.MissingSchema, requests.exceptions.ConnectionError) as e:
+            response = self._http.put('command', self._print_job_uri, priority=transport.CONTROL,
+                                      json={'status':status})
+        except (requests.exceptions.MissingSchema, requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout) as e:
             self._log('Request to {} generated error: {}'.format(self._print_job_uri, e))
             response = None
 
-        if response and response.ok:
+        # The connection may have been closed while the request was waiting
+        if response and response.ok and self._monitoring_active:
             status_map = {
                     'cancel': PRINTER_STATE['OPERATIONAL'],
                     'pause': PRINTER_STATE['PAUSED'],
                     'resume': PRINTER_STATE['PRINTING'],
                     }
             self._change_state(status_map[status])
+            self._poll_status_soon()
 
     def cancelPrint(self):
         if not self.isPrinting() and not self.isPaused():
             return
-        self._send_pause_cancel_request('cancel')
+        self._control_dispatcher.dispatch(pipeline.CONTROL, self._send_pause_cancel_request, 'cancel')
 
     def setPause(self, pause):
         if not pause and self.isPaused():
-            self._send_pause_cancel_request('resume')
+            self._control_dispatcher.dispatch(pipeline.CONTROL, self._send_pause_cancel_request, 'resume')
 
         elif pause and self.isPrinting():
-            self._send_pause_cancel_request('pause')
+            self._control_dispatcher.dispatch(pipeline.CONTROL, self._send_pause_cancel_request, 'pause')
 
     def sendGcodeScript(self, scriptName, replacements=None):
         return
@@ -472,48 +800,35 @@ class MachineCom(octoprint.plugin.MachineComPlugin): #pylint: disable=too-many-i
     ##~~ Serial monitor processing received messages
 
     def _readline(self):
-        def _put_command_on_queue(data, start_time_diff):
-            if start_time_diff < 120:
-                self._command_uri_queue.put(data)
+        command_response = self._command_tracker.pop()
+        if not command_response:
+            current_time = time.time()
+            command_uris = self._command_tracker.due(current_time)
+            if not command_uris:
+                return ''
+
+            for start in range(0, len(command_uris), COMMAND_STATUS_CHUNK_SIZE):
+                self._command_tracker.update(self._get_command_resources(command_uris[start:start + COMMAND_STATUS_CHUNK_SIZE]))
+            command_response = self._command_tracker.pop()
+            if not command_response:
+                return ''
 
-        current_time = time.time()
-
-        try:
-            command = self._command_uri_queue.get_nowait()
-        except Queue.Empty:
-            return ''
-
-        start_time    = command['start_time']
-        previous_time = command['previous_time']
-        command_uri   = command['uri']
-
-        start_time_diff = current_time - start_time
-        previous_time_diff = (current_time - previous_time) if previous_time else start_time_diff
-
-        if previous_time_diff < 2:
-            _put_command_on_queue({
-                'uri'           : command_uri,
-                'start_time'    : start_time,
-                'previous_time' : previous_time,
-            }, start_time_diff)
-            return ''
-
-        response = self._session.get(command_uri)
-
-        if response.ok and response.json()['status'] in ['error', 'printer_offline']:
-            return ''
-        elif not response.ok or response.json()['status'] != 'ok':
-            _put_command_on_queue({
-                'uri'           : command_uri,
-                'start_time'    : start_time,
-                'previous_time' : current_time,
-            }, start_time_diff)
-            return ''
-
-        command_response = response.json()
         self._log('Got response: {}, for command: {}'.format(command_response['response'], command_response['command']))
         return command_response['response']
 
+    def _get_command_resources(self, command_uris):
+        try:
+            response = self._http.get('command', urlparse.urljoin(self._printer_uri, 'command/'),
+                                      hedge=True, params={'filter[uri]': ','.join(command_uris)})
+        except requests.exceptions.RequestException as e:
+            self._log('Unable to get command status: {}'.format(e))
+            return []
+
+        if not response.ok:
+            self._log('Unable to get command status: {}: {}'.format(response.status_code, response.content))
+            return []
+        return decoding.command_resources(decoding.decode(response))
+
     def _monitor_loop(self):
         self._log("Connected, starting monitor")
         while self._monitoring_active:
@@ -521,13 +836,14 @@ class MachineCom(octoprint.plugin.MachineComPlugin): #pylint: disable=too-many-i
                 line = self._readline()
 
                 if not line:
+                    self._command_tracker.wait(time.time())
                     continue
 
-                temps = parse_temps(line)
-                if temps:
-                    tool_temps = {i: [temp['actual'], temp['target']] for i, temp in enumerate(temps['tools'])}
-                    bed_temp = (temps['bed']['actual'], temps['bed']['target']) if temps['bed'] else None
-                    self._callback.on_comm_temperature_update(tool_temps, bed_temp)
+                line_type = lines.classify(line)
+                self._line_counts[line_type] += 1
+                handler = self._line_handlers.get(line_type)
+                if handler:
+                    handler(line)
                 self._callback.on_comm_message(line)
 
             except: #pylint: disable=bare-except
@@ -537,25 +853,94 @@ class MachineCom(octoprint.plugin.MachineComPlugin): #pylint: disable=too-many-i
                 self._log(errorMsg)
                 self._errorValue = errorMsg
                 self._change_state(PRINTER_STATE['ERROR'])
-            time.sleep(0.1)
+                time.sleep(MONITOR_ERROR_DELAY)
         self._log("Connection closed, closing down monitor")
 
+    def _handle_temperature_line(self, line):
+        temps = parse_temps(line)
+        if temps:
+            tool_temps = {i: [temp['actual'], temp['target']] for i, temp in enumerate(temps['tools'])}
+            bed_temp = (temps['bed']['actual'], temps['bed']['target']) if temps['bed'] else None
+            self._callback.on_comm_temperature_update(tool_temps, bed_temp)
+
+    def _handle_error_line(self, line):
+        self._logger.warning("Printer reported an error: %s", line)
+
+    def line_counts(self):
+        return {line_type: self._line_counts[line_type] for line_type in lines.LINE_TYPES}
+
     def _update_printer_data(self):
         if not self._printer_uri:
             return
 
-        response = self._session.get(self._printer_uri)
+        try:
+            if self._settings.get_boolean(['multi_printer']): #pylint: disable=no-member
+                self._update_client_printers_data()
+            else:
+                self._update_connected_printer_data()
+        except requests.exceptions.RequestException as e:
+            self._log('Unable to get printer status: {}'.format(e))
+
+    def _update_connected_printer_data(self):
+        headers = {'If-None-Match': self._printer_etag} if self._printer_etag else None
+        response = self._http.get('status', self._printer_uri, hedge=True, headers=headers)
+
+        if response.status_code == 304:
+            self._temperatures_updated = time.time()
+            return
+
+        if response.status_code == 404:
+            self._forget_printer_uri(self._printer_uri)
 
         if not response.ok:
             self._log('Unable to get printer status: {}: {}'.format(response.status_code, response.content))
             return
 
-        response_data = response.json()
+        self._printer_etag = response.headers.get('ETag')
+        self._handle_printer_data(decoding.printer_resource(decoding.decode(response)))
+
+    def _update_client_printers_data(self):
+        # One request for every printer of this node, fanned out to each printer's state
+        headers = {'If-None-Match': self._client_printers_etag} if self._client_printers_etag else None
+        response = self._http.get('status', self._client_printers_url(), hedge=True, headers=headers)
+
+        if response.status_code == 304:
+            self._temperatures_updated = time.time()
+            return
+
+        if not response.ok:
+            self._log('Unable to get printer statuses: {}: {}'.format(response.status_code, response.content))
+            return
+
+        page = decoding.decode(response)
+        client_printers = decoding.printer_resources(page)
+        next_url = (page.get('links') or {}).get('next')
+        # An ETag only vouches for the first page, so a list spanning pages is fetched whole every time
+        self._client_printers_etag = None if next_url else response.headers.get('ETag')
+        if next_url:
+            client_printers = itertools.chain(client_printers,
+                                              self._iter_client_printers(url=next_url, endpoint='status', hedge=True))
+
+        now = time.time()
+        for printer in client_printers:
+            if printer['uri'] == self._printer_uri:
+                self._handle_printer_data(printer)
+                continue
+
+            if printer['uri'] not in self._printers:
+                self._printers[printer['uri']] = printers.PrinterStatus(printer['uri'])
+            self._printers[printer['uri']].update(printer, now)
+
+    def _handle_printer_data(self, response_data):
+        if self._printer_uri in self._printers:
+            self._printers[self._printer_uri].update(response_data, time.time())
 
         if response_data['current_print'] and response_data['current_print']['status'].lower() != 'new':
             self._print_job_uri = response_data['current_print']['job_uri']
+            self._current_print_status = response_data['current_print']['status'].lower()
         else:
             self._print_job_uri = None
+            self._current_print_status = None
 
         self._update_state(response_data)
         self._update_temps(response_data)
@@ -563,19 +948,13 @@ class MachineCom(octoprint.plugin.MachineComPlugin): #pylint: disable=too-many-i
         self._update_progress(response_data)
 
     def _update_temps(self, response_data):
-        temps = response_data['temperatures']
+        self._tool_tempuratures, self._bed_tempurature = printers.parse_temperatures(response_data['temperatures'])
+        self._temperatures_updated = time.time()
 
-        self._tool_tempuratures = {0: [
-                temps['extruder1'].get('current') if temps.get('extruder1') else None,
-                temps['extruder1'].get('target') if temps.get('extruder1') else None,
-            ]}
-
-        self._bed_tempurature = [
-                temps['bed'].get('current') if temps.get('bed') else None,
-                temps['bed'].get('target') if temps.get('bed') else None,
-                ] if temps.get('bed') else None
-
-        self._callback.on_comm_temperature_update(self._tool_tempuratures, self._bed_tempurature)
+        temperature_update = (self._tool_tempuratures, self._bed_tempurature)
+        if temperature_update != self._last_temperature_update:
+            self._last_temperature_update = temperature_update
+            self._callback.on_comm_temperature_update(*temperature_update)
 
     def _update_progress(self, response_data):
         current_print = response_data['current_print']
@@ -586,7 +965,7 @@ class MachineCom(octoprint.plugin.MachineComPlugin): #pylint: disable=too-many-i
                 'elapsed'          : current_print['elapsed'],
                 'remaining'        : current_print['remaining'],
             }
-            self._callback.on_comm_set_progress_data(
+            progress_update = (
                     current_print['percent_complete'],
                     current_print['percent_complete']*100 if current_print['percent_complete'] else None,
                     current_print['elapsed'],
@@ -594,7 +973,11 @@ class MachineCom(octoprint.plugin.MachineComPlugin): #pylint: disable=too-many-i
                     )
         else:
             self._print_progress = None
-            self._callback.on_comm_set_progress_data(None, None, None, None)
+            progress_update = (None, None, None, None)
+
+        if progress_update != self._last_progress_update:
+            self._last_progress_update = progress_update
+            self._callback.on_comm_set_progress_data(*progress_update)
 
     def _update_state(self, response_data):
         if response_data['status'].lower() == 'online':
@@ -0,0 +1,185 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import itertools
+import json
+import logging
+import subprocess
+import threading
+
+from concurrent import futures
+
+from octoprint_authentise import helpers
+
+# Queries the client answers, with the flag that asks a one-shot client run the same thing
+QUERIES = {
+    'version'           : '--version',
+    'node-uuid'         : '--node-uuid',
+    'connection-code'   : '--connection-code',
+}
+
+# Seconds a closed channel's client gets to exit once its stdin is closed, before it's killed
+CONTROL_CLOSE_TIMEOUT = 2
+
+class ControlChannelException(Exception):
+    pass
+
+class ControlChannel(object): #pylint: disable=too-many-instance-attributes
+    """Long-lived client process answering queries over its stdin and stdout.
+
+    The client is started with `--control` and speaks line-delimited JSON: each request is an
+    object like `{"id": 1, "query": "node-uuid"}` on one line of its stdin, answered by a line
+    like `{"id": 1, "result": "..."}` or `{"id": 1, "error": "..."}` on its stdout. Answers may
+    come out of order, they are matched to requests by id.
+
+    The process is started on the first query and restarted if it exits. A client that exits
+    before ever answering doesn't support the protocol, and the channel is marked `unsupported`.
+    """
+    def __init__(self, command):
+        self._logger = logging.getLogger(__name__)
+
+        self._command = command
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._process = None
+        self._reader = None
+        self._answered = False
+        self.unsupported = False
+
+    def query(self, query, timeout=None):
+        with self._lock:
+            if self.unsupported:
+                raise ControlChannelException("The client doesn't support a control channel")
+
+            process = self._process or self._start()
+            request_id = next(self._ids)
+            pending = futures.Future()
+            self._pending[request_id] = (process, pending)
+
+        # The reader needs `_lock` to hand out answers, so a write blocked on a full pipe mustn't hold it
+        try:
+            with self._write_lock:
+                process.stdin.write(json.dumps({'id': request_id, 'query': query}) + '\n')
+                process.stdin.flush()
+        except (IOError, OSError, ValueError) as e:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise ControlChannelException("Could not send {} query to the client: {}".format(query, e))
+
+        try:
+            return pending.result(timeout)
+        except futures.TimeoutError:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise ControlChannelException("Timed out waiting for the client to answer {} query".format(query))
+
+    def close(self, timeout=CONTROL_CLOSE_TIMEOUT):
+        """Closes the client's stdin and waits up to `timeout` seconds for it to exit before killing it"""
+        with self._lock:
+            process, self._process = self._process, None
+            reader, self._reader = self._reader, None
+        if not process:
+            return
+
+        with self._write_lock:
+            process.stdin.close()
+        # The reader reaps the process, waiting on it here too would race it for the exit status
+        reader.join(timeout)
+        if reader.is_alive():
+            self._logger.warning("Client control channel did not exit within %ss, killing it", timeout)
+            try:
+                process.kill()
+            except OSError:
+                pass
+            reader.join(timeout)
+
+    def _start(self):
+        try:
+            self._process = subprocess.Popen(self._command + ['--control'],
+                                             stdin=subprocess.PIPE,
+                                             stdout=subprocess.PIPE,
+                                             stderr=helpers.DEVNULL)
+        except OSError as e:
+            self.unsupported = True
+            raise ControlChannelException("Could not start the client control channel: {}".format(e))
+
+        self._reader = threading.Thread(target=self._read, args=(self._process,), name="authentise._control")
+        self._reader.daemon = True
+        self._reader.start()
+        return self._process
+
+    def _read(self, process):
+        for line in iter(process.stdout.readline, ''):
+            try:
+                response = json.loads(line)
+                request_id = response['id']
+            except (ValueError, KeyError, TypeError):
+                self._logger.warning("Ignoring unexpected output on the client control channel: %s", line.strip())
+                continue
+
+            with self._lock:
+                self._answered = True
+                _, pending = self._pending.pop(request_id, (None, None))
+            if not pending:
+                continue
+            if 'error' in response:
+                pending.set_exception(ControlChannelException(response['error']))
+            else:
+                pending.set_result(response.get('result'))
+
+        process.wait()
+        with self._lock:
+            if self._process is process:
+                self._process = None
+                self._reader = None
+            if not self._answered:
+                self.unsupported = True
+            # Requests sent to a process started since are still waiting for their answer
+            failed = [request_id for request_id, (sent_to, _) in self._pending.items() if sent_to is process]
+            failed = [self._pending.pop(request_id)[1] for request_id in failed]
+
+        for request in failed:
+            request.set_exception(ControlChannelException(
+                "The client control channel exited with {}".format(process.returncode)))
+
+_channels = {}
+_channels_lock = threading.Lock()
+
+def channel(settings):
+    """Returns the control channel shared by everyone running the configured client"""
+    command = helpers.client_command(settings)
+    with _channels_lock:
+        key = tuple(command)
+        if key not in _channels:
+            # Channels to a client that is no longer configured would never be used again
+            for stale in _channels.values():
+                stale.close()
+            _channels.clear()
+            _channels[key] = ControlChannel(command)
+        return _channels[key]
+
+def close_channels():
+    """Stops every control channel's client process"""
+    with _channels_lock:
+        channels = _channels.values()
+        _channels.clear()
+    for control_channel in channels:
+        control_channel.close()
+
+def query_client(settings, query, logger, timeout=None):
+    """Asks the client a question from `QUERIES`, over the control channel when it's available.
+
+    Falls back to a one-shot run of the client when the control channel is disabled, unsupported
+    or failing. Each attempt gives up after `timeout` seconds, `client_query_timeout` by default,
+    and a one-shot client still running by then is killed.
+    """
+    timeout = timeout or settings.get_float(['client_query_timeout'])
+    if settings.get_boolean(['client_control_channel']):
+        try:
+            return channel(settings).query(query, timeout=timeout)
+        except ControlChannelException as e:
+            logger.debug("Falling back to a one-shot client run for %s: %s", query, e)
+
+    return helpers.run_client_and_wait(settings, args=[QUERIES[query]], logger=logger, timeout=timeout)
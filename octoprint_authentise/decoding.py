@@ -0,0 +1,30 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+# A faster JSON decoder is used when one is installed. They all raise a ValueError on bad input
+try:
+    import ujson as json_backend
+except ImportError:
+    try:
+        import simplejson as json_backend
+    except ImportError:
+        import json as json_backend
+
+def loads(text):
+    return json_backend.loads(text)
+
+def decode(response):
+    """Parses the body of a `requests` response once, with the fastest decoder available.
+
+    Unlike `response.json()` the encoding isn't guessed, the API always answers in UTF-8.
+    """
+    return json_backend.loads(response.content.decode(response.encoding or 'utf-8'))
+
+def command_resources(body):
+    return body['resources']
+
+def printer_resource(body):
+    return body
+
+def printer_resources(body):
+    return body['resources']
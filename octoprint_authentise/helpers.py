@@ -1,26 +1,105 @@
 # coding=utf-8
 from __future__ import absolute_import
 
+import cookielib
 import json
 import os
 import subprocess
+import threading
+import time
+from distutils.spawn import find_executable
 from urlparse import urljoin
 from uuid import uuid4
 
 import requests
+from concurrent import futures
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 
+from octoprint_authentise import decoding, transport
 
-def run_client_and_wait(settings, logger, args=None):
+
+def run_client_and_wait(settings, logger, args=None, timeout=None):
+    """Runs the client and returns its output, or None if it hasn't exited after `timeout` seconds"""
     try:
         process = run_client(settings, args, pipe=subprocess.PIPE)
-        output, _ = process.communicate()
-        return output.strip()
-    except subprocess.CalledProcessError as exception:
+    except (subprocess.CalledProcessError, OSError) as exception:
         logger.error("Error running client command `%s` using parameters: %s", exception, args)
         return
 
+    expired = threading.Event()
+    def _kill():
+        expired.set()
+        try:
+            process.kill()
+        except OSError:
+            pass
+
+    timer = threading.Timer(timeout, _kill) if timeout else None
+    if timer:
+        timer.daemon = True
+        timer.start()
+    try:
+        output, _ = process.communicate()
+    finally:
+        if timer:
+            timer.cancel()
+
+    if expired.is_set():
+        logger.warning("Killed client running with parameters %s after %ss", args, timeout)
+        return
+    return output.strip()
+
+class SingleFlightCache(object): #pylint: disable=too-few-public-methods
+    """Caches the result of `load` for `ttl` seconds.
+
+    Callers arriving while `load` is running wait for and share its result instead of calling it
+    again, whether or not they asked for a refresh. Falsy results and errors aren't cached.
+    """
+    def __init__(self, load, ttl):
+        self._load = load
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._value = None
+        self._expires = 0
+        self._pending = None
+
+    def get(self, refresh=False):
+        with self._lock:
+            if self._pending:
+                pending, loading = self._pending, False
+            elif self._value and not refresh and time.time() < self._expires:
+                return self._value
+            else:
+                pending, loading = futures.Future(), True
+                self._pending = pending
+
+        if not loading:
+            return pending.result()
+
+        try:
+            value = self._load()
+        except Exception as e: #pylint: disable=broad-except
+            with self._lock:
+                self._pending = None
+            pending.set_exception(e)
+            raise
+
+        with self._lock:
+            self._pending = None
+            if value:
+                self._value = value
+                self._expires = time.time() + self._ttl
+        pending.set_result(value)
+        return value
+
 DEVNULL = open(os.devnull, 'w')
 def run_client(settings, args=None, pipe=None):
+    if pipe==None:
+        pipe=DEVNULL
+    return subprocess.Popen(client_command(settings, args), stdout=pipe, stderr=pipe)
+
+def client_command(settings, args=None):
     command = []
     if isinstance(settings.get(["streamus_client_path"]), list):
         command.extend(settings.get(["streamus_client_path"]))
@@ -37,32 +116,82 @@ def run_client(settings, args=None, pipe=None):
     if args:
         command.extend(args)
 
-    if pipe==None:
-        pipe=DEVNULL
-    return subprocess.Popen(command, stdout=pipe, stderr=pipe)
+    return command
+
+NODE_IDENTITY_FILE = 'node_identity.json'
+
+def client_fingerprint(settings):
+    """Identifies the installed client and its configuration by path, mtime and size.
+
+    Output of the client cached under a fingerprint is stale as soon as the fingerprint changes.
+    """
+    if isinstance(settings.get(["streamus_client_path"]), list):
+        paths = list(settings.get(["streamus_client_path"]))
+    else:
+        paths = [settings.get(["streamus_client_path"])]
+    paths.append(settings.get(["streamus_config_path"]))
+
+    fingerprint = []
+    for path in paths:
+        path = (find_executable(path) or path) if path else path
+        try:
+            stat = os.stat(path) if path else None
+        except OSError:
+            stat = None
+        fingerprint.append([path, stat.st_mtime, stat.st_size] if stat else [path, None, None])
+    return fingerprint
+
+def load_node_identity(path, fingerprint):
+    """Returns the cached node uuid and version if they were cached under `fingerprint`"""
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+    except (IOError, ValueError):
+        return
+
+    if not isinstance(cached, dict) or cached.get('fingerprint') != fingerprint:
+        return
+    if not cached.get('node_uuid') or not cached.get('node_version'):
+        return
+    return cached
+
+def save_node_identity(path, fingerprint, node_uuid, node_version, logger):
+    cached = {
+        'fingerprint'   : fingerprint,
+        'node_uuid'     : node_uuid,
+        'node_version'  : node_version,
+    }
+    temporary_path = '{}.tmp'.format(path)
+    try:
+        with open(temporary_path, 'w') as f:
+            json.dump(cached, f)
+        os.rename(temporary_path, path)
+    except (IOError, OSError) as e:
+        logger.warning("Could not cache node identity in %s: %s", path, e)
 
 class ClaimNodeException(Exception):
     pass
 
-def claim_node(node_uuid, settings, logger):
-    _session = session(settings)
+def claim_node(node_uuid, settings, logger, get_claim_code):
+    """Claims the node for the account of the API key, asking `get_claim_code` for a claim code if it isn't yet"""
+    _http = transport.RequestPolicy(session(settings), settings)
 
     if not node_uuid:
         raise ClaimNodeException("No Authentise node uuid available to claim")
 
     url = urljoin(settings.get(["authentise_url"]), "client/{}/".format(node_uuid))
-    response = _session.get(url)
+    response = _http.get('auth', url)
     if response.ok:
         return
 
-    claim_code = run_client_and_wait(settings, args=['--connection-code'], logger=logger)
+    claim_code = get_claim_code()
     if claim_code:
         logger.info("Got claim code: %s", claim_code)
     else:
         raise ClaimNodeException("Could not get a claim code from Authentise")
 
     url = urljoin(settings.get(["authentise_url"]), "client/claim/{}/".format(claim_code))
-    response = _session.put(url)
+    response = _http.put('auth', url)
     logger.info("Response from - POST %s - %s - %s", url, response.status_code, response.text)
 
     if response.ok:
@@ -74,18 +203,18 @@ def claim_node(node_uuid, settings, logger):
 def login(settings, username, password, logger):
     url = '{}/sessions/'.format(settings.get(["authentise_user_url"]))
     payload = {"username": username, "password": password,}
-    response = requests.post(url, json=payload)
+    response = transport.RequestPolicy(anonymous_session(), settings).post('auth', url, json=payload)
     logger.info("Response from - POST %s - %s - %s", url, response.status_code, response.text)
 
     if response.ok:
         logger.info("Successfully logged in to user service: %s", username)
-        return response.status_code, json.loads(response.text), response.cookies
+        return response.status_code, decoding.decode(response), response.cookies
     elif response.status_code == 400:
         logger.warning("Failed to log in to user service for user %s", username)
     else:
         logger.error("Error logging in to user service for user %s", username)
 
-    return response.status_code, json.loads(response.text), None
+    return response.status_code, decoding.decode(response), None
 
 def create_api_token(settings, cookies, logger):
     if not cookies:
@@ -94,7 +223,8 @@ def create_api_token(settings, cookies, logger):
 
     url = '{}/api_tokens/'.format(settings.get(["authentise_user_url"]))
     payload = {"name": "Octoprint Token - {}".format(str(uuid4()))}
-    response = requests.post(url, json=payload, cookies=cookies)
+    response = transport.RequestPolicy(anonymous_session(), settings).post('auth', url, json=payload,
+                                                                           cookies=cookies)
     logger.info("Response from - POST %s - %s - %s", url, response.status_code, response.text)
 
     if response.ok:
@@ -104,12 +234,33 @@ def create_api_token(settings, cookies, logger):
     else:
         logger.error("Error creating api token for user")
 
-    return response.status_code, json.loads(response.text)
+    return response.status_code, decoding.decode(response)
 
 class SessionException(Exception):
     pass
 
+# Connection pooling shared by every request the plugin makes. The pool is sized for the command
+# pipeline workers plus the monitor, status and client threads all talking to the API at once
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 16
+# Only retry failures that happen before a request reaches the server, or reads of idempotent requests
+RETRY = Retry(total=3, connect=3, read=2, backoff_factor=0.2)
+
+_sessions_lock = threading.Lock()
+_api_session = None
+_api_session_credentials = None
+_anonymous_session = None
+
+def _new_session():
+    _session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=RETRY)
+    _session.mount('https://', adapter)
+    _session.mount('http://', adapter)
+    return _session
+
 def session(settings):
+    global _api_session, _api_session_credentials #pylint: disable=global-statement
+
     api_key = settings.get(['api_key'])
     api_secret = settings.get(['api_secret'])
 
@@ -119,6 +270,28 @@ def session(settings):
     if not api_secret:
         raise SessionException("No Authentise API secret available to claim node")
 
-    _session = requests.Session()
-    _session.auth = requests.auth.HTTPBasicAuth(api_key, api_secret)
-    return _session
+    with _sessions_lock:
+        if _api_session is None or _api_session_credentials != (api_key, api_secret):
+            _api_session = _new_session()
+            _api_session.auth = requests.auth.HTTPBasicAuth(api_key, api_secret)
+            _api_session_credentials = (api_key, api_secret)
+        return _api_session
+
+def anonymous_session():
+    """Shared session for the user service. It never stores cookies, callers pass them explicitly"""
+    global _anonymous_session #pylint: disable=global-statement
+
+    with _sessions_lock:
+        if _anonymous_session is None:
+            _anonymous_session = _new_session()
+            _anonymous_session.cookies.set_policy(cookielib.DefaultCookiePolicy(allowed_domains=[]))
+        return _anonymous_session
+
+def invalidate_sessions():
+    """Drops the shared sessions so the next request builds them with the current settings"""
+    global _api_session, _api_session_credentials, _anonymous_session #pylint: disable=global-statement
+
+    with _sessions_lock:
+        _api_session = None
+        _api_session_credentials = None
+        _anonymous_session = None
@@ -0,0 +1,43 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+OK = 'ok'
+TEMPERATURE = 'temperature'
+ERROR = 'error'
+BUSY = 'busy'
+POSITION = 'position'
+OTHER = 'other'
+
+LINE_TYPES = [OK, TEMPERATURE, ERROR, BUSY, POSITION, OTHER]
+
+ERROR_PREFIXES = ('Error:', 'error:', '!!')
+BUSY_PREFIXES = ('echo:busy', 'busy:')
+POSITION_PREFIXES = ('X:',)
+
+def _is_temperature_report(line):
+    # A report starts with a `T:` or `Tn:` field, so only the first few characters need looking at
+    if not line.startswith('T'):
+        return False
+    colon = line.find(':', 1, 6)
+    return colon == 1 or (colon > 1 and line[1:colon].isdigit())
+
+def classify(line):
+    """Returns the type of a printer response line, one of `LINE_TYPES`.
+
+    Only looks at the start of the line, so it is cheap enough to run on every line before handing
+    it to a parser for its type. A temperature line may still fail to parse.
+    """
+    acknowledged = line.startswith('ok')
+    rest = line[2:].lstrip() if acknowledged else line
+
+    if _is_temperature_report(rest):
+        return TEMPERATURE
+    if rest.startswith(ERROR_PREFIXES):
+        return ERROR
+    if rest.startswith(BUSY_PREFIXES):
+        return BUSY
+    if rest.startswith(POSITION_PREFIXES):
+        return POSITION
+    if acknowledged:
+        return OK
+    return OTHER
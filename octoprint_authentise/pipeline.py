@@ -0,0 +1,252 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import collections
+import itertools
+import logging
+import Queue
+import sys
+import threading
+import time
+
+from concurrent import futures
+
+# Priorities of calls run by a `PriorityDispatcher`, the lowest goes first
+EMERGENCY = 0
+CONTROL = 1
+
+# Commands that skip the queue, and have everything queued behind them dropped
+EMERGENCY_STOP_COMMANDS = ('M112',)
+
+def is_emergency_stop(cmd):
+    parts = cmd.split(None, 1)
+    return bool(parts) and parts[0].upper() in EMERGENCY_STOP_COMMANDS
+
+class PipelineFullException(Exception):
+    pass
+
+class CommandPipeline(object): #pylint: disable=too-many-instance-attributes
+    """Hands items to `send` on a pool of worker threads.
+
+    Every key (a printer uri) is pinned to one worker so items for the same printer are sent in
+    the order they were submitted, while different printers are sent concurrently. Items that
+    arrive within `batch_window` seconds of each other are coalesced and handed to `send` as a
+    single list of up to `batch_size` items.
+    """
+    def __init__(self, send, on_error=None, workers=4, max_size=256, #pylint: disable=too-many-arguments
+                 batch_window=0, batch_size=1, name="comm._pipeline"):
+        self._logger = logging.getLogger(__name__)
+
+        self._send = send
+        self._on_error = on_error
+        self._batch_window = batch_window or 0
+        self._batch_size = max(batch_size or 1, 1)
+        self._name = name
+        self._queues = [Queue.Queue(maxsize=max_size) for _ in range(max(workers, 1))]
+        # Keeps submissions out of a queue while `discard` takes it apart and puts it back together
+        self._submit_lock = threading.Lock()
+        # Items per key that are queued or being sent
+        self._pending = collections.Counter()
+        self._threads = []
+        self._running = False
+
+    def start(self):
+        self._running = True
+        for index, queue in enumerate(self._queues):
+            thread = threading.Thread(target=self._work, args=(queue,), name="{}.{}".format(self._name, index))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._running = False
+        for queue in self._queues:
+            try:
+                queue.put_nowait(None)
+            except Queue.Full:
+                pass
+        self._threads = []
+
+    def submit(self, key, item):
+        if not self._running:
+            raise PipelineFullException("Command pipeline is not running")
+
+        queue = self._queues[hash(key) % len(self._queues)]
+        try:
+            with self._submit_lock:
+                queue.put_nowait((key, item))
+                self._pending[key] += 1
+        except Queue.Full:
+            raise PipelineFullException("Command pipeline is full, could not queue {}".format(item))
+
+    def join(self):
+        for queue in self._queues:
+            queue.join()
+
+    def pending(self, key):
+        """Returns how many items for `key` are queued or still being sent"""
+        with self._submit_lock:
+            return self._pending[key]
+
+    def discard(self, key):
+        """Drops the items queued for `key` that no worker has picked up yet, returns how many"""
+        queue = self._queues[hash(key) % len(self._queues)]
+        kept = []
+        dropped = 0
+        with self._submit_lock:
+            while True:
+                try:
+                    entry = queue.get_nowait()
+                except Queue.Empty:
+                    break
+                if entry is not None and entry[0] == key:
+                    dropped += 1
+                else:
+                    kept.append(entry)
+                queue.task_done()
+
+            # Items for other keys go back in the order they were queued
+            for entry in kept:
+                queue.put_nowait(entry)
+            self._done(key, dropped)
+        return dropped
+
+    def _done(self, key, count):
+        self._pending[key] -= count
+        if self._pending[key] <= 0:
+            del self._pending[key]
+
+    def _collect(self, queue, first):
+        entries = [first]
+        if first is None:
+            return entries
+
+        deadline = time.time() + self._batch_window
+        while len(entries) < self._batch_size:
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    entry = queue.get(timeout=remaining)
+                else:
+                    entry = queue.get_nowait()
+            except Queue.Empty:
+                break
+
+            entries.append(entry)
+            if entry is None:
+                break
+        return entries
+
+    def _send_entries(self, entries):
+        batches = collections.OrderedDict()
+        for entry in entries:
+            if entry is None:
+                break
+            key, item = entry
+            batches.setdefault(key, []).append(item)
+
+        for key, items in batches.items():
+            if not self._running:
+                break
+            try:
+                self._send(key, items)
+            except Exception as e: #pylint: disable=broad-except
+                if self._on_error:
+                    self._on_error(key, items, e)
+                else:
+                    self._logger.exception("Error sending %s for %s", items, key)
+
+    def _work(self, queue):
+        while True:
+            entries = self._collect(queue, queue.get())
+            try:
+                self._send_entries(entries)
+            finally:
+                with self._submit_lock:
+                    for entry in entries:
+                        if entry is not None:
+                            self._done(entry[0], 1)
+                for _ in entries:
+                    queue.task_done()
+
+            if None in entries or not self._running:
+                return
+
+class PriorityDispatcher(object):
+    """Runs calls on a few worker threads of their own, most urgent first.
+
+    Emergency stops and job control are kept out of the `CommandPipeline` so they never wait
+    behind queued bulk commands, or for a pipeline worker busy sending them. Calls of the same
+    priority run in the order they were submitted, and `submit` returns a future of the result.
+    """
+    def __init__(self, workers=2, on_error=None, name="comm._dispatcher"):
+        self._logger = logging.getLogger(__name__)
+
+        self._on_error = on_error
+        self._workers = max(workers, 1)
+        self._name = name
+        self._queue = Queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._running = False
+
+    def start(self):
+        self._running = True
+        for index in range(self._workers):
+            thread = threading.Thread(target=self._work, name="{}.{}".format(self._name, index))
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        # Calls still queued are cancelled, only the ones already running finish
+        self._running = False
+        while True:
+            try:
+                _, _, entry = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            if entry is not None:
+                entry[0].cancel()
+            self._queue.task_done()
+
+        for _ in range(self._workers):
+            self._queue.put((sys.maxint, next(self._sequence), None))
+
+    def submit(self, priority, call, *args):
+        if not self._running:
+            raise PipelineFullException("Control dispatcher is not running")
+
+        future = futures.Future()
+        self._queue.put((priority, next(self._sequence), (future, call, args)))
+        return future
+
+    def dispatch(self, priority, call, *args):
+        """Like `submit`, but logs instead of raising when stopped, returns whether `call` was queued"""
+        try:
+            self.submit(priority, call, *args)
+        except PipelineFullException as e:
+            self._logger.warning("Not running %s: %s", call.__name__, e)
+            return False
+        return True
+
+    def join(self):
+        self._queue.join()
+
+    def _work(self):
+        while True:
+            _, _, entry = self._queue.get()
+            try:
+                if entry is None:
+                    return
+                future, call, args = entry
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(call(*args))
+                except Exception as e: #pylint: disable=broad-except
+                    if self._on_error:
+                        self._on_error(call, e)
+                    else:
+                        self._logger.exception("Error running %s", call)
+                    future.set_exception(e)
+            finally:
+                self._queue.task_done()
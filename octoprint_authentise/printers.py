@@ -0,0 +1,73 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+
+def parse_temperatures(temps):
+    """Returns the tool and bed temperatures from the `temperatures` field of a printer resource"""
+    tools = {0: [
+            temps['extruder1'].get('current') if temps.get('extruder1') else None,
+            temps['extruder1'].get('target') if temps.get('extruder1') else None,
+        ]}
+
+    bed = [
+            temps['bed'].get('current') if temps.get('bed') else None,
+            temps['bed'].get('target') if temps.get('bed') else None,
+            ] if temps.get('bed') else None
+
+    return tools, bed
+
+class PrinterStatus(object): #pylint: disable=too-many-instance-attributes
+    """Last known state of one Authentise printer instance driven by this plugin"""
+    def __init__(self, uri, port=None, baud_rate=None, name=None):
+        self.uri = uri
+        self.port = port
+        self.baud_rate = baud_rate
+        self.name = name
+
+        self.status = None
+        self.print_status = None
+        self.print_job_uri = None
+        self.tools = None
+        self.bed = None
+        self.progress = None
+        self.updated = None
+
+    def update(self, response_data, now):
+        self.status = response_data['status'].lower()
+        self.port = response_data.get('port', self.port)
+        self.baud_rate = response_data.get('baud_rate', self.baud_rate)
+        self.name = response_data.get('name', self.name)
+
+        current_print = response_data['current_print']
+        if current_print and current_print['status'].lower() != 'new':
+            self.print_status = current_print['status'].lower()
+            self.print_job_uri = current_print.get('job_uri')
+            self.progress = {
+                'percent_complete' : current_print.get('percent_complete'),
+                'elapsed'          : current_print.get('elapsed'),
+                'remaining'        : current_print.get('remaining'),
+            }
+        else:
+            self.print_status = None
+            self.print_job_uri = None
+            self.progress = None
+
+        if response_data.get('temperatures') is not None:
+            self.tools, self.bed = parse_temperatures(response_data['temperatures'])
+
+        self.updated = now
+
+    def as_dict(self):
+        return {
+            'uri'           : self.uri,
+            'port'          : self.port,
+            'baud_rate'     : self.baud_rate,
+            'name'          : self.name,
+            'status'        : self.status,
+            'print_status'  : self.print_status,
+            'print_job_uri' : self.print_job_uri,
+            'tools'         : self.tools,
+            'bed'           : self.bed,
+            'progress'      : self.progress,
+            'updated'       : self.updated,
+        }
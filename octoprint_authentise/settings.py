@@ -3,6 +3,8 @@ from __future__ import absolute_import
 
 import octoprint.plugin
 
+from octoprint_authentise import helpers, transport
+
 
 class SettingsPlugin(octoprint.plugin.SettingsPlugin):
     def get_settings_defaults(self):
@@ -13,5 +15,40 @@ class SettingsPlugin(octoprint.plugin.SettingsPlugin):
             authentise_user_url='https://users.authentise.com',
             streamus_client_path='authentise',
             streamus_config_path=None,
+            client_probe_timeout=10,
+            client_control_channel=True,
+            client_query_timeout=5,
+            client_restart_backoff=1,
+            client_restart_max_backoff=30,
+            client_stderr_lines=200,
+            client_stop_timeout=5,
+            connect_timeout=60,
+            connection_code_ttl=60,
             frame_src='https://app.authentise.com/#/models',
+            command_workers=4,
+            control_workers=2,
+            command_queue_size=256,
+            command_batch_window=0.05,
+            command_batch_size=32,
+            command_poll_interval=0.5,
+            command_poll_backoff=2,
+            command_poll_max_interval=8,
+            command_expiry=120,
+            status_interval_min=1,
+            status_interval_max=60,
+            status_streaming=False,
+            multi_printer=False,
+            status_stream_timeout=60,
+            temperature_cache_max_age=5,
+            http_connect_timeout=transport.HTTP_CONNECT_TIMEOUT,
+            http_read_timeouts=dict(transport.HTTP_READ_TIMEOUTS),
+            http_hedging=True,
+            http_rate_limit=transport.HTTP_RATE_LIMIT,
+            http_rate_burst=transport.HTTP_RATE_BURST,
         )
+
+    def on_settings_save(self, data):
+        octoprint.plugin.SettingsPlugin.on_settings_save(self, data)
+
+        if any(key in data for key in ['api_key', 'api_secret', 'authentise_url', 'authentise_user_url']):
+            helpers.invalidate_sessions()
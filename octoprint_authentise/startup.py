@@ -2,24 +2,95 @@
 #pylint: disable=no-member
 from __future__ import absolute_import
 
+import os
+
 import octoprint.plugin
+from concurrent import futures
+
+from octoprint_authentise import control, helpers
+
+
+def _resolved(value):
+    result = futures.Future()
+    result.set_result(value)
+    return result
+
+class StartupPlugin(octoprint.plugin.StartupPlugin, octoprint.plugin.ShutdownPlugin):
+    """Finds the node uuid and version of the installed client.
+
+    Both are futures until the client has answered. A probe gives up on the client, and kills
+    it, after `client_probe_timeout` seconds. Reading `node_uuid` or `node_version` waits for the
+    answer, at most that long, and a probe that timed out or failed reads as None from then on.
+    """
+    _node_uuid = None
+    _node_version = None
+    _node_identity_cached = None
+
+    @property
+    def node_uuid(self):
+        return self._probe_result('_node_uuid', 'node uuid')
 
-from octoprint_authentise import helpers
+    @node_uuid.setter
+    def node_uuid(self, value):
+        self._node_uuid = _resolved(value)
 
+    @property
+    def node_version(self):
+        return self._probe_result('_node_version', 'node version')
 
-class StartupPlugin(octoprint.plugin.StartupPlugin):
-    node_uuid = None
-    node_version = None
+    @node_version.setter
+    def node_version(self, value):
+        self._node_version = _resolved(value)
 
     def on_after_startup(self):
-        self.node_version = helpers.run_client_and_wait(self._settings, args=['--version'], logger=self._logger)
-        if self.node_version:
-            self._logger.info("Found node version: %s", self.node_version)
-        else:
-            self._logger.warning("Could not find node version")
+        # Asking the client for its version and uuid means starting it up, so the answers are
+        # cached on disk and only asked for again, in the background, once the client changes
+        identity_path = os.path.join(self.get_plugin_data_folder(), helpers.NODE_IDENTITY_FILE)
+        fingerprint = helpers.client_fingerprint(self._settings)
+
+        identity = helpers.load_node_identity(identity_path, fingerprint)
+        if identity:
+            self.node_version = identity['node_version']
+            self.node_uuid = identity['node_uuid']
+            self._logger.info("Found cached node version: %s", identity['node_version'])
+            self._logger.info("Found cached node uuid: %s", identity['node_uuid'])
+            return
+
+        executor = futures.ThreadPoolExecutor(max_workers=2)
+        self._node_version = executor.submit(self._probe_client, 'version', 'node version')
+        self._node_uuid = executor.submit(self._probe_client, 'node-uuid', 'node uuid')
+        self._node_identity_cached = executor.submit(self._cache_node_identity, identity_path, fingerprint,
+                                                     self._node_uuid, self._node_version)
+        executor.shutdown(wait=False)
+
+    def on_shutdown(self): #pylint: disable=no-self-use
+        control.close_channels()
 
-        self.node_uuid = helpers.run_client_and_wait(self._settings, args=['--node-uuid'], logger=self._logger)
-        if self.node_uuid:
-            self._logger.info("Found node uuid: %s", self.node_uuid)
+    def _probe_client(self, query, name):
+        value = control.query_client(self._settings, query, self._logger,
+                                     timeout=self._settings.get_float(['client_probe_timeout']))
+        if value:
+            self._logger.info("Found %s: %s", name, value)
         else:
-            self._logger.warning("Could not find node uuid")
+            self._logger.warning("Could not find %s", name)
+        return value
+
+    def _cache_node_identity(self, identity_path, fingerprint, node_uuid, node_version):
+        node_uuid, node_version = node_uuid.result(), node_version.result()
+        if node_version and node_uuid:
+            helpers.save_node_identity(identity_path, fingerprint, node_uuid, node_version, self._logger)
+
+    def _probe_result(self, attribute, name):
+        probe = getattr(self, attribute)
+        if probe is None:
+            return
+        try:
+            return probe.result(timeout=self._settings.get_float(['client_probe_timeout']))
+        except futures.TimeoutError:
+            self._logger.warning("Timed out waiting for the client to report its %s", name)
+        except Exception: #pylint: disable=broad-except
+            self._logger.exception("Error asking the client for its %s", name)
+
+        # Don't make every later read wait all over again, unless a new probe was started since
+        if getattr(self, attribute) is probe:
+            setattr(self, attribute, _resolved(None))
@@ -0,0 +1,95 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import logging
+import threading
+
+import requests
+
+from octoprint_authentise import decoding
+
+EVENT_STREAM_CONTENT_TYPE = 'text/event-stream'
+
+def iter_events(lines):
+    """Yields the data of each server-sent event found in `lines`"""
+    data = []
+    for line in lines:
+        if not line:
+            if data:
+                yield '\n'.join(data)
+            data = []
+        elif line.startswith('data:'):
+            data.append(line[len('data:'):].lstrip(' '))
+    if data:
+        yield '\n'.join(data)
+
+class PrinterStatusStream(object): #pylint: disable=too-many-instance-attributes
+    """Subscribes to server-sent printer status events on a background thread.
+
+    The stream is requested from the printer resource itself, and the server sends the current
+    representation as its first event followed by one event per change. Each event's JSON payload
+    is passed to `on_data`. `on_failure` is called with a reason once the server turns out not to
+    support streaming, or the stream ends or breaks for any reason other than `stop`.
+    """
+    def __init__(self, session, url, on_data, on_failure, read_timeout=None):
+        self._logger = logging.getLogger(__name__)
+
+        self._session = session
+        self._url = url
+        self._on_data = on_data
+        self._on_failure = on_failure
+        self._read_timeout = read_timeout
+
+        self._response = None
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="comm._status_stream")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        response = self._response
+        if response is not None:
+            response.close()
+
+    def _run(self):
+        try:
+            reason = self._stream()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            reason = 'Printer status stream from {} broke: {}'.format(self._url, e)
+        except Exception as e: #pylint: disable=broad-except
+            # Whatever went wrong, polling has to take over from here
+            self._logger.exception("Error handling printer status stream from %s", self._url)
+            reason = 'Printer status stream from {} failed: {}'.format(self._url, e)
+
+        if self._running:
+            self._running = False
+            self._on_failure(reason)
+
+    def _stream(self):
+        self._response = self._session.get(self._url,
+                                           headers={'Accept': EVENT_STREAM_CONTENT_TYPE},
+                                           stream=True,
+                                           timeout=self._read_timeout)
+        try:
+            if not self._response.ok:
+                return 'Unable to stream printer status from {}: {}'.format(self._url, self._response.status_code)
+
+            content_type = self._response.headers.get('Content-Type', '')
+            if not content_type.startswith(EVENT_STREAM_CONTENT_TYPE):
+                return 'Printer status streaming is not supported by {}'.format(self._url)
+
+            # Events are small and may not be chunked, read them as they arrive instead of in blocks
+            for event in iter_events(self._response.iter_lines(chunk_size=1)):
+                if not self._running:
+                    return
+                self._on_data(decoding.printer_resource(decoding.loads(event)))
+
+            return 'Printer status stream from {} ended'.format(self._url)
+        finally:
+            self._response.close()
+            self._response = None
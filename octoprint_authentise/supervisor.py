@@ -0,0 +1,146 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import collections
+import logging
+import signal
+import subprocess
+import threading
+import time
+
+from octoprint_authentise import helpers
+
+CLIENT_RESTART_BACKOFF = 1
+CLIENT_RESTART_MAX_BACKOFF = 30
+CLIENT_STABLE_AFTER = 60
+CLIENT_STDERR_LINES = 200
+CLIENT_STOP_TIMEOUT = 5
+# Seconds to wait for the rest of an exited client's stderr, a child it left behind may hold it open
+CLIENT_STDERR_DRAIN_TIMEOUT = 2
+
+class ClientSupervisor(object): #pylint: disable=too-many-instance-attributes
+    """Runs the streaming client and restarts it whenever it exits.
+
+    A client that ran for at least `stable_after` seconds is restarted straight away. One that
+    keeps exiting sooner than that is restarted after `backoff` seconds, doubling on every exit
+    up to `max_backoff`. The last `stderr_lines` lines the client wrote to stderr are kept, and
+    `on_exit` is called with the exit code and those lines whenever the client exits unexpectedly.
+    """
+    def __init__(self, command, on_exit=None, backoff=CLIENT_RESTART_BACKOFF, #pylint: disable=too-many-arguments
+                 max_backoff=CLIENT_RESTART_MAX_BACKOFF, stable_after=CLIENT_STABLE_AFTER,
+                 stderr_lines=CLIENT_STDERR_LINES, name="comm._client_supervisor"):
+        self._logger = logging.getLogger(__name__)
+
+        self._command = command
+        self._on_exit = on_exit
+        self._backoff = backoff
+        self._max_backoff = max(max_backoff, backoff)
+        self._stable_after = stable_after
+        self._name = name
+
+        self._stderr = collections.deque(maxlen=stderr_lines)
+        self._stopped = threading.Event()
+        self._thread = None
+        self._process = None
+        self._stderr_reader = None
+
+        self._starts = 0
+        self._crashes = 0
+        self._last_exit_code = None
+        self._last_restart_latency = None
+        self._started_at = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._supervise, name=self._name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=CLIENT_STOP_TIMEOUT):
+        """Interrupts the client and waits up to `timeout` seconds for it to exit before killing it.
+
+        With a `timeout` of None the client is only interrupted.
+        """
+        self._stopped.set()
+        process = self._process
+        if process and process.poll() is None:
+            process.send_signal(signal.SIGINT)
+            if timeout is None:
+                return
+            deadline = time.time() + timeout
+            while process.poll() is None and time.time() < deadline:
+                time.sleep(0.05)
+            if process.poll() is None:
+                self._logger.warning("Authentise client did not exit within %ss, killing it", timeout)
+                process.kill()
+
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def stderr(self):
+        return list(self._stderr)
+
+    def metrics(self):
+        process = self._process
+        return {
+            'running'               : bool(process and process.poll() is None),
+            'pid'                   : process.pid if process else None,
+            'starts'                : self._starts,
+            'crashes'               : self._crashes,
+            'last_exit_code'        : self._last_exit_code,
+            'last_restart_latency'  : self._last_restart_latency,
+            'uptime'                : time.time() - self._started_at if self._started_at else None,
+        }
+
+    def _spawn(self):
+        process = subprocess.Popen(self._command, stdout=helpers.DEVNULL, stderr=subprocess.PIPE)
+        reader = threading.Thread(target=self._read_stderr, args=(process,), name="{}.stderr".format(self._name))
+        reader.daemon = True
+        reader.start()
+
+        self._process = process
+        self._stderr_reader = reader
+        self._starts += 1
+        self._started_at = time.time()
+        return process
+
+    def _read_stderr(self, process):
+        for line in iter(process.stderr.readline, ''):
+            self._stderr.append(line.rstrip())
+
+    def _supervise(self):
+        delay = 0
+        exited_at = None
+        while not self._stopped.is_set():
+            try:
+                process = self._spawn()
+            except OSError as e:
+                self._logger.error("Could not start the Authentise client: %s", e)
+                process = None
+            else:
+                # stop() may have run before the process was there to interrupt
+                if self._stopped.is_set():
+                    process.send_signal(signal.SIGINT)
+                if exited_at is not None:
+                    self._last_restart_latency = time.time() - exited_at
+                    self._logger.info("Restarted the Authentise client in %.2fs", self._last_restart_latency)
+                process.wait()
+                # Report the crash with everything the client wrote before exiting
+                self._stderr_reader.join(CLIENT_STDERR_DRAIN_TIMEOUT)
+
+            if self._stopped.is_set():
+                return
+
+            exited_at = time.time()
+            self._crashes += 1
+            self._last_exit_code = process.returncode if process else None
+            self._logger.warning("Authentise client exited with %s, last output:\n%s",
+                                 self._last_exit_code, '\n'.join(self.stderr()[-20:]))
+            if self._on_exit:
+                self._on_exit(self._last_exit_code, self.stderr())
+
+            if process and exited_at - self._started_at >= self._stable_after:
+                delay = 0
+            else:
+                delay = min(delay * 2, self._max_backoff) if delay else self._backoff
+            self._stopped.wait(delay)
@@ -0,0 +1,94 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+# First letter of the heaters in a temperature report: tools `T`, `T0`, `T1`..., bed `B`, chamber `C`
+HEATER_PREFIXES = frozenset('TBC')
+
+def parse_temps(line): #pylint: disable=too-many-branches, too-many-locals
+    """Parses a temperature report such as `ok T:210.0 /210.0 B:60.1 /60.0 T0:210.0 /210.0 T1:25 /0`.
+
+    Returns a dict with a `tools` list indexed by extruder number, and `bed` and `chamber` entries
+    that are None when the report doesn't mention them. Returns None if the line isn't a
+    temperature report, which has to start with a `T` or `Tn` field after an optional `ok`.
+
+    The line is tokenized on whitespace in a single pass. Tokens that aren't heater fields, like
+    `@:64`, `B@:127` or `RAW0:3922`, are skipped.
+    """
+    tokens = line.split()
+    index, count = (1, len(tokens)) if tokens and tokens[0] == 'ok' else (0, len(tokens))
+    if index == count or tokens[index][0] != 'T':
+        return
+
+    active = None
+    numbered = {}
+    bed = chamber = None
+    while index < count:
+        token = tokens[index]
+        index += 1
+        if token[0] not in HEATER_PREFIXES:
+            continue
+        name, separator, actual = token.partition(':')
+        if not separator or (len(name) > 1 and (name[0] != 'T' or not name[1:].isdigit())):
+            continue
+
+        # The value may be separated from its heater by a space, and the target may be attached
+        # to the value or separated from it by spaces: `T:210/210`, `T: 210 /210` or `T:210 / 210`
+        if not actual and index < count:
+            actual = tokens[index]
+            index += 1
+        target = None
+        if '/' in actual:
+            actual, _, target = actual.partition('/')
+        elif index < count and tokens[index][0] == '/':
+            target = tokens[index][1:]
+            index += 1
+            if not target and index < count:
+                target = tokens[index]
+                index += 1
+
+        try:
+            temperature = {'actual': float(actual), 'target': float(target) if target else None}
+        except ValueError:
+            return
+
+        if name == 'T':
+            active = active or temperature
+        elif name == 'B':
+            bed = bed or temperature
+        elif name == 'C':
+            chamber = chamber or temperature
+        else:
+            numbered.setdefault(int(name[1:]), temperature)
+
+    # `T` is the active tool. It only stands in for the first extruder if the report has no `T0`
+    if active and 0 not in numbered:
+        numbered[0] = active
+    if len(numbered) == 1 and 0 in numbered:
+        tools = [numbered[0]]
+    else:
+        tools = [numbered.get(number, {'actual': None, 'target': None}) for number in range(max(numbered) + 1)] if numbered else []
+
+    return {'tools': tools, 'bed': bed, 'chamber': chamber}
+
+def format_temps(tools, bed):
+    """Formats tool and bed temperatures, as `{0: [actual, target]}` and `[actual, target]`, as a
+    Marlin style temperature report like `ok T:210.0 /210.0 B:60.0 /60.0 T0:210.0 /210.0`.
+
+    Returns None unless the first tool's temperature is known.
+    """
+    def _field(heater, temperature):
+        actual, target = temperature
+        if target is None:
+            return '{}:{:.1f}'.format(heater, actual)
+        return '{}:{:.1f} /{:.1f}'.format(heater, actual, target)
+
+    if not tools or not tools.get(0) or tools[0][0] is None:
+        return
+
+    fields = ['ok', _field('T', tools[0])]
+    if bed and bed[0] is not None:
+        fields.append(_field('B', bed))
+    if len(tools) > 1:
+        fields.extend(_field('T{}'.format(number), temperature) for number, temperature in sorted(tools.items())
+                      if temperature and temperature[0] is not None)
+    return ' '.join(fields)
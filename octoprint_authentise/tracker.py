@@ -0,0 +1,167 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import collections
+import heapq
+import itertools
+import threading
+
+COMMAND_POLL_INTERVAL = 0.5
+COMMAND_POLL_BACKOFF = 2
+COMMAND_POLL_MAX_INTERVAL = 8
+COMMAND_EXPIRY = 120
+
+# Command statuses that will never produce a response
+COMMAND_FAILED_STATUSES = ['error', 'printer_offline']
+
+class CommandTracker(object): #pylint: disable=too-many-instance-attributes
+    """Table of commands sent to a printer that are still waiting for a response.
+
+    Commands are keyed by uri and kept in submission order. Responses are handed out in that same
+    order, so a command that resolves early waits for the ones sent before it.
+
+    Polls are scheduled on a heap keyed by each command's next poll time. The first poll happens
+    `poll_interval` seconds after the command is added and the gap grows by `backoff` after every
+    poll, up to `max_interval`. Commands without a response after `expiry` seconds are dropped.
+
+    `wait` lets a reader sleep until there is something to do: a response to hand out, a newly
+    added command, or the next time an outstanding command is due for polling.
+    """
+    def __init__(self, poll_interval=COMMAND_POLL_INTERVAL, backoff=COMMAND_POLL_BACKOFF,
+                 max_interval=COMMAND_POLL_MAX_INTERVAL, expiry=COMMAND_EXPIRY):
+        self._poll_interval = poll_interval
+        self._backoff = max(backoff, 1)
+        self._max_interval = max(max_interval, poll_interval)
+        self._expiry = expiry
+
+        self._condition = threading.Condition(threading.Lock())
+        self._commands = collections.OrderedDict()
+        self._schedule = []
+        self._sequence = itertools.count()
+        self._resolved = collections.deque()
+        self._stopped = False
+
+    def __len__(self):
+        with self._condition:
+            return len(self._commands) + len(self._resolved)
+
+    def add(self, uri, now):
+        with self._condition:
+            command = {
+                'uri'           : uri,
+                'start_time'    : now,
+                'next_poll'     : None,
+                'interval'      : self._poll_interval,
+                'result'        : None,
+                'done'          : False,
+            }
+            self._commands[uri] = command
+            self._schedule_poll(command, now)
+            self._condition.notify_all()
+
+    def add_resolved(self, resource):
+        """Queues a response that needs no polling behind the commands still waiting for theirs"""
+        with self._condition:
+            key = ('resolved', next(self._sequence))
+            self._commands[key] = {
+                'uri'           : key,
+                'start_time'    : None,
+                'next_poll'     : None,
+                'interval'      : None,
+                'result'        : resource,
+                'done'          : True,
+            }
+            self._flush()
+            self._condition.notify_all()
+
+    def due(self, now):
+        """Returns the uris of commands that should be polled now, dropping expired ones.
+
+        The returned commands are scheduled for their next poll straight away, so a failed poll
+        simply backs off.
+        """
+        with self._condition:
+            uris = []
+            while self._schedule and self._schedule[0][0] <= now:
+                next_poll, _, uri = heapq.heappop(self._schedule)
+                command = self._commands.get(uri)
+                if not command or command['done'] or command['next_poll'] != next_poll:
+                    continue
+
+                if now - command['start_time'] >= self._expiry:
+                    del self._commands[uri]
+                    continue
+
+                uris.append(uri)
+                command['interval'] = min(command['interval'] * self._backoff, self._max_interval)
+                self._schedule_poll(command, now)
+            self._flush()
+            return uris
+
+    def update(self, resources):
+        """Records the command resources returned by the API"""
+        with self._condition:
+            for resource in resources:
+                command = self._commands.get(resource['uri'])
+                if not command:
+                    continue
+
+                status = resource['status']
+                if status == 'ok':
+                    command['result'] = resource
+                    command['done'] = True
+                elif status in COMMAND_FAILED_STATUSES:
+                    command['done'] = True
+            self._flush()
+
+    def pop(self):
+        """Returns the next resolved command resource in submission order, or None"""
+        with self._condition:
+            return self._resolved.popleft() if self._resolved else None
+
+    def clear(self):
+        with self._condition:
+            self._commands.clear()
+            self._resolved.clear()
+            del self._schedule[:]
+
+    def start(self):
+        with self._condition:
+            self._stopped = False
+
+    def stop(self):
+        """Wakes up and releases any reader blocked in `wait`"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def wait(self, now, timeout=None):
+        """Blocks until a response is ready, a command is added or the next command is due.
+
+        Returns immediately if something is already due or the tracker is stopped. `timeout`
+        caps how long to block.
+        """
+        with self._condition:
+            if self._stopped or self._resolved:
+                return
+
+            if self._schedule:
+                remaining = self._schedule[0][0] - now
+                if remaining <= 0:
+                    return
+                timeout = remaining if timeout is None else min(timeout, remaining)
+
+            self._condition.wait(timeout)
+
+    def _schedule_poll(self, command, now):
+        command['next_poll'] = min(now + command['interval'], command['start_time'] + self._expiry)
+        heapq.heappush(self._schedule, (command['next_poll'], next(self._sequence), command['uri']))
+
+    def _flush(self):
+        while self._commands:
+            uri, command = next(self._commands.iteritems())
+            if not command['done']:
+                return
+            del self._commands[uri]
+            if command['result']:
+                self._resolved.append(command['result'])
@@ -0,0 +1,289 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import collections
+import email.utils
+import logging
+import threading
+import time
+import urlparse
+
+from concurrent import futures
+
+HTTP_CONNECT_TIMEOUT = 3.05
+# Seconds to wait for a response to start arriving, by kind of request
+HTTP_READ_TIMEOUTS = {
+    'status'    : 10,
+    'command'   : 10,
+    'printers'  : 30,
+    'auth'      : 15,
+    'default'   : 30,
+}
+
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.05
+HEDGE_WINDOW = 200
+HEDGE_WORKERS = 8
+
+# Requests a second allowed to each API host, and how many can go out at once after a quiet spell
+HTTP_RATE_LIMIT = 10
+HTTP_RATE_BURST = 20
+# How many times a request answered with a 429 is sent again, and the longest wait allowed between
+RATE_LIMIT_RETRIES = 2
+RETRY_AFTER_DEFAULT = 1
+RETRY_AFTER_MAX = 60
+# Longest a job control request is held back by a Retry-After, cancelling a print can't wait a minute
+CONTROL_MAX_HOLD = 1
+
+# Priorities of requests waiting on the rate limit, the lowest goes first
+CONTROL = 0
+NORMAL = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {
+    CONTROL     : 'control',
+    NORMAL      : 'normal',
+    BACKGROUND  : 'background',
+}
+
+def timeout(settings, endpoint):
+    """Returns the `(connect, read)` timeout for a kind of request, as passed to `requests`"""
+    read_timeouts = dict(HTTP_READ_TIMEOUTS)
+    read_timeouts.update(settings.get(['http_read_timeouts']) or {})
+    connect_timeout = settings.get_float(['http_connect_timeout']) or HTTP_CONNECT_TIMEOUT
+    return connect_timeout, read_timeouts.get(endpoint, read_timeouts['default'])
+
+def retry_after(response):
+    """Returns how many seconds a 429 response asks to wait, from its `Retry-After` header"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return RETRY_AFTER_DEFAULT
+    try:
+        seconds = float(value)
+    except ValueError:
+        parsed = email.utils.parsedate_tz(value)
+        if not parsed:
+            return RETRY_AFTER_DEFAULT
+        seconds = email.utils.mktime_tz(parsed) - time.time()
+    return min(max(seconds, 0), RETRY_AFTER_MAX)
+
+class RateLimiter(object): #pylint: disable=too-many-instance-attributes
+    """Token bucket shared by every request to one API host.
+
+    Requests take a token each, tokens come back at `rate` a second up to `burst`. A request that
+    finds the bucket empty waits, and waiting requests get their token in order of priority, so a
+    `CONTROL` request is never stuck behind `BACKGROUND` polls. After a 429 nothing else is sent
+    until its `Retry-After` has passed, except `CONTROL` requests, which are held at most
+    `CONTROL_MAX_HOLD` seconds. A `rate` of 0 or less turns the limit off, only `Retry-After` is
+    honoured then.
+    """
+    def __init__(self, rate=HTTP_RATE_LIMIT, burst=HTTP_RATE_BURST):
+        self._rate = float(rate)
+        self._burst = max(burst, 1)
+        self._tokens = float(self._burst)
+        self._updated = time.time()
+        self._blocked_until = 0
+        self._condition = threading.Condition()
+        self._waiting = collections.Counter()
+
+        self._throttled = 0
+        self._waits = {priority: {'requests': 0, 'waited': 0, 'total_wait': 0.0, 'max_wait': 0.0}
+                       for priority in PRIORITY_NAMES}
+
+    def acquire(self, priority=NORMAL):
+        """Blocks until a request of `priority` may be sent, returns how long that took"""
+        started = time.time()
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    delay = self._delay(priority, started)
+                    if not delay:
+                        break
+                    self._condition.wait(delay)
+                self._tokens -= 1
+            finally:
+                self._waiting[priority] -= 1
+                self._condition.notify_all()
+
+            waited = time.time() - started
+            self._record(priority, waited)
+        return waited
+
+    def defer(self, seconds):
+        """Holds every request for `seconds`, as asked by a 429 response"""
+        with self._condition:
+            self._throttled += 1
+            self._blocked_until = max(self._blocked_until, time.time() + seconds)
+            self._tokens = min(self._tokens, 0)
+
+    def metrics(self):
+        with self._condition:
+            return {
+                'rate'          : self._rate,
+                'burst'         : self._burst,
+                'throttled'     : self._throttled,
+                'blocked_for'   : max(self._blocked_until - time.time(), 0),
+                'waits'         : {PRIORITY_NAMES[priority]: dict(waits)
+                                   for priority, waits in self._waits.items()},
+            }
+
+    def _delay(self, priority, started):
+        now = time.time()
+        if now < self._blocked_until:
+            if priority != CONTROL:
+                return self._blocked_until - now
+            if now < started + CONTROL_MAX_HOLD:
+                return min(self._blocked_until, started + CONTROL_MAX_HOLD) - now
+        if self._rate <= 0:
+            return 0
+
+        self._tokens = min(self._tokens + max(now - self._updated, 0) * self._rate, self._burst)
+        self._updated = now
+
+        if any(self._waiting[other] for other in PRIORITY_NAMES if other < priority):
+            # More urgent requests get the next token, and notify once they've taken it
+            return 1 / self._rate
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self._rate
+
+    def _record(self, priority, waited):
+        waits = self._waits[priority]
+        waits['requests'] += 1
+        if waited > 0.001:
+            waits['waited'] += 1
+            waits['total_wait'] += waited
+            waits['max_wait'] = max(waits['max_wait'], waited)
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def limiter(settings, url):
+    """Returns the rate limiter shared by every request to the host of `url`"""
+    rate = settings.get_float(['http_rate_limit'])
+    burst = settings.get_int(['http_rate_burst'])
+    host = urlparse.urlparse(url or '').netloc
+    with _limiters_lock:
+        key = (host, rate, burst)
+        if key not in _limiters:
+            # The limiter from before the rate limit settings changed is never used again
+            for stale in [other for other in _limiters if other[0] == host]:
+                del _limiters[stale]
+            _limiters[key] = RateLimiter(rate, burst)
+        return _limiters[key]
+
+def rate_limit_metrics():
+    """Returns the metrics of every rate limiter in use, by API host"""
+    with _limiters_lock:
+        limiters = list(_limiters.items())
+    return {host: limiter.metrics() for (host, _, _), limiter in limiters}
+
+def _quantile(samples, quantile):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * quantile), len(ordered) - 1)]
+
+class RequestPolicy(object):
+    """Sends requests through a session with a timeout for each kind of request.
+
+    Every request waits its turn on the rate limiter of its host. GETs wait with `BACKGROUND`
+    priority and everything else with `NORMAL`, unless given a `priority`. A request answered with
+    a 429 is sent again once its `Retry-After` has passed, up to `RATE_LIMIT_RETRIES` times.
+
+    GETs can be hedged: once `HEDGE_MIN_SAMPLES` latencies of a kind of request are known, a GET
+    that hasn't answered by the `HEDGE_QUANTILE` latency is sent a second time, and whichever
+    answer arrives first is used. The delay is counted from when the first GET got past the rate
+    limiter. Only hedge requests that are safe to send twice.
+    """
+    def __init__(self, session, settings):
+        self._logger = logging.getLogger(__name__)
+
+        self._session = session
+        self._settings = settings
+        self._hedging = settings.get_boolean(['http_hedging'])
+        self._latencies = collections.defaultdict(lambda: collections.deque(maxlen=HEDGE_WINDOW))
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def get(self, endpoint, url, hedge=False, **kwargs):
+        if hedge and self._hedging:
+            return self._hedged(endpoint, url, **kwargs)
+        return self._send('get', endpoint, url, **kwargs)
+
+    def post(self, endpoint, url, **kwargs):
+        return self._send('post', endpoint, url, **kwargs)
+
+    def put(self, endpoint, url, **kwargs):
+        return self._send('put', endpoint, url, **kwargs)
+
+    def hedge_delay(self, endpoint):
+        """Returns how long a hedged GET waits before it is sent again, None until enough is known"""
+        with self._lock:
+            samples = list(self._latencies[endpoint])
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return
+        return max(_quantile(samples, HEDGE_QUANTILE), HEDGE_MIN_DELAY)
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False)
+
+    def _send(self, method, endpoint, url, priority=None, sending=None, **kwargs):
+        kwargs.setdefault('timeout', timeout(self._settings, endpoint))
+        if priority is None:
+            priority = BACKGROUND if method == 'get' else NORMAL
+
+        rate_limiter = limiter(self._settings, url)
+        for retry in range(RATE_LIMIT_RETRIES + 1):
+            rate_limiter.acquire(priority)
+            if sending:
+                sending.set()
+            response = getattr(self._session, method)(url, **kwargs)
+            if response.status_code != 429:
+                break
+            wait = retry_after(response)
+            rate_limiter.defer(wait)
+            self._logger.warning("Rate limited by %s, holding requests for %.1fs", url, wait)
+            if retry < RATE_LIMIT_RETRIES:
+                response.close()
+
+        with self._lock:
+            self._latencies[endpoint].append(response.elapsed.total_seconds())
+        return response
+
+    def _hedged(self, endpoint, url, **kwargs):
+        delay = self.hedge_delay(endpoint)
+        if delay is None:
+            return self._send('get', endpoint, url, **kwargs)
+
+        with self._lock:
+            if not self._executor:
+                self._executor = futures.ThreadPoolExecutor(max_workers=HEDGE_WORKERS)
+            executor = self._executor
+
+        # Time spent waiting for a rate limit token isn't latency, a hedge then would only add load
+        sending = threading.Event()
+        attempts = [executor.submit(self._send, 'get', endpoint, url, sending=sending, **kwargs)]
+        attempts[0].add_done_callback(lambda _: sending.set())
+        sending.wait()
+        done, _ = futures.wait(attempts, timeout=delay)
+        if not done:
+            self._logger.debug("No response from %s after %.3fs, sending the request again", url, delay)
+            attempts.append(executor.submit(self._send, 'get', endpoint, url, **kwargs))
+
+        pending = set(attempts)
+        while True:
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            answered = [attempt for attempt in done if attempt.exception() is None]
+            if answered or not pending:
+                winner = answered[0] if answered else done.pop()
+                for other in set(attempts) - {winner}:
+                    other.add_done_callback(_release)
+                return winner.result()
+
+def _release(attempt):
+    # The slower of two hedged requests is never read, hand its connection back to the pool
+    if not attempt.cancelled() and attempt.exception() is None:
+        attempt.result().close()
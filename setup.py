@@ -47,6 +47,7 @@ plugin_license = "AGPLv3"
 # Any additional requirements besides OctoPrint should be listed here
 plugin_requires = [
     'requests==2.8.1',
+    'futures==3.0.5',
 ]
 
 extra_requires = {
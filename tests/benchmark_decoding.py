@@ -0,0 +1,76 @@
+# coding=utf-8
+"""Compares decoding API responses with `response.json()` and with the decoding module.
+
+Run with `python tests/benchmark_decoding.py [iterations]`. Install ujson or simplejson to
+compare against a faster backend.
+"""
+from __future__ import absolute_import, print_function
+
+import json
+import sys
+import timeit
+
+import requests
+
+from octoprint_authentise import decoding
+
+PRINTER_URI = 'https://print.authentise.com/printer/instance/6c7a2a2e-2b5b-4d0b-9d5e-0a8b5b1f4e7d/'
+
+def _printer(number):
+    return {
+        'uri'               : '{}{}/'.format(PRINTER_URI[:-37], number),
+        'port'              : '/dev/ttyACM{}'.format(number),
+        'baud_rate'         : 250000,
+        'name'              : 'Printer {}'.format(number),
+        'status'            : 'ONLINE',
+        'client'            : 'https://print.authentise.com/client/0b6a2c1e-6b7a-4a43-9e8c-5f2f6f3c8e21/',
+        'printer_model'     : 'https://print.authentise.com/printer/model/9/',
+        'created'           : '2016-03-01T12:00:00.000000',
+        'updated'           : '2016-03-01T12:30:00.000000',
+        'temperatures'      : {
+            'extruder1' : {'current': 209.8, 'target': 210.0},
+            'bed'       : {'current': 59.9, 'target': 60.0},
+        },
+        'current_print'     : {
+            'status'            : 'PRINTING',
+            'job_uri'           : 'https://print.authentise.com/job/c3c1c7f4-2c8b-4a1e-8b38-6f1b9c0e9f2a/',
+            'percent_complete'  : 42.5,
+            'elapsed'           : 1200,
+            'remaining'         : 1625,
+        },
+    }
+
+def _command(number):
+    return {
+        'uri'       : '{}command/{}/'.format(PRINTER_URI, number),
+        'printer'   : PRINTER_URI,
+        'command'   : 'G1 X{0}.0 Y{0}.0 E{0}.5'.format(number),
+        'response'  : 'ok',
+        'status'    : 'ok',
+        'created'   : '2016-03-01T12:00:00.000000',
+    }
+
+PAYLOADS = [
+    ('printer', _printer(1), decoding.printer_resource),
+    ('printer page', {'resources': [_printer(index) for index in range(20)]}, decoding.printer_resources),
+    ('command page', {'resources': [_command(index) for index in range(32)]}, decoding.command_resources),
+]
+
+def _response(body):
+    response = requests.Response()
+    response._content = json.dumps(body) #pylint: disable=protected-access
+    response.status_code = 200
+    return response
+
+def main(iterations=2000):
+    print('JSON backend: {}'.format(decoding.json_backend.__name__))
+    for name, body, extract in PAYLOADS:
+        response = _response(body)
+        baseline = min(timeit.repeat(response.json, number=iterations, repeat=3))
+        decode = lambda: extract(decoding.decode(response)) # pylint: disable=cell-var-from-loop
+        decoded = min(timeit.repeat(decode, number=iterations, repeat=3))
+        print('{:<14} response.json() {:>8.1f} us  decoding {:>8.1f} us'.format(
+            name, 1e6 * baseline / iterations, 1e6 * decoded / iterations))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
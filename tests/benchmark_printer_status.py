@@ -0,0 +1,104 @@
+# coding=utf-8
+"""Compares polling every printer of a node one by one with fetching them all in bulk.
+
+Serves a node's printers from a local HTTP server that answers each request after `latency`
+seconds, then times one status tick of each strategy for a growing number of printers. The bulk
+fetch follows `links.next` like the plugin does, so it costs one request per page.
+
+Run with `python tests/benchmark_printer_status.py [latency] [page_size]`.
+"""
+from __future__ import absolute_import, print_function
+
+import BaseHTTPServer
+import json
+import sys
+import threading
+import time
+import urlparse
+
+import requests
+
+from octoprint_authentise import decoding, printers
+
+PRINTER_COUNTS = [1, 2, 5, 10, 25, 50, 100]
+
+def _printer(base_url, number):
+    return {
+        'uri'           : '{}/printer/instance/{}/'.format(base_url, number),
+        'port'          : '/dev/ttyACM{}'.format(number),
+        'baud_rate'     : 250000,
+        'status'        : 'ONLINE',
+        'current_print' : None,
+        'temperatures'  : {'extruder1': {'current': 209.8, 'target': 210.0}},
+    }
+
+def _server(latency, page_size):
+    state = {'printers': [], 'requests': 0}
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self): #pylint: disable=invalid-name
+            state['requests'] += 1
+            time.sleep(latency)
+            url = urlparse.urlparse(self.path)
+            if url.path == '/printer/instance/':
+                page = int(urlparse.parse_qs(url.query).get('page', ['1'])[0])
+                resources = state['printers'][(page - 1) * page_size:page * page_size]
+                body = {'resources': resources, 'links': {}}
+                if page * page_size < len(state['printers']):
+                    body['links']['next'] = '{}/printer/instance/?page={}'.format(base_url, page + 1)
+            else:
+                body = state['printers'][int(url.path.strip('/').split('/')[-1])]
+
+            payload = json.dumps(body)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args): #pylint: disable=arguments-differ
+            pass
+
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+    base_url = 'http://127.0.0.1:{}'.format(server.server_port)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, base_url, state
+
+def poll_individually(session, statuses, uris):
+    for uri in uris:
+        printer = decoding.printer_resource(decoding.decode(session.get(uri)))
+        statuses.setdefault(uri, printers.PrinterStatus(uri)).update(printer, time.time())
+
+def fetch_in_bulk(session, statuses, url):
+    while url:
+        body = decoding.decode(session.get(url))
+        now = time.time()
+        for printer in decoding.printer_resources(body):
+            statuses.setdefault(printer['uri'], printers.PrinterStatus(printer['uri'])).update(printer, now)
+        url = body.get('links', {}).get('next')
+
+def _tick(state, strategy, *args):
+    state['requests'] = 0
+    started = time.time()
+    strategy(*args)
+    return state['requests'], (time.time() - started) * 1000
+
+def main(latency=0.01, page_size=20):
+    server, base_url, state = _server(float(latency), int(page_size))
+    session = requests.Session()
+
+    print('{:>8}  {:>20}  {:>20}'.format('printers', 'individual req / ms', 'bulk req / ms'))
+    for count in PRINTER_COUNTS:
+        state['printers'] = [_printer(base_url, number) for number in range(count)]
+        uris = [printer['uri'] for printer in state['printers']]
+
+        individual = _tick(state, poll_individually, session, {}, uris)
+        bulk = _tick(state, fetch_in_bulk, session, {}, '{}/printer/instance/'.format(base_url))
+        print('{:>8}  {:>8} / {:>9.1f}  {:>8} / {:>9.1f}'.format(count, individual[0], individual[1],
+                                                               bulk[0], bulk[1]))
+    server.shutdown()
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
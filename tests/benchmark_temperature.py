@@ -0,0 +1,78 @@
+# coding=utf-8
+"""Compares the temperature report parser with the regex it replaced.
+
+Run with `python tests/benchmark_temperature.py [iterations]`.
+"""
+from __future__ import absolute_import, print_function
+
+import re
+import sys
+import timeit
+
+from octoprint_authentise.temperature import parse_temps
+
+# Lines as reported by real firmwares, plus the non temperature lines the monitor also sees
+CORPUS = [
+    # Marlin
+    'ok T:210.0 /210.0 B:60.0 /60.0 @:64 B@:127',
+    'T:23.61 /0 @:0 T0:23.61 /0 @0:0 RAW0:3922 T1:23.89 /0 @1:0 RAW1:3920',
+    'ok T:25.0 /0.0 B:24.9 /0.0 T0:25.0 /0.0 T1:24.8 /0.0 T2:180.2 /185.0 @:0 B@:0',
+    # RepRapFirmware
+    'T:201.0 /202.0 B:117.0 /120.0 C:49.3 /50.0',
+    'ok T:70 /190 B:30 /100 T0:70 /190 T1:90 /210',
+    # Smoothieware
+    'ok T:21.8 /0.0 @0 B:22.0 /0.0 @0',
+    'ok T:219.0 /220.0 T0:219.0 /220.0 @:72 B@:0',
+    # Everything else
+    'ok',
+    'echo:busy: processing',
+    'X:0.00 Y:0.00 Z:0.00 E:0.00 Count X:0 Y:0 Z:0',
+]
+
+FLOAT_RE = r'[-+]?\d*\.?\d+'
+JUNK_RE = r'(?:\s+.*?\s*)?'
+LEGACY_TEMP_RE = re.compile(
+        r'^(?:ok)?\s*T:\s*(?P<T>{float})(?:\s*/(?P<TT>{float}))?'
+        r'(?:{junk}\s*B:\s*(?P<B>{float})(?:\s*/(?P<TB>{float}))?)?'
+        r'(?:{junk}\s*T0:\s*(?P<T0>{float})(?:\s*/(?P<TT0>{float}))?)?'
+        r'(?:{junk}\s*T1:\s*(?P<T1>{float})(?:\s*/(?P<TT1>{float}))?)?'
+        r'{junk}$'.format(float=FLOAT_RE, junk=JUNK_RE)
+)
+
+def legacy_parse_temps(line):
+    def _cast_to_float(value):
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                return
+
+    match = LEGACY_TEMP_RE.match(line)
+    if not match:
+        return
+
+    tools = [{
+        'actual': _cast_to_float(match.group('T0') or match.group('T')),
+        'target': _cast_to_float(match.group('TT0') or match.group('TT')),
+    }]
+    if _cast_to_float(match.group('T1')):
+        tools.append({'actual': _cast_to_float(match.group('T1')), 'target': _cast_to_float(match.group('TT1'))})
+
+    bed = None
+    if _cast_to_float(match.group('B')):
+        bed = {'actual': _cast_to_float(match.group('B')), 'target': _cast_to_float(match.group('TB'))}
+
+    return {'tools': tools, 'bed': bed}
+
+def _run(parser):
+    for line in CORPUS:
+        parser(line)
+
+def main(iterations=20000):
+    for name, parser in [('legacy regex', legacy_parse_temps), ('parse_temps', parse_temps)]:
+        elapsed = min(timeit.repeat(lambda: _run(parser), number=iterations, repeat=3)) # pylint: disable=cell-var-from-loop
+        lines_per_second = iterations * len(CORPUS) / elapsed
+        print('{:<14} {:>10.0f} lines/s  {:>6.2f} us/line'.format(name, lines_per_second, 1e6 / lines_per_second))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -1,5 +1,10 @@
 def patch_connect(mocker):
-    mocker.patch('octoprint_authentise.comm.threading.Thread')
+    mocker.patch('octoprint_authentise.comm.MachineCom._monitor_loop')
     mocker.patch('octoprint_authentise.comm.RepeatedTimer')
-    mocker.patch("octoprint_authentise.comm.helpers.run_client")
+    mocker.patch("octoprint_authentise.comm.supervisor.ClientSupervisor")
     mocker.patch("octoprint_authentise.comm.helpers.claim_node")
+
+def printer_event(status, current_print=None):
+    return {'status': status,
+            'temperatures': {'extruder1': {'current': 185.9}},
+            'current_print': current_print}
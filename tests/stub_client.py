@@ -0,0 +1,49 @@
+"""Stands in for the `authentise` client in tests.
+
+Answers `--version`, `--node-uuid` and `--connection-code` like the client does, and serves the
+same queries over the line-delimited JSON protocol when run with `--control`. Every run is
+appended to the file named by STUB_CLIENT_LOG. STUB_CLIENT_NO_CONTROL makes it behave like a
+client without a control channel, and STUB_CLIENT_IGNORE_EOF like one that keeps running after
+its control channel's stdin is closed.
+"""
+from __future__ import print_function
+
+import json
+import os
+import sys
+import time
+
+ANSWERS = {
+    'version'           : '1.2.3',
+    'node-uuid'         : 'some-node-uuid',
+    'connection-code'   : 'ABC123',
+}
+
+def main(args):
+    if os.environ.get('STUB_CLIENT_LOG'):
+        with open(os.environ['STUB_CLIENT_LOG'], 'a') as log:
+            log.write(args[-1] + '\n')
+
+    if args[-1] != '--control':
+        print(ANSWERS[args[-1][2:]])
+        return 0
+
+    if os.environ.get('STUB_CLIENT_NO_CONTROL'):
+        print('error: unrecognized arguments: --control', file=sys.stderr)
+        return 2
+
+    for line in iter(sys.stdin.readline, ''):
+        request = json.loads(line)
+        if request['query'] in ANSWERS:
+            response = {'id': request['id'], 'result': ANSWERS[request['query']]}
+        else:
+            response = {'id': request['id'], 'error': 'Unknown query {}'.format(request['query'])}
+        sys.stdout.write(json.dumps(response) + '\n')
+        sys.stdout.flush()
+
+    if os.environ.get('STUB_CLIENT_IGNORE_EOF'):
+        time.sleep(60)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
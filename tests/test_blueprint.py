@@ -0,0 +1,131 @@
+#pylint: disable=redefined-outer-name, protected-access
+import json
+
+import flask
+import pytest
+from flask_principal import Identity, RoleNeed
+from werkzeug.exceptions import Forbidden
+
+from octoprint_authentise import comm as _comm
+from octoprint_authentise import transport
+
+
+def _request(view, roles=(), **kwargs):
+    with flask.Flask(__name__).test_request_context(**kwargs):
+        flask.g.identity = Identity('some-user')
+        for role in roles:
+            flask.g.identity.provides.add(RoleNeed(role))
+        body, status_code = view()
+        return json.loads(body), status_code
+
+def _post_printer_command(plugin, payload, roles=()):
+    return _request(plugin.post_printer_command, roles=roles, method='POST', json=payload)
+
+@pytest.fixture
+def send_printer_command(comm, mocker):
+    return mocker.patch.object(comm, 'send_printer_command', return_value=True)
+
+def test_post_printer_command(comm, send_printer_command):
+    body, status_code = _post_printer_command(comm, {'printer_uri': 'a', 'command': 'G28'}, roles=['user', 'admin'])
+
+    assert status_code == 202
+    assert body == {'printer_uri': 'a', 'command': 'G28'}
+    send_printer_command.assert_called_once_with('a', 'G28')
+
+@pytest.mark.parametrize("roles", [(), ('user',)])
+def test_post_printer_command_not_admin(comm, send_printer_command, roles):
+    with pytest.raises(Forbidden):
+        _post_printer_command(comm, {'printer_uri': 'a', 'command': 'G28'}, roles=roles)
+
+    assert not send_printer_command.called
+
+@pytest.mark.parametrize("payload", [{}, {'printer_uri': 'a'}, {'command': 'G28'}])
+def test_post_printer_command_missing_fields(comm, send_printer_command, payload):
+    _, status_code = _post_printer_command(comm, payload, roles=['admin'])
+
+    assert status_code == 400
+    assert not send_printer_command.called
+
+@pytest.mark.parametrize("state", ['OFFLINE', 'CONNECTING', 'CLOSED', 'ERROR'])
+def test_post_printer_command_not_operational(comm, state, mocker):
+    comm._state = _comm.PRINTER_STATE[state]
+    comm._printers = {'a': mocker.Mock()}
+    comm._command_pipeline = mocker.Mock()
+
+    _, status_code = _post_printer_command(comm, {'printer_uri': 'a', 'command': 'G28'}, roles=['admin'])
+
+    assert status_code == 409
+    assert not comm._command_pipeline.submit.called
+
+@pytest.mark.usefixtures('connect_printer')
+def test_get_printers(comm, printer):
+    body, status_code = _request(comm.get_printers)
+
+    assert status_code == 200
+    assert body == {'resources': comm.printer_statuses()}
+    assert [status['uri'] for status in body['resources']] == [printer['uri']]
+
+def test_get_printers_not_connected(comm):
+    assert _request(comm.get_printers) == ({'resources': []}, 200)
+
+@pytest.fixture
+def query_client(mocker):
+    return mocker.patch('octoprint_authentise.blueprint.control.query_client', side_effect=['ABC123', 'DEF456'])
+
+@pytest.fixture
+def node(comm):
+    comm.node_uuid = 'some-node-uuid'
+    comm.node_version = '1.2.3'
+    comm._plugin_version = '0.1.0'
+    return comm
+
+def test_get_node(node, query_client):
+    body, status_code = _request(node.get_node)
+
+    assert status_code == 200
+    assert body == {'connectionCode': 'ABC123', 'uuid': 'some-node-uuid', 'version': '1.2.3', 'plugin_version': '0.1.0'}
+    assert _request(node.get_node)[0]['connectionCode'] == 'ABC123'
+    assert query_client.call_count == 1
+
+@pytest.mark.parametrize("refresh, expected", [('true', 'DEF456'), ('1', 'DEF456'), ('no', 'ABC123')])
+def test_get_node_refresh(node, query_client, refresh, expected):
+    _request(node.get_node)
+
+    body, status_code = _request(node.get_node, query_string={'refresh': refresh})
+
+    assert status_code == 200
+    assert body['connectionCode'] == expected
+    assert query_client.call_count == (1 if expected == 'ABC123' else 2)
+
+def test_get_node_no_connection_code(node, mocker):
+    mocker.patch('octoprint_authentise.blueprint.control.query_client', return_value=None)
+
+    body, status_code = _request(node.get_node)
+
+    assert status_code == 500
+    assert body == {'message': 'Could not find node connection code'}
+
+def test_get_client(comm, mocker):
+    metrics = {'running': True, 'pid': 1234, 'starts': 1, 'crashes': 0}
+    comm._client_supervisor = mocker.Mock(**{'metrics.return_value': metrics})
+
+    assert _request(comm.get_client) == (metrics, 200)
+
+def test_get_client_not_started(comm):
+    body, status_code = _request(comm.get_client)
+
+    assert status_code == 404
+    assert body == {'message': 'The Authentise client has not been started'}
+
+def test_get_rate_limit(comm, settings):
+    transport.limiter(settings, 'https://not-a-real-url.com/printer/').acquire(transport.CONTROL)
+
+    body, status_code = _request(comm.get_rate_limit)
+
+    assert status_code == 200
+    assert body.keys() == ['not-a-real-url.com']
+    assert body['not-a-real-url.com']['rate'] == settings.get_float(['http_rate_limit'])
+    assert body['not-a-real-url.com']['waits']['control']['requests'] == 1
+
+def test_get_rate_limit_no_requests(comm):
+    assert _request(comm.get_rate_limit) == ({}, 200)
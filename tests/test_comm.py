@@ -1,320 +1,123 @@
-#pylint: disable=line-too-long, protected-access
+#pylint: disable=line-too-long, protected-access, redefined-outer-name
 import json
-import Queue
+import threading
+import time
 from urlparse import urljoin
 
 import pytest
+import requests
 from octoprint.events import Events
 
 import tests.helpers
 from octoprint_authentise import comm as _comm
-from octoprint_authentise import helpers
-
-
-def test_printer_connect_create_authentise_printer(comm, printer, httpretty, mocker):
-    httpretty.register_uri(httpretty.GET,
-                           printer['request_url'],
-                           body=json.dumps({"resources": []}),
+from octoprint_authentise import pipeline, transport
+
+COMMAND_URI = 'https://not-a-real-url.com/printer/instance/abc-123/command/{}/'
+
+def _command_resource(name, status, response=''):
+    return {'uri': COMMAND_URI.format(name), 'command': 'G28 X Y', 'response': response, 'status': status}
+
+@pytest.mark.parametrize("resources, status_code, current_time, expected_lines, expected_outstanding", [
+    ([_command_resource('a', 'ok', 'ok')]                                , 200, 10   , ['ok']      , 0),
+    ([_command_resource('a', 'ok', '')]                                  , 200, 10   , ['']        , 0),
+    ([_command_resource('a', 'sent')]                                    , 200, 10   , ['']        , 1),
+    ([_command_resource('a', 'unsent')]                                  , 200, 10   , ['']        , 1),
+    ([_command_resource('a', 'ok', 'ok')]                                , 200, 0.2  , ['']        , 1),
+    ([_command_resource('a', 'sent')]                                    , 200, 121  , ['']        , 0),
+    ([]                                                                  , 400, 10   , ['']        , 1),
+    ([_command_resource('a', 'printer_offline')]                         , 200, 10   , ['']        , 0),
+    ([_command_resource('a', 'error')]                                   , 200, 10   , ['']        , 0),
+])
+@pytest.mark.usefixtures('connect_printer') #pylint: disable=too-many-arguments
+def test_readline(comm, httpretty, set_time, resources, status_code, current_time, expected_lines, expected_outstanding):
+    httpretty.register_uri(httpretty.GET, urljoin(comm._printer_uri, 'command/'),
+                           body=json.dumps({'resources': resources}),
+                           status=status_code,
                            content_type='application/json')
+    comm._command_tracker.add(COMMAND_URI.format('a'), 0)
+    set_time(current_time)
 
-    httpretty.register_uri(httpretty.POST, printer['request_url'],
-                           adding_headers={"Location": printer['uri']})
-
-    tests.helpers.patch_connect(mocker)
-
-    comm.connect(port="1234", baudrate=5678)
-
-    assert comm.getState() == _comm.PRINTER_STATE['CONNECTING']
-    assert comm._printer_uri == printer['uri']
-
-def test_printer_connect_get_authentise_printer(comm, printer, httpretty, mocker,):
-    httpretty.register_uri(httpretty.POST, printer['request_url'],
-                           adding_headers={"Location": printer['uri']})
-
-    httpretty.register_uri(httpretty.PUT, printer['uri'])
-
-    tests.helpers.patch_connect(mocker)
+    assert [comm._readline() for _ in expected_lines] == expected_lines
+    assert len(comm._command_tracker) == expected_outstanding
 
-    comm.connect(port="/dev/tty.derp", baudrate=5678)
+@pytest.mark.usefixtures('connect_printer')
+def test_readline_no_commands(comm, httpretty):
+    httpretty.reset()
+    assert comm._readline() == ''
+    assert not httpretty.has_request()
 
-    assert comm.getState() == _comm.PRINTER_STATE['CONNECTING']
-    assert comm._printer_uri == printer['uri']
+@pytest.mark.usefixtures('connect_printer')
+def test_readline_bulk_query_in_submission_order(comm, httpretty, set_time):
+    httpretty.register_uri(httpretty.GET, urljoin(comm._printer_uri, 'command/'),
+                           body=json.dumps({'resources': [
+                               _command_resource('c', 'ok', 'ok T:70'),
+                               _command_resource('a', 'ok', 'ok'),
+                               _command_resource('b', 'ok', 'X:0 Y:0 Z:0'),
+                           ]}),
+                           content_type='application/json')
+    for name in ['a', 'b', 'c']:
+        comm._command_tracker.add(COMMAND_URI.format(name), 0)
+    set_time(10)
+    requests_before = len(httpretty.httpretty.latest_requests)
 
-def test_printer_connect_get_authentise_printer_no_put(comm, printer, mocker):
-    tests.helpers.patch_connect(mocker)
+    assert [comm._readline() for _ in range(4)] == ['ok', 'X:0 Y:0 Z:0', 'ok T:70', '']
+    assert len(httpretty.httpretty.latest_requests) - requests_before == 1
+    assert httpretty.last_request().querystring == {
+        'filter[uri]': [','.join(COMMAND_URI.format(name) for name in ['a', 'b', 'c'])]
+    }
 
-    comm.connect(port="/dev/tty.derp", baudrate=250000)
+@pytest.mark.usefixtures('connect_printer')
+def test_readline_bulk_query_chunks_uris(comm, httpretty, set_time, mocker):
+    mocker.patch.object(_comm, 'COMMAND_STATUS_CHUNK_SIZE', 2)
+    names = ['a', 'b', 'c', 'd', 'e']
+    httpretty.register_uri(httpretty.GET, urljoin(comm._printer_uri, 'command/'),
+                           body=json.dumps({'resources': [_command_resource(name, 'ok', 'ok') for name in names]}),
+                           content_type='application/json')
+    for name in names:
+        comm._command_tracker.add(COMMAND_URI.format(name), 0)
+    set_time(10)
+    requests_before = len(httpretty.httpretty.latest_requests)
 
-    assert comm.getState() == _comm.PRINTER_STATE['CONNECTING']
-    assert comm._printer_uri == printer['uri']
+    assert [comm._readline() for _ in range(6)] == ['ok'] * 5 + ['']
+    assert [request.querystring['filter[uri]'] for request in httpretty.httpretty.latest_requests[requests_before:]] == [
+        [','.join(COMMAND_URI.format(name) for name in chunk)] for chunk in [['a', 'b'], ['c', 'd'], ['e']]
+    ]
 
-def test_printer_connect_session_error(comm, mocker, event_manager):
-    tests.helpers.patch_connect(mocker)
-    mocker.patch("octoprint_authentise.comm.helpers.session", side_effect=helpers.SessionException('a session error message'))
-
-    comm.connect(port="/dev/tty.derp", baudrate=250000)
-
-    event_manager.fire.assert_called_once_with(Events.ERROR, {'error': 'a session error message'})
-
-def test_printer_connect_claim_node_error(comm, mocker, event_manager):
-    mocker.patch('octoprint_authentise.comm.threading.Thread')
-    mocker.patch('octoprint_authentise.comm.RepeatedTimer')
-    mocker.patch("octoprint_authentise.comm.helpers.run_client")
-
-    mocker.patch("octoprint_authentise.comm.helpers.claim_node", side_effect=helpers.ClaimNodeException('a claim node error message'))
-
-    comm.connect(port="/dev/tty.derp", baudrate=250000)
-
-    event_manager.fire.assert_called_once_with(Events.ERROR, {'error': 'a claim node error message'})
-
-@pytest.mark.parametrize("command_queue, response, current_time, expected_return, expected_queue", [
-    (
-        {
-            'uri'          : 'https://not-a-uri.com/',
-            'start_time'   : 0,
-            'previous_time' : None,
-        },
-        {
-            'status_code': 200,
-            'json': {
-                'command'  : 'G28 X Y',
-                'response' : 'ok',
-                'status'   : 'ok',
-                },
-        },
-        10,
-        'ok',
-        None
-    ),
-    (
-        {
-            'uri'          : 'https://not-a-uri.com/',
-            'start_time'   : 0,
-            'previous_time' : None,
-        },
-        {
-            'status_code': 200,
-            'json': {
-                'command'  : 'G28 X Y',
-                'response' : '',
-                'status'   : 'sent',
-                },
-        },
-        10,
-        '',
-        {
-            'uri'          : 'https://not-a-uri.com/',
-            'start_time'   : 0,
-            'previous_time' : 10,
-        },
-    ),
-    (
-        None,
-        None,
-        10,
-        '',
-        None,
-    ),
-    (
-        {
-            'uri'          : 'https://not-a-uri.com/',
-            'start_time'   : 0,
-            'previous_time' : 9,
-        },
-        {
-            'status_code': 200,
-            'json': {
-                'command'  : 'G28 X Y',
-                'response' : 'ok',
-                'status'   : 'ok',
-                },
-        },
-        10,
-        '',
-        {
-            'uri'          : 'https://not-a-uri.com/',
-            'start_time'   : 0,
-            'previous_time' : 9,
-        },
-    ),
-    (
-        {
-            'uri'          : 'https://not-a-uri.com/',
-            'start_time'   : 0,
-            'previous_time' : 8,
-        },
-        {
-            'status_code': 200,
-            'json': {
-                'command'  : 'G28 X Y',
-                'response' : 'ok',
-                'status'   : 'ok',
-                },
-        },
-        10.1,
-        'ok',
-        None
-    ),
-    (
-        {
-            'uri'          : 'https://not-a-uri.com/',
-            'start_time'   : 0,
-            'previous_time' : None,
-        },
-        {
-            'status_code': 200,
-            'json': {
-                'command'  : 'G28 X Y',
-                'response' : '',
-                'status'   : 'sent',
-                },
-        },
-        121,
-        '',
-        None
-    ),
-    (
-        {
-            'uri'          : 'https://not-a-uri.com/',
-            'start_time'   : 0,
-            'previous_time' : None,
-        },
-        {
-            'status_code': 400,
-        },
-        10,
-        '',
-        {
-            'uri'          : 'https://not-a-uri.com/',
-            'start_time'   : 0,
-            'previous_time' : 10,
-        },
-    ),
-    (
-        {
-            'uri'          : 'https://not-a-uri.com/',
-            'start_time'   : 0,
-            'previous_time' : None,
-        },
-        {
-            'status_code': 400,
-        },
-        120.1,
-        '',
-        None
-    ),
-    (
-        {
-            'uri'          : 'https://not-a-uri.com/',
-            'start_time'   : 0,
-            'previous_time' : None,
-        },
-        {
-            'status_code': 200,
-            'json': {
-                'command'  : 'G28 X Y',
-                'response' : '',
-                'status'   : 'printer_offline',
-                },
-        },
-        10,
-        '',
-        None
-    ),
-    (
-        {
-            'uri'          : 'https://not-a-uri.com/',
-            'start_time'   : 0,
-            'previous_time' : None,
-        },
-        {
-            'status_code': 200,
-            'json': {
-                'command'  : 'G28 X Y',
-                'response' : '',
-                'status'   : 'error',
-                },
-        },
-        10,
-        '',
-        None
-    ),
-    (
-        {
-            'uri'          : 'https://not-a-uri.com/',
-            'start_time'   : 0,
-            'previous_time' : None,
-        },
-        {
-            'status_code': 200,
-            'json': {
-                'command'  : 'G28 X Y',
-                'response' : '',
-                'status'   : 'sent',
-                },
-        },
-        10,
-        '',
-        {
-            'uri'          : 'https://not-a-uri.com/',
-            'start_time'   : 0,
-            'previous_time' : 10,
-        },
-    ),
-    (
-        {
-            'uri'          : 'https://not-a-uri.com/',
-            'start_time'   : 0,
-            'previous_time' : None,
-        },
-        {
-            'status_code': 200,
-            'json': {
-                'command'  : 'G28 X Y',
-                'response' : '',
-                'status'   : 'unsent',
-                },
-        },
-        10,
-        '',
-        {
-            'uri'          : 'https://not-a-uri.com/',
-            'start_time'   : 0,
-            'previous_time' : 10,
-        },
-    ), #pylint: disable=too-many-arguments
-])
 @pytest.mark.usefixtures('connect_printer')
-def test_readline(comm, httpretty, set_time, command_queue, response, current_time, expected_return, expected_queue):
-    set_time(current_time)
-
-    if command_queue:
-        httpretty.register_uri(httpretty.GET, command_queue['uri'],
-                               body=json.dumps(response.get('json')),
-                               status=response['status_code'],
-                               content_type='application/json')
-        comm._command_uri_queue.put(command_queue)
+def test_readline_waits_for_earlier_commands(comm, httpretty, set_time):
+    httpretty.register_uri(httpretty.GET, urljoin(comm._printer_uri, 'command/'),
+                           body=json.dumps({'resources': [
+                               _command_resource('a', 'sent'),
+                               _command_resource('b', 'ok', 'ok'),
+                           ]}),
+                           content_type='application/json')
+    for name in ['a', 'b']:
+        comm._command_tracker.add(COMMAND_URI.format(name), 0)
+    set_time(10)
 
-    response = comm._readline()
-    assert response == expected_return
-    try:
-        assert comm._command_uri_queue.get_nowait() == expected_queue
-    except Queue.Empty:
-        assert not expected_queue
+    assert comm._readline() == ''
+    assert len(comm._command_tracker) == 2
 
 @pytest.mark.parametrize("line, expected", [
-    ('ok T:70', {'tools': [{'actual':70, 'target':None}], 'bed':None}),
-    ('ok T: 80', {'tools': [{'actual':80, 'target':None}], 'bed':None}),
-    ('T:70', {'tools': [{'actual':70, 'target':None}], 'bed':None}),
-    ('ok T:90 B:30', {'tools': [{'actual':90, 'target':None}], 'bed':{'actual':30, 'target':None}}),
-    ('ok T: 70 B: 40', {'tools': [{'actual':70, 'target':None}], 'bed':{'actual':40, 'target':None}}),
-    ('ok T:70 /0 B:30 /0', {'tools': [{'actual':70, 'target':0}], 'bed':{'actual':30, 'target':0}}),
-    ('T:23.61 /0 @:0 T0:23.61 /0 @0:0 RAW0:3922 T1:23.89 /0 @1:0 RAW1:3920', {'tools': [{'actual':23.61, 'target':0}, {'actual':23.89, 'target':0}], 'bed':None}),
-    ('ok T:70 /190 B:30 /100 T0:70 /190 T1:90 /210', {'tools': [{'actual':70, 'target':190}, {'actual':90, 'target':210}], 'bed':{'actual':30, 'target':100}}),
+    ('ok T:70', {'tools': [{'actual':70, 'target':None}], 'bed':None, 'chamber':None}),
+    ('ok T: 80', {'tools': [{'actual':80, 'target':None}], 'bed':None, 'chamber':None}),
+    ('T:70', {'tools': [{'actual':70, 'target':None}], 'bed':None, 'chamber':None}),
+    ('ok T:90 B:30', {'tools': [{'actual':90, 'target':None}], 'bed':{'actual':30, 'target':None}, 'chamber':None}),
+    ('ok T: 70 B: 40', {'tools': [{'actual':70, 'target':None}], 'bed':{'actual':40, 'target':None}, 'chamber':None}),
+    ('ok T:70 /0 B:30 /0', {'tools': [{'actual':70, 'target':0}], 'bed':{'actual':30, 'target':0}, 'chamber':None}),
+    ('T:23.61 /0 @:0 T0:23.61 /0 @0:0 RAW0:3922 T1:23.89 /0 @1:0 RAW1:3920', {'tools': [{'actual':23.61, 'target':0}, {'actual':23.89, 'target':0}], 'bed':None, 'chamber':None}),
+    ('ok T:70 /190 B:30 /100 T0:70 /190 T1:90 /210', {'tools': [{'actual':70, 'target':190}, {'actual':90, 'target':210}], 'bed':{'actual':30, 'target':100}, 'chamber':None}),
     ('ok', None),
     ('something that isnt gcode', None),
     ('ok T:7.Nooope', None),
-    ('ok T:219.0 /220.0 T0:219.0 /220.0 @:72 B@:0', {'tools': [{'actual':219.0, 'target':220}], 'bed':None}),
+    ('ok T:219.0 /220.0 T0:219.0 /220.0 @:72 B@:0', {'tools': [{'actual':219.0, 'target':220}], 'bed':None, 'chamber':None}),
+    ('ok T:21.8 /0.0 @0 B:22.0 /0.0 @0', {'tools': [{'actual':21.8, 'target':0}], 'bed':{'actual':22, 'target':0}, 'chamber':None}),
+    ('T:201 /202 B:117 /120 C:49.3 /50', {'tools': [{'actual':201, 'target':202}], 'bed':{'actual':117, 'target':120}, 'chamber':{'actual':49.3, 'target':50}}),
+    ('ok T:25.0 /0.0 B:24.9 /0.0 T0:25.0 /0.0 T1:24.8 /0.0 T2:180.2 /185.0 @:0 B@:0', {'tools': [{'actual':25, 'target':0}, {'actual':24.8, 'target':0}, {'actual':180.2, 'target':185}], 'bed':{'actual':24.9, 'target':0}, 'chamber':None}),
+    ('ok T0:210 /210 T1:0 /0 B:0 /0', {'tools': [{'actual':210, 'target':210}, {'actual':0, 'target':0}], 'bed':{'actual':0, 'target':0}, 'chamber':None}),
+    ('T:-15.00 /0', {'tools': [{'actual':-15, 'target':0}], 'bed':None, 'chamber':None}),
+    ('echo: T:70', None),
+    ('X:0.00 Y:0.00 Z:0.00 E:0.00 Count X:0 Y:0 Z:0', None),
 ])
 def test_parse_temps(line, expected):
     actual = _comm.parse_temps(line)
@@ -342,6 +145,169 @@ def test_change_state(old_state, new_state, event, comm, event_manager):
     else:
         assert event_manager.fire.call_count == 0
 
+def test_monitor_loop_idle_blocks_until_closed(comm, mocker):
+    comm._readline = mocker.Mock(return_value='')
+    comm._monitoring_active = True
+    comm._command_tracker.start()
+
+    monitor = threading.Thread(target=comm._monitor_loop)
+    monitor.start()
+    time.sleep(0.3)
+    comm.close()
+    monitor.join(1)
+
+    assert not monitor.is_alive()
+    assert comm._readline.call_count == 1
+
+def test_monitor_loop_routes_lines_by_type(comm, mocker):
+    parse_temps = mocker.patch('octoprint_authentise.comm.parse_temps', wraps=_comm.parse_temps)
+    responses = ['ok', 'ok T:70 /190 B:30', 'echo:busy: processing', 'X:0 Y:0 Z:0', 'Error:Thermal runaway', 'ok', 'start']
+    remaining = list(responses)
+    def _readline():
+        if remaining:
+            return remaining.pop(0)
+        comm._monitoring_active = False
+        comm._command_tracker.stop()
+        return ''
+    comm._readline = _readline
+    comm._monitoring_active = True
+
+    comm._monitor_loop()
+
+    parse_temps.assert_called_once_with('ok T:70 /190 B:30')
+    comm._callback.on_comm_temperature_update.assert_called_once_with({0: [70, 190]}, (30, None))
+    assert [call[0][0] for call in comm._callback.on_comm_message.call_args_list] == responses
+    assert comm.line_counts() == {'ok': 2, 'temperature': 1, 'busy': 1, 'position': 1, 'error': 1, 'other': 1}
+
+@pytest.fixture
+def other_printer(printer, httpretty):
+    other_printer_uri = urljoin(printer['request_url'], 'def-456/')
+    other_printer_payload = {"baud_rate": 115200,
+                             "port": "/dev/tty.other",
+                             "uri": other_printer_uri,
+                             "status": "ONLINE",
+                             "temperatures": {"extruder1": {"current": 210, "target": 215}},
+                             "current_print": None}
+    printer_payload = {"baud_rate": printer['baud_rate'],
+                       "port": printer['port'],
+                       "uri": printer['uri']}
+
+    httpretty.register_uri(httpretty.GET,
+                           printer['request_url'],
+                           body=json.dumps({"resources": [printer_payload, other_printer_payload]}),
+                           content_type='application/json')
+    httpretty.register_uri(httpretty.GET,
+                           other_printer_uri,
+                           body=json.dumps(other_printer_payload),
+                           content_type='application/json')
+    return other_printer_payload
+
+def test_multi_printer_connect(comm, printer, other_printer, settings, mocker):
+    settings.set(['multi_printer'], True)
+    tests.helpers.patch_connect(mocker)
+
+    comm.connect(port=printer['port'], baudrate=printer['baud_rate'])
+
+    comm._connecting.result(5)
+
+    assert comm._printer_uri == printer['uri']
+    assert sorted(status['uri'] for status in comm.printer_statuses()) == sorted([printer['uri'], other_printer['uri']])
+
+def test_multi_printer_update_printer_data(comm, printer, other_printer, settings, mocker, httpretty): #pylint: disable=too-many-arguments
+    settings.set(['multi_printer'], True)
+    tests.helpers.patch_connect(mocker)
+    comm.connect(port=printer['port'], baudrate=printer['baud_rate'])
+    comm._connecting.result(5)
+
+    printer_payload = tests.helpers.printer_event('ONLINE', {'status': 'PRINTING', 'percent_complete': 10.55, 'elapsed': 30,
+                                                'remaining': 0.4, 'job_uri': 'http://some-job-uri.com/'})
+    printer_payload['uri'] = printer['uri']
+    new_printer_payload = dict(other_printer, uri=urljoin(printer['request_url'], 'ghi-789/'), port='/dev/tty.new')
+    httpretty.register_uri(httpretty.GET,
+                           printer['request_url'],
+                           body=json.dumps({"resources": [printer_payload, other_printer, new_printer_payload]}),
+                           content_type='application/json')
+    requests_before = len(httpretty.httpretty.latest_requests)
+
+    comm._update_printer_data()
+
+    assert len(httpretty.httpretty.latest_requests) - requests_before == 1
+    statuses = {status['uri']: status for status in comm.printer_statuses()}
+    assert statuses[other_printer['uri']]['status'] == 'online'
+    assert statuses[other_printer['uri']]['tools'] == {0: [210, 215]}
+    assert statuses[new_printer_payload['uri']]['port'] == '/dev/tty.new'
+    assert statuses[printer['uri']]['print_status'] == 'printing'
+    assert comm._state == _comm.PRINTER_STATE['PRINTING']
+    assert comm._print_job_uri == 'http://some-job-uri.com/'
+
+def test_multi_printer_update_printer_data_pages(comm, printer, other_printer, settings, mocker, httpretty): #pylint: disable=too-many-arguments
+    settings.set(['multi_printer'], True)
+    tests.helpers.patch_connect(mocker)
+    comm.connect(port=printer['port'], baudrate=printer['baud_rate'])
+    comm._connecting.result(5)
+
+    printer_payload = tests.helpers.printer_event('ONLINE', {'status': 'PRINTING', 'percent_complete': 10.55, 'elapsed': 30,
+                                                'remaining': 0.4, 'job_uri': 'http://some-job-uri.com/'})
+    printer_payload['uri'] = printer['uri']
+    pages = {
+        '1': {'resources': [other_printer], 'links': {'next': printer['request_url'] + '?page=2'}},
+        '2': {'resources': [printer_payload], 'links': {}},
+    }
+    requested = []
+    def _page(request, uri, headers): #pylint: disable=unused-argument
+        requested.append(request.querystring.get('page', ['1'])[0])
+        headers['ETag'] = 'page-etag'
+        return 200, headers, json.dumps(pages[requested[-1]])
+    httpretty.reset()
+    httpretty.register_uri(httpretty.GET, printer['request_url'], body=_page, content_type='application/json')
+
+    comm._update_printer_data()
+
+    assert requested == ['1', '2']
+    assert comm._state == _comm.PRINTER_STATE['PRINTING']
+    assert comm._print_job_uri == 'http://some-job-uri.com/'
+    assert comm._client_printers_etag is None
+
+@pytest.mark.parametrize("printer_count", [1, 5, 50])
+def test_multi_printer_update_printer_data_request_count(printer_count, comm, printer, settings, mocker, httpretty): #pylint: disable=too-many-arguments
+    payloads = [dict(tests.helpers.printer_event('ONLINE'), uri=urljoin(printer['request_url'], '{}/'.format(i)), port=str(i), baud_rate=250000)
+                for i in range(printer_count)]
+    payloads[0].update(uri=printer['uri'], port=printer['port'], baud_rate=printer['baud_rate'])
+    settings.set(['multi_printer'], True)
+    tests.helpers.patch_connect(mocker)
+    comm.connect(port=printer['port'], baudrate=printer['baud_rate'])
+    comm._connecting.result(5)
+    httpretty.reset()
+    httpretty.register_uri(httpretty.GET,
+                           printer['request_url'],
+                           body=json.dumps({"resources": payloads}),
+                           content_type='application/json')
+
+    for _ in range(3):
+        comm._update_printer_data()
+
+    assert len(httpretty.httpretty.latest_requests) == 3
+    assert len(comm.printer_statuses()) == printer_count
+    assert all(status['status'] == 'online' for status in comm.printer_statuses())
+
+def test_multi_printer_send_printer_command(comm, printer, other_printer, settings, mocker, httpretty):
+    settings.set(['multi_printer'], True)
+    tests.helpers.patch_connect(mocker)
+    comm.connect(port=printer['port'], baudrate=printer['baud_rate'])
+    comm._connecting.result(5)
+    httpretty.register_uri(httpretty.POST,
+                           urljoin(other_printer['uri'], 'command/'),
+                           adding_headers={'Location': urljoin(other_printer['uri'], 'command/1234-asdf/')})
+
+    assert not comm.send_printer_command(other_printer['uri'], 'G28 ; home')
+    comm._state = _comm.PRINTER_STATE['OPERATIONAL']
+    assert comm.send_printer_command(other_printer['uri'], 'G28 ; home')
+    assert not comm.send_printer_command('https://not-a-real-url.com/printer/instance/nope/', 'G28')
+    comm._command_pipeline.join()
+
+    assert httpretty.last_request().body == json.dumps({'command': 'G28'})
+    assert len(comm._command_tracker) == 0
+
 ### TESTS FOR VARIOUS GETTERS ###
 def test_getState(comm):
     comm._state = _comm.PRINTER_STATE['OPERATIONAL']
@@ -469,15 +435,15 @@ def test_isStreaming_isSdReady_isSdFileSelected_isSdPrinting(state, result, comm
 def test_getSdFiles(comm):
     assert not comm.getSdFiles()
 
-@pytest.mark.parametrize("progress, percent, time", [
+@pytest.mark.parametrize("progress, percent, print_time", [
     ({'percent_complete': 0.112, 'elapsed': 54}, 0.112, 54),
     (None, None, None),
 ])
-def test_getPrintProgress_getPrintTime_getCleanedPrintTime(progress, percent, time, comm):
+def test_getPrintProgress_getPrintTime_getCleanedPrintTime(progress, percent, print_time, comm):
     comm._print_progress = progress
     assert comm.getPrintProgress() == percent
-    assert comm.getPrintTime() == time
-    assert comm.getCleanedPrintTime() == time
+    assert comm.getPrintTime() == print_time
+    assert comm.getCleanedPrintTime() == print_time
 
 def test_getPrintFilepos(comm):
     assert not comm.getPrintFilepos()
@@ -508,10 +474,12 @@ def test_getTransport(comm):
 @pytest.mark.usefixtures('connect_printer')
 def test_close_not_printing(comm, event_manager):
     comm._state = _comm.PRINTER_STATE['OPERATIONAL']
+    timer = comm._printer_status_timer
     comm.close()
 
-    comm._printer_status_timer.cancel.assert_called_once_with()
-    comm._authentise_process.send_signal.assert_called_once_with(2)
+    timer.cancel.assert_called_once_with()
+    assert comm._printer_status_timer is None
+    comm._client_supervisor.stop.assert_called_once_with(5)
     assert comm._state == _comm.PRINTER_STATE['CLOSED']
     event_manager.fire.assert_called_once_with(Events.DISCONNECTED)
 
@@ -519,10 +487,12 @@ def test_close_not_printing(comm, event_manager):
 def test_close_while_printing(comm, event_manager):
     comm._print_job_uri = 'test'
     comm._state = _comm.PRINTER_STATE['PRINTING']
+    timer = comm._printer_status_timer
     comm.close()
 
-    comm._printer_status_timer.cancel.assert_called_once_with()
-    comm._authentise_process.send_signal.assert_called_once_with(2)
+    timer.cancel.assert_called_once_with()
+    assert comm._printer_status_timer is None
+    comm._client_supervisor.stop.assert_called_once_with(5)
     assert comm._state == _comm.PRINTER_STATE['CLOSED']
     assert comm._print_job_uri == None
     event_manager.fire.assert_any_call(Events.PRINT_FAILED, None)
@@ -546,20 +516,52 @@ def test_send_command_printer_operational(command, sent_command, comm, httpretty
                            adding_headers={'Location': command_uri})
 
     comm.sendCommand(command)
-    expected = {'uri': command_uri,
-            'start_time' : now,
-            'previous_time' : None}
-    assert comm._command_uri_queue.get_nowait() == expected
+    comm._command_pipeline.join()
+    assert comm._command_tracker.due(now + 2) == [command_uri]
     assert httpretty.last_request().body == json.dumps({'command': sent_command})
 
+@pytest.mark.parametrize("tools, bed, age, expected_line", [
+    ({0: [210.0, 215.0]}, [60.0, 60.0], 1, 'ok T:210.0 /215.0 B:60.0 /60.0'),
+    ({0: [21.0, None]}, None, 4.9, 'ok T:21.0'),
+    ({0: [210.0, 215.0]}, [60.0, 60.0], 6, None),
+    ({0: [None, None]}, None, 1, None),
+])
+@pytest.mark.usefixtures('connect_printer')
+def test_send_command_m105_answered_locally(comm, httpretty, set_time, tools, bed, age, expected_line): #pylint: disable=too-many-arguments
+    comm._state = _comm.PRINTER_STATE['OPERATIONAL']
+    comm._tool_tempuratures, comm._bed_tempurature = tools, bed
+    comm._temperatures_updated = 1000
+    set_time(1000 + age)
+    httpretty.reset()
+    httpretty.register_uri(httpretty.POST,
+                           urljoin(comm._printer_uri, 'command/'),
+                           adding_headers={'Location': urljoin(comm._printer_uri, 'command/1234-asdf/')})
+
+    comm.sendCommand('M105')
+    comm._command_pipeline.join()
+
+    if expected_line:
+        assert not httpretty.has_request()
+        assert comm._readline() == expected_line
+    else:
+        assert httpretty.last_request().body == json.dumps({'command': 'M105'})
+
+@pytest.mark.usefixtures('connect_printer')
+def test_temperatures_fresh_after_unchanged_status(comm, httpretty, set_time):
+    httpretty.register_uri(httpretty.GET, comm._printer_uri, status=304)
+    set_time(1234)
+
+    comm._update_printer_data()
+
+    assert comm._temperatures_updated == 1234
+
 @pytest.mark.usefixtures('connect_printer')
 def test_send_command_printer_not_operational(comm, httpretty):
     httpretty.reset()
     comm._state = _comm.PRINTER_STATE['OFFLINE']
 
     comm.sendCommand('G1 X50 Y50')
-    with pytest.raises(Queue.Empty):
-        comm._command_uri_queue.get_nowait()
+    assert len(comm._command_tracker) == 0
     assert not httpretty.has_request()
 
 @pytest.mark.usefixtures('connect_printer')
@@ -574,10 +576,82 @@ def test_send_command_bad_response(comm, httpretty):
                            adding_headers={'Location': command_uri})
 
     comm.sendCommand('G1 X50 Y50')
-    with pytest.raises(Queue.Empty):
-        comm._command_uri_queue.get_nowait()
+    comm._command_pipeline.join()
+    assert len(comm._command_tracker) == 0
     assert httpretty.last_request().body == json.dumps({'command': 'G1 X50 Y50'})
 
+def _sent_commands(httpretty):
+    commands = []
+    for request in httpretty.httpretty.latest_requests:
+        if request.method != 'POST':
+            continue
+        body = json.loads(request.body)
+        commands.extend(body['commands'] if request.path.endswith('/batch/') else [body['command']])
+    return commands
+
+@pytest.mark.usefixtures('connect_printer')
+def test_send_command_batch(comm, httpretty):
+    comm._state = _comm.PRINTER_STATE['OPERATIONAL']
+
+    def _batch_response(request, uri, headers): #pylint: disable=unused-argument
+        commands = json.loads(request.body)['commands']
+        resources = [{'uri': urljoin(comm._printer_uri, 'command/{}/'.format(i))} for i, _ in enumerate(commands)]
+        return 201, headers, json.dumps({'resources': resources})
+
+    httpretty.register_uri(httpretty.POST,
+                           urljoin(comm._printer_uri, 'command/batch/'),
+                           body=_batch_response,
+                           content_type='application/json')
+    httpretty.register_uri(httpretty.POST,
+                           urljoin(comm._printer_uri, 'command/'),
+                           adding_headers={'Location': urljoin(comm._printer_uri, 'command/1234-asdf/')})
+
+    commands = ['M104 S200', 'M140 S60', 'G28', 'M105']
+    for command in commands:
+        comm.sendCommand(command)
+    comm._command_pipeline.join()
+
+    requests_sent = [request for request in httpretty.httpretty.latest_requests if request.method == 'POST']
+    assert _sent_commands(httpretty) == commands
+    assert len(requests_sent) < len(commands)
+    assert len(comm._command_tracker) == len(commands)
+    assert comm._command_batching
+
+@pytest.mark.usefixtures('connect_printer')
+def test_send_command_batch_unsupported(comm, httpretty):
+    comm._state = _comm.PRINTER_STATE['OPERATIONAL']
+
+    httpretty.register_uri(httpretty.POST,
+                           urljoin(comm._printer_uri, 'command/batch/'),
+                           status=404)
+    httpretty.register_uri(httpretty.POST,
+                           urljoin(comm._printer_uri, 'command/'),
+                           responses=[httpretty.Response('', status=201, adding_headers={
+                               'Location': urljoin(comm._printer_uri, 'command/{}/'.format(i))
+                           }) for i in range(4)])
+
+    commands = ['M104 S200', 'M140 S60', 'G28', 'M105']
+    for command in commands:
+        comm.sendCommand(command)
+    comm._command_pipeline.join()
+
+    requests_sent = [request for request in httpretty.httpretty.latest_requests
+                     if request.method == 'POST' and not request.path.endswith('/batch/')]
+    assert [json.loads(request.body) for request in requests_sent] == [{'command': command} for command in commands]
+    assert len(comm._command_tracker) == len(commands)
+    assert not comm._command_batching
+
+@pytest.mark.usefixtures('connect_printer')
+def test_send_command_connection_error(comm, mocker):
+    comm._state = _comm.PRINTER_STATE['OPERATIONAL']
+    mocker.patch.object(comm._session, 'post', side_effect=requests.exceptions.ConnectionError('no route'))
+
+    comm.sendCommand('G1 X50 Y50')
+    comm._command_pipeline.join()
+
+    assert len(comm._command_tracker) == 0
+    comm._callback.on_comm_log.assert_called_with('Error sending G1 X50 Y50 to {}: no route'.format(comm._printer_uri))
+
 @pytest.mark.parametrize("printer_status, request_status", [
     ('PRINTING', 'cancel'),
     ('PAUSED', 'cancel'),
@@ -586,10 +660,12 @@ def test_send_command_bad_response(comm, httpretty):
     ('OPERATIONAL', None),
     ('CLOSED', None),
 ])
+@pytest.mark.usefixtures('connect_printer')
 def test_cancelPrint(printer_status, request_status, comm, mocker):
     comm._send_pause_cancel_request = mocker.Mock()
     comm._state = _comm.PRINTER_STATE[printer_status]
     comm.cancelPrint()
+    comm._control_dispatcher.join()
     if request_status:
         comm._send_pause_cancel_request.assert_called_once_with(request_status)
     else:
@@ -605,10 +681,12 @@ def test_cancelPrint(printer_status, request_status, comm, mocker):
     ('OPERATIONAL', None, False),
     ('CLOSED', None, False),
 ])
+@pytest.mark.usefixtures('connect_printer')
 def test_setPause(printer_status, request_status, pause, comm, mocker):
     comm._send_pause_cancel_request = mocker.Mock()
     comm._state = _comm.PRINTER_STATE[printer_status]
     comm.setPause(pause)
+    comm._control_dispatcher.join()
     if request_status:
         comm._send_pause_cancel_request.assert_called_once_with(request_status)
     else:
@@ -643,149 +721,138 @@ def test_send_pause_cancel_request_no_print_uri(comm, httpretty):
     assert not httpretty.has_request()
     assert comm._state == _comm.PRINTER_STATE['PRINTING']
 
+def _slow_command_posts(comm, mocker, release):
+    posted = []
+    started = threading.Event()
+    def _post(url, json, **kwargs): #pylint: disable=redefined-outer-name, unused-argument
+        posted.append(json['command'])
+        if json['command'] != 'M112':
+            started.set()
+            release.wait(5)
+        return mocker.Mock(ok=True, status_code=201, content='',
+                           headers={'Location': urljoin(comm._printer_uri, 'command/1234-asdf/')})
+    mocker.patch.object(comm._session, 'post', side_effect=_post)
+    comm._command_batching = False
+    return posted, started
+
 @pytest.mark.usefixtures('connect_printer')
-def test_send_pause_cancel_request_bad_print_url(comm, httpretty):
+def test_send_command_emergency_stop(comm, mocker):
     comm._state = _comm.PRINTER_STATE['PRINTING']
-    httpretty.reset()
-    comm._print_job_uri = 'http://not-a-good-url/'
-
-    comm._send_pause_cancel_request('resume')
-    assert httpretty.last_request().body == json.dumps({'status': 'resume'})
-    assert comm._state == _comm.PRINTER_STATE['PRINTING']
-
-@pytest.mark.parametrize("response, expected_state", [
-    ({'status': 'new'     , 'current_print': {'status':'new'}}        , _comm.PRINTER_STATE['CONNECTING']),
-    ({'status': 'OFFLINE' , 'current_print': None}                    , _comm.PRINTER_STATE['CONNECTING']),
-    ({'status': 'ONLINE'  , 'current_print': None}                    , _comm.PRINTER_STATE['OPERATIONAL']),
-    ({'status': 'ONLINE'  , 'current_print': {'status':'new'}}        , _comm.PRINTER_STATE['OPERATIONAL']),
-    ({'status': 'ONLINE'  , 'current_print': {'status':'PRINTING'}}   , _comm.PRINTER_STATE['PRINTING']),
-    ({'status': 'ONLINE'  , 'current_print': {'status':'WARMING_UP'}} , _comm.PRINTER_STATE['PRINTING']),
-    ({'status': 'ONLINE'  , 'current_print': {'status':'PAUSED'}}     , _comm.PRINTER_STATE['PAUSED']),
-    ({'status': 'ONLINE'  , 'current_print': {'status':'WAT?'}}       , _comm.PRINTER_STATE['OFFLINE']),
-])
-def test_update_state(response, expected_state, comm):
-    comm._state = _comm.PRINTER_STATE['OFFLINE']
-    comm._update_state(response)
-    assert comm._state == expected_state
-
-@pytest.mark.parametrize("response, expected_progress, expected_callback", [
-    ({'current_print': {'status':'new'}}, None, [None, None, None, None]),
-    ({'current_print': {'status':'PRINTING', 'percent_complete': 23.55, 'elapsed': 54, 'remaining': 66.3}}, {'percent_complete': 0.2355, 'elapsed': 54, 'remaining': 66.3}, [23.55, 2355, 54, 66.3]),
-    ({'current_print': {'status':'WARMING_UP', 'percent_complete': 43.1, 'elapsed': 40, 'remaining': 66.3}}, {'percent_complete': 0.431, 'elapsed': 40, 'remaining': 66.3}, [43.1, 4310, 40, 66.3]),
-    ({'current_print': {'status':'PAUSED', 'percent_complete': 23.56, 'elapsed': 54, 'remaining': 66.3}}, {'percent_complete': 0.2356, 'elapsed': 54, 'remaining': 66.3}, [23.56, 2356, 54, 66.3]),
-])
-def test_update_progress(response, expected_progress, expected_callback, comm, assert_almost_equal):
-    comm._update_progress(response)
-    assert_almost_equal(comm._print_progress, expected_progress)
-    comm._callback.on_comm_set_progress_data.assert_called_once_with(*expected_callback)
-
-@pytest.mark.parametrize("response, expected_temps, expected_bed", [
-    ({'temperatures':{'extruder1':{'current':0}}}, {0: [0, None]}, None),
-    ({'temperatures':{'extruder1':{'current':180.9, 'target':200}}}, {0: [180.9, 200]}, None),
-    ({'temperatures':{'extruder1':{'current':180.9}, 'bed':{'current':30.5, 'target':50.1}}}, {0: [180.9, None]}, [30.5, 50.1]),
-])
-def test_update_temps(response, expected_temps, expected_bed, comm):
-    comm._update_temps(response)
-    assert comm._tool_tempuratures == expected_temps
-    assert comm._bed_tempurature == expected_bed
+    release = threading.Event()
+    posted, started = _slow_command_posts(comm, mocker, release)
+
+    comm.sendCommand('G28')
+    assert started.wait(5)
+    comm.sendCommand('G1 X10')
+    comm.sendCommand('G1 X20')
+    comm.sendCommand('M112')
+    comm._control_dispatcher.join()
+
+    assert posted == ['G28', 'M112']
+    release.set()
+    comm._command_pipeline.join()
+    assert posted == ['G28', 'M112']
+    comm._callback.on_comm_log.assert_any_call('Dropped 2 queued commands for {}'.format(comm._printer_uri))
 
 @pytest.mark.usefixtures('connect_printer')
-def test_update_printer_data_ok_response(comm, httpretty, assert_almost_equal):
-    comm._state = _comm.PRINTER_STATE['CONNECTING']
-    comm._tool_tempuratures = None
-    comm._bed_tempurature = None
-    comm._print_progress = None
-
-    printer_payload = {"baud_rate": 250000,
-                       "port": "/dev/tty.derp",
-                       "uri": comm._printer_uri,
-                       'status': 'ONLINE',
-                       'temperatures':{'extruder1': {'current':185.9}},
-                       'current_print': {
-                           'status': 'PRINTING',
-                           'percent_complete': 10.55,
-                           'elapsed': 30,
-                           'remaining': 0.4,
-                           'job_uri': 'http://some-job-uri.com/',
-                       }}
-
-    httpretty.register_uri(httpretty.GET,
-                           comm._printer_uri,
-                           status=200,
-                           body=json.dumps(printer_payload),
-                           content_type='application/json')
+def test_send_command_m105_queued_behind_pending_commands(comm, mocker, set_time):
+    comm._state = _comm.PRINTER_STATE['OPERATIONAL']
+    comm._tool_tempuratures, comm._bed_tempurature = {0: [210.0, 215.0]}, None
+    comm._temperatures_updated = 1000
+    set_time(1001)
+    release = threading.Event()
+    posted, started = _slow_command_posts(comm, mocker, release)
+
+    comm.sendCommand('G28')
+    assert started.wait(5)
+    comm.sendCommand('M105')
+    release.set()
+    comm._command_pipeline.join()
+
+    assert posted == ['G28', 'M105']
+    assert comm._command_pipeline.pending(comm._printer_uri) == 0
+
+@pytest.mark.parametrize("command", ['', '   '])
+@pytest.mark.usefixtures('connect_printer')
+def test_send_command_empty_processed(comm, mocker, command):
+    comm._state = _comm.PRINTER_STATE['OPERATIONAL']
+    submit = mocker.patch.object(comm._command_pipeline, 'submit')
 
-    comm._update_printer_data()
+    comm.sendCommand(command, processed=True)
 
-    assert comm._state == _comm.PRINTER_STATE['PRINTING']
-    assert comm._tool_tempuratures == {0: [185.9, None]}
-    assert comm._bed_tempurature == None
-    assert comm._print_job_uri == 'http://some-job-uri.com/'
-    assert_almost_equal(comm._print_progress, {'percent_complete': 0.1055, 'elapsed': 30, 'remaining': 0.4})
+    assert not pipeline.is_emergency_stop(command)
+    submit.assert_called_once_with(comm._printer_uri, command)
 
 @pytest.mark.usefixtures('connect_printer')
-def test_update_printer_data_not_printing(comm, httpretty):
-    comm._state = _comm.PRINTER_STATE['CONNECTING']
-    comm._tool_tempuratures = None
-    comm._bed_tempurature = None
-    comm._print_progress = None
-    comm._print_job_uri = 'http://some-job-uri.com/'
-
-    printer_payload = {"baud_rate": 250000,
-                       "port": "/dev/tty.derp",
-                       "uri": comm._printer_uri,
-                       'status': 'ONLINE',
-                       'temperatures':{'extruder1': {'current':185.9}},
-                       'current_print': None}
-
-    httpretty.register_uri(httpretty.GET,
-                           comm._printer_uri,
-                           status=200,
-                           body=json.dumps(printer_payload),
-                           content_type='application/json')
-
-    comm._update_printer_data()
+def test_cancel_under_load(comm, settings, mocker):
+    comm._state = _comm.PRINTER_STATE['PRINTING']
+    comm._print_job_uri = 'http://test.uri.com/job/1234/'
+    comm._command_batching = False
+    sent = []
+    def _record(name):
+        location = urljoin(comm._printer_uri, 'command/1234-asdf/')
+        return lambda url, **kwargs: sent.append(name) or mocker.Mock(ok=True, status_code=201, headers={'Location': location})
+    mocker.patch.object(comm._session, 'post', side_effect=lambda url, json, **kwargs: _record(json['command'])(url))
+    mocker.patch.object(comm._session, 'get', side_effect=_record('status'))
+    mocker.patch.object(comm._session, 'put', side_effect=_record('cancel'))
+
+    # An empty bucket that fills up slowly, so every request has to wait for its token
+    settings.set(['http_rate_limit'], 4)
+    settings.set(['http_rate_burst'], 1)
+    limiter = transport.limiter(settings, comm._printer_uri)
+    limiter.acquire(transport.CONTROL)
+
+    polls = [threading.Thread(target=comm._http.get, args=('status', comm._printer_uri)) for _ in range(2)]
+    for poll in polls:
+        poll.start()
+    for i in range(3):
+        comm.sendCommand('G1 X{}'.format(i))
+    for _ in range(100):
+        if limiter._waiting[transport.NORMAL] and limiter._waiting[transport.BACKGROUND] >= 2:
+            break
+        time.sleep(0.01)
 
+    comm.cancelPrint()
+    comm._control_dispatcher.join()
+    comm._command_pipeline.join()
+    for poll in polls:
+        poll.join(5)
+
+    assert sent[0] == 'cancel'
+    assert [name for name in sent if name.startswith('G1')] == ['G1 X0', 'G1 X1', 'G1 X2']
+    waits = limiter.metrics()['waits']
+    assert waits['control']['max_wait'] < waits['normal']['max_wait']
+    assert waits['control']['max_wait'] < waits['background']['max_wait']
     assert comm._state == _comm.PRINTER_STATE['OPERATIONAL']
-    assert comm._tool_tempuratures == {0: [185.9, None]}
-    assert comm._bed_tempurature == None
-    assert comm._print_job_uri == None
-    assert comm._print_progress == None
 
 @pytest.mark.usefixtures('connect_printer')
-def test_update_printer_data_bad_response(comm, httpretty):
-    comm._state = _comm.PRINTER_STATE['CONNECTING']
-    comm._tool_tempuratures = None
-    comm._bed_tempurature = None
-    comm._print_progress = None
-
-    printer_payload = {}
-
-    httpretty.register_uri(httpretty.GET,
-                           comm._printer_uri,
-                           status=400,
-                           body=json.dumps(printer_payload),
-                           content_type='application/json')
-
-    comm._update_printer_data()
+def test_cancel_answered_after_close(comm, mocker):
+    comm._state = _comm.PRINTER_STATE['PRINTING']
+    comm._print_job_uri = 'http://test.uri.com/job/1234/'
+    release = threading.Event()
+    started = threading.Event()
+    answered = threading.Event()
+    def _put(url, **kwargs): #pylint: disable=unused-argument
+        started.set()
+        release.wait(5)
+        return mocker.Mock(ok=True)
+    mocker.patch.object(comm._session, 'put', side_effect=_put)
+    mocker.patch.object(comm, '_poll_status_soon', side_effect=answered.set)
 
-    assert comm._state == _comm.PRINTER_STATE['CONNECTING']
-    assert comm._tool_tempuratures == None
-    assert comm._bed_tempurature == None
-    assert comm._print_progress == None
-    assert comm._print_job_uri == None
+    comm.cancelPrint()
+    assert started.wait(5)
+    comm.close()
+    release.set()
 
-def test_update_printer_data_no_print_uri(comm):
-    comm._state = _comm.PRINTER_STATE['CONNECTING']
-    comm._printer_uri = None
-    comm._tool_tempuratures = None
-    comm._bed_tempurature = None
-    comm._print_progress = None
+    assert not answered.wait(0.2)
+    assert comm._state == _comm.PRINTER_STATE['CLOSED']
 
-    comm._update_printer_data()
+@pytest.mark.usefixtures('connect_printer')
+def test_send_pause_cancel_request_bad_print_url(comm, httpretty):
+    comm._state = _comm.PRINTER_STATE['PRINTING']
+    httpretty.reset()
+    comm._print_job_uri = 'http://not-a-good-url/'
 
-    assert comm._state == _comm.PRINTER_STATE['CONNECTING']
-    assert comm._tool_tempuratures == None
-    assert comm._bed_tempurature == None
-    assert comm._print_progress == None
-    assert comm._print_job_uri == None
+    comm._send_pause_cancel_request('resume')
+    assert httpretty.last_request().body == json.dumps({'status': 'resume'})
+    assert comm._state == _comm.PRINTER_STATE['PRINTING']
@@ -0,0 +1,195 @@
+#pylint: disable=line-too-long, protected-access, redefined-outer-name
+import json
+import threading
+import time
+from urlparse import urljoin
+
+import pytest
+from octoprint.events import Events
+
+import tests.helpers
+from octoprint_authentise import comm as _comm
+from octoprint_authentise import helpers
+
+
+def test_printer_connect_create_authentise_printer(comm, printer, httpretty, mocker):
+    httpretty.register_uri(httpretty.GET,
+                           printer['request_url'],
+                           body=json.dumps({"resources": []}),
+                           content_type='application/json')
+
+    httpretty.register_uri(httpretty.POST, printer['request_url'],
+                           adding_headers={"Location": printer['uri']})
+
+    tests.helpers.patch_connect(mocker)
+
+    comm.connect(port="1234", baudrate=5678)
+
+    comm._connecting.result(5)
+
+    assert comm.getState() == _comm.PRINTER_STATE['CONNECTING']
+    assert comm._printer_uri == printer['uri']
+
+def test_printer_connect_get_authentise_printer(comm, printer, httpretty, mocker,):
+    httpretty.register_uri(httpretty.POST, printer['request_url'],
+                           adding_headers={"Location": printer['uri']})
+
+    httpretty.register_uri(httpretty.PUT, printer['uri'])
+
+    tests.helpers.patch_connect(mocker)
+
+    comm.connect(port="/dev/tty.derp", baudrate=5678)
+
+    comm._connecting.result(5)
+
+    assert comm.getState() == _comm.PRINTER_STATE['CONNECTING']
+    assert comm._printer_uri == printer['uri']
+
+def test_printer_connect_get_authentise_printer_no_put(comm, printer, mocker):
+    tests.helpers.patch_connect(mocker)
+
+    comm.connect(port="/dev/tty.derp", baudrate=250000)
+
+    comm._connecting.result(5)
+
+    assert comm.getState() == _comm.PRINTER_STATE['CONNECTING']
+    assert comm._printer_uri == printer['uri']
+
+def test_printer_connect_session_error(comm, mocker, event_manager):
+    tests.helpers.patch_connect(mocker)
+    mocker.patch("octoprint_authentise.comm.helpers.session", side_effect=helpers.SessionException('a session error message'))
+
+    comm.connect(port="/dev/tty.derp", baudrate=250000)
+
+    comm._connecting.result(5)
+
+    event_manager.fire.assert_called_once_with(Events.ERROR, {'error': 'a session error message'})
+
+def test_printer_connect_claim_node_error(comm, mocker, event_manager):
+    tests.helpers.patch_connect(mocker)
+    mocker.patch("octoprint_authentise.comm.helpers.claim_node", side_effect=helpers.ClaimNodeException('a claim node error message'))
+
+    comm.connect(port="/dev/tty.derp", baudrate=250000)
+
+    comm._connecting.result(5)
+
+    event_manager.fire.assert_called_once_with(Events.ERROR, {'error': 'a claim node error message'})
+
+def test_claim_node_asks_client_for_claim_code(comm, mocker):
+    claim_node = mocker.patch("octoprint_authentise.comm.helpers.claim_node")
+    query_client = mocker.patch("octoprint_authentise.comm.control.query_client", return_value='ABC123')
+
+    comm._claim_node()
+
+    get_claim_code = claim_node.call_args[0][3]
+    assert get_claim_code() == 'ABC123'
+    query_client.assert_called_once_with(comm._settings, 'connection-code', comm._logger)
+
+@pytest.fixture
+def printer_pages(printer, httpretty):
+    other_payload = {"baud_rate": 115200, "port": "/dev/tty.other", "uri": urljoin(printer['request_url'], 'def-456/')}
+    matching_payload = {"baud_rate": printer['baud_rate'], "port": printer['port'], "uri": printer['uri']}
+    pages = {
+        '1': {'resources': [other_payload], 'links': {'next': printer['request_url'] + '?page=2'}},
+        '2': {'resources': [matching_payload], 'links': {'next': printer['request_url'] + '?page=3'}},
+        '3': {'resources': [], 'links': {}},
+    }
+    requested = []
+    def _page(request, uri, headers): #pylint: disable=unused-argument
+        page = request.querystring.get('page', ['1'])[0]
+        requested.append((page, request.querystring.get('filter[port]')))
+        return 200, headers, json.dumps(pages[page])
+    # Replaces the printer list registered by the printer fixture for every page
+    httpretty.reset()
+    httpretty.register_uri(httpretty.GET, printer['request_url'], body=_page, content_type='application/json')
+    return requested
+
+def test_printer_connect_pages_until_match(comm, printer, printer_pages, mocker):
+    tests.helpers.patch_connect(mocker)
+
+    comm.connect(port=printer['port'], baudrate=printer['baud_rate'])
+    comm._connecting.result(5)
+
+    assert comm._printer_uri == printer['uri']
+    assert printer_pages == [('1', [printer['port']]), ('2', None)]
+
+def test_printer_connect_reuses_printer_uri(comm, printer, printer_pages, mocker):
+    tests.helpers.patch_connect(mocker)
+    comm.connect(port=printer['port'], baudrate=printer['baud_rate'])
+    comm._connecting.result(5)
+    comm.close()
+    del printer_pages[:]
+
+    comm.connect(port=printer['port'], baudrate=printer['baud_rate'])
+    comm._connecting.result(5)
+
+    assert comm._printer_uri == printer['uri']
+    assert printer_pages == []
+
+@pytest.mark.usefixtures('printer_pages')
+def test_printer_uri_forgotten_when_gone(comm, printer, mocker, httpretty):
+    tests.helpers.patch_connect(mocker)
+    comm.connect(port=printer['port'], baudrate=printer['baud_rate'])
+    comm._connecting.result(5)
+    httpretty.register_uri(httpretty.GET, printer['uri'], status=404)
+
+    comm._update_printer_data()
+
+    assert comm._printer_uris == {}
+
+@pytest.yield_fixture
+def slow_claim(mocker):
+    release = threading.Event()
+    tests.helpers.patch_connect(mocker)
+    mocker.patch("octoprint_authentise.comm.helpers.claim_node", side_effect=lambda *args: release.wait(5))
+    yield release
+    release.set()
+
+def test_printer_connect_does_not_block(comm, printer, slow_claim):
+    comm.connect(port=printer['port'], baudrate=printer['baud_rate'])
+
+    assert comm.getState() == _comm.PRINTER_STATE['CONNECTING']
+    assert not comm._connecting.done()
+
+    slow_claim.set()
+    comm._connecting.result(5)
+
+    assert comm._printer_uri == printer['uri']
+    assert comm._monitoring_active
+
+def test_printer_connect_timeout(comm, printer, slow_claim, settings, event_manager):
+    settings.set(['connect_timeout'], 0.05)
+
+    comm.connect(port=printer['port'], baudrate=printer['baud_rate'])
+    time.sleep(0.2)
+
+    assert comm.getState() == _comm.PRINTER_STATE['ERROR']
+    event_manager.fire.assert_called_once_with(Events.ERROR, {'error': 'Timed out connecting to Authentise after 0.05s'})
+
+    slow_claim.set()
+    comm._connecting.result(5)
+
+    assert comm._printer_uri is None
+    assert comm._client_supervisor is None
+    assert comm.getState() == _comm.PRINTER_STATE['ERROR']
+
+def test_printer_connect_closed_while_connecting(comm, printer, slow_claim):
+    comm.connect(port=printer['port'], baudrate=printer['baud_rate'])
+    comm.close()
+
+    slow_claim.set()
+    comm._connecting.result(5)
+
+    assert not comm._monitoring_active
+    assert comm.getState() == _comm.PRINTER_STATE['CLOSED']
+
+@pytest.mark.usefixtures('event_manager')
+def test_printer_connect_printer_error(comm, printer, mocker, httpretty):
+    tests.helpers.patch_connect(mocker)
+    httpretty.register_uri(httpretty.GET, comm._client_printers_url(), status=500, body='Oops')
+
+    comm.connect(port=printer['port'], baudrate=printer['baud_rate'])
+    comm._connecting.result(5)
+
+    assert comm.getState() == _comm.PRINTER_STATE['ERROR']
+    assert comm.getErrorString().startswith('Could not connect to Authentise: ')
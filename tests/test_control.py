@@ -0,0 +1,112 @@
+#pylint: disable=redefined-outer-name, protected-access
+import os
+import signal
+import sys
+import time
+
+import pytest
+
+from octoprint_authentise import control
+
+STUB_CLIENT = os.path.join(os.path.dirname(__file__), 'stub_client.py')
+
+@pytest.fixture
+def client_log(tmpdir, monkeypatch, settings):
+    log = tmpdir.join('client.log')
+    monkeypatch.setenv('STUB_CLIENT_LOG', str(log))
+    # Every test gets its own channel, since channels are shared per client command
+    settings.set(['streamus_config_path'], str(tmpdir.join('config')))
+    settings.set(['streamus_client_path'], [sys.executable, STUB_CLIENT])
+    return log
+
+def _runs(client_log):
+    return client_log.read().split() if client_log.check() else []
+
+def test_query_client_control_channel(settings, client_log, mocker):
+    logger = mocker.Mock()
+
+    answers = [control.query_client(settings, query, logger)
+               for query in ['version', 'node-uuid', 'connection-code', 'node-uuid']]
+
+    assert answers == ['1.2.3', 'some-node-uuid', 'ABC123', 'some-node-uuid']
+    assert _runs(client_log) == ['--control']
+    control.channel(settings).close()
+
+def test_query_client_control_channel_restarts(settings, client_log, mocker):
+    logger = mocker.Mock()
+    assert control.query_client(settings, 'version', logger) == '1.2.3'
+
+    control.channel(settings).close()
+
+    assert control.query_client(settings, 'version', logger) == '1.2.3'
+    assert _runs(client_log) == ['--control', '--control']
+    control.channel(settings).close()
+
+def test_query_client_unsupported_falls_back(settings, client_log, mocker, monkeypatch):
+    monkeypatch.setenv('STUB_CLIENT_NO_CONTROL', '1')
+    logger = mocker.Mock()
+
+    answers = [control.query_client(settings, query, logger) for query in ['version', 'node-uuid', 'version']]
+
+    assert answers == ['1.2.3', 'some-node-uuid', '1.2.3']
+    assert _runs(client_log) == ['--control', '--version', '--node-uuid', '--version']
+    assert control.channel(settings).unsupported
+
+def test_query_client_disabled(settings, client_log, mocker):
+    settings.set(['client_control_channel'], False)
+
+    assert control.query_client(settings, 'connection-code', mocker.Mock()) == 'ABC123'
+    assert _runs(client_log) == ['--connection-code']
+
+@pytest.mark.usefixtures('client_log')
+def test_control_channel_error(settings):
+    channel = control.channel(settings)
+
+    with pytest.raises(control.ControlChannelException) as error:
+        channel.query('not-a-query', timeout=5)
+
+    assert error.value.message == 'Unknown query not-a-query'
+    channel.close()
+
+@pytest.mark.usefixtures('client_log')
+def test_close_kills_client_that_keeps_running(settings, mocker, monkeypatch):
+    monkeypatch.setenv('STUB_CLIENT_IGNORE_EOF', '1')
+    assert control.query_client(settings, 'version', mocker.Mock()) == '1.2.3'
+    channel = control.channel(settings)
+    process = channel._process
+
+    started = time.time()
+    channel.close(timeout=0.1)
+
+    assert time.time() - started < 5
+    assert process.poll() == -signal.SIGKILL
+    control.close_channels()
+
+def test_close_channels(settings, client_log, mocker):
+    assert control.query_client(settings, 'version', mocker.Mock()) == '1.2.3'
+    process = control.channel(settings)._process
+
+    control.close_channels()
+
+    assert process.poll() is not None
+    assert control.query_client(settings, 'version', mocker.Mock()) == '1.2.3'
+    assert _runs(client_log) == ['--control', '--control']
+    control.close_channels()
+
+@pytest.mark.usefixtures('client_log')
+def test_channel_for_another_client_closes_stale_channel(settings, tmpdir, mocker):
+    assert control.query_client(settings, 'version', mocker.Mock()) == '1.2.3'
+    process = control.channel(settings)._process
+
+    settings.set(['streamus_config_path'], str(tmpdir.join('other-config')))
+    control.channel(settings)
+
+    assert process.poll() is not None
+    control.close_channels()
+
+def test_on_shutdown_closes_channels(plugin, mocker):
+    close_channels = mocker.patch('octoprint_authentise.control.close_channels')
+
+    plugin.on_shutdown()
+
+    close_channels.assert_called_once_with()
@@ -0,0 +1,41 @@
+import json
+import sys
+
+import mock
+import requests
+
+from octoprint_authentise import decoding
+
+
+def _response(body):
+    response = requests.Response()
+    response._content = json.dumps(body) #pylint: disable=protected-access
+    response.status_code = 200
+    return response
+
+def test_decode():
+    assert decoding.decode(_response({'resources': [1, 2]})) == {'resources': [1, 2]}
+
+def test_command_resources():
+    body = {'resources': [{'uri': 'a', 'status': 'ok', 'command': 'G28', 'response': 'ok',
+                           'printer': 'https://not-a-real-url.com/printer/instance/abc-123/',
+                           'created': '2016-01-01T00:00:00'}]}
+
+    assert decoding.command_resources(body) is body['resources']
+
+def test_printer_resource():
+    body = {'uri': 'a', 'status': 'ONLINE', 'current_print': None, 'port': '/dev/tty.derp',
+            'client': 'https://not-a-real-url.com/client/abc/', 'printer_model': 'https://not-a-real-url.com/model/9/'}
+
+    assert decoding.printer_resource(body) is body
+    assert decoding.printer_resources({'resources': [body]}) == [body]
+
+def test_backend_fallback():
+    with mock.patch.dict(sys.modules, {'ujson': None, 'simplejson': None}):
+        reload(decoding)
+        backend = decoding.json_backend
+        loaded = decoding.loads('{"a": 1}')
+    reload(decoding)
+
+    assert backend is json
+    assert loaded == {'a': 1}
@@ -1,3 +1,7 @@
+import sys
+import threading
+import time
+
 import pytest
 
 from octoprint_authentise import helpers
@@ -6,35 +10,31 @@ from octoprint_authentise import helpers
 def test_claim_node_no_node_uuid(settings, mocker):
     logger = mocker.Mock()
     with pytest.raises(helpers.ClaimNodeException) as error:
-        helpers.claim_node(None, settings, logger)
+        helpers.claim_node(None, settings, logger, mocker.Mock())
     assert error.value.message == "No Authentise node uuid available to claim"
 
 def test_claim_node_already_claimed(settings, httpretty, mocker, client_uri, node_uuid):
     logger = mocker.Mock()
     httpretty.register_uri(httpretty.GET, client_uri, status=200)
 
-    helpers.claim_node(node_uuid, settings, logger)
+    helpers.claim_node(node_uuid, settings, logger, mocker.Mock())
 
 def test_claim_node_unclaimed_no_claim_code(settings, httpretty, mocker, client_uri, node_uuid):
     logger = mocker.Mock()
     httpretty.register_uri(httpretty.GET, client_uri, status=403)
 
-    mocker.patch('octoprint_authentise.helpers.run_client_and_wait', return_value=None)
-
     with pytest.raises(helpers.ClaimNodeException) as error:
-        helpers.claim_node(node_uuid, settings, logger)
+        helpers.claim_node(node_uuid, settings, logger, mocker.Mock(return_value=None))
     assert error.value.message == "Could not get a claim code from Authentise"
 
 def test_claim_node_unclaimed_bad_claim_code(settings, httpretty, mocker, client_uri, node_uuid, claim_code, claim_code_uri):
     logger = mocker.Mock()
     httpretty.register_uri(httpretty.GET, client_uri, status=403)
 
-    mocker.patch('octoprint_authentise.helpers.run_client_and_wait', return_value=claim_code)
-
     httpretty.register_uri(httpretty.PUT, claim_code_uri, status=404)
 
     with pytest.raises(helpers.ClaimNodeException) as error:
-        helpers.claim_node(node_uuid, settings, logger)
+        helpers.claim_node(node_uuid, settings, logger, mocker.Mock(return_value=claim_code))
 
     assert error.value.message == "Could not use claim code {} for node {}".format(claim_code, node_uuid)
 
@@ -42,11 +42,12 @@ def test_claim_node_unclaimed_good_claim_code(settings, httpretty, mocker, clien
     logger = mocker.Mock()
     httpretty.register_uri(httpretty.GET, client_uri, status=403)
 
-    mocker.patch('octoprint_authentise.helpers.run_client_and_wait', return_value=claim_code)
+    get_claim_code = mocker.Mock(return_value=claim_code)
 
     httpretty.register_uri(httpretty.PUT, claim_code_uri, status=200)
 
-    helpers.claim_node(node_uuid, settings, logger)
+    helpers.claim_node(node_uuid, settings, logger, get_claim_code)
+    get_claim_code.assert_called_once_with()
 
 def test_session_no_api_key(settings):
     settings.set(['api_key'], '')
@@ -73,3 +74,118 @@ def test_session_success(settings):
 
     assert session.auth.username == 'some_api_key'
     assert session.auth.password == 'some_secret'
+
+def test_session_shared(settings):
+    assert helpers.session(settings) is helpers.session(settings)
+
+def test_session_credentials_changed(settings):
+    old_session = helpers.session(settings)
+    settings.set(['api_secret'], 'a-new-secret')
+
+    new_session = helpers.session(settings)
+
+    assert new_session is not old_session
+    assert new_session.auth.password == 'a-new-secret'
+
+def test_session_invalidated(settings):
+    old_session = helpers.session(settings)
+    old_anonymous_session = helpers.anonymous_session()
+
+    helpers.invalidate_sessions()
+
+    assert helpers.session(settings) is not old_session
+    assert helpers.anonymous_session() is not old_anonymous_session
+
+def test_session_pooling(settings):
+    adapter = helpers.session(settings).get_adapter('https://not-a-real-url.com/')
+
+    assert adapter._pool_maxsize == helpers.POOL_MAXSIZE #pylint: disable=protected-access
+    assert adapter.max_retries is helpers.RETRY
+
+def test_anonymous_session_keeps_no_cookies(settings, httpretty, mocker):
+    url = '{}/sessions/'.format(settings.get(["authentise_user_url"]))
+    httpretty.register_uri(httpretty.POST, url, body='{}', status=201, adding_headers={'Set-Cookie': 'session=abc'})
+
+    _, _, cookies = helpers.login(settings, 'user', 'password', mocker.Mock())
+
+    assert cookies['session'] == 'abc'
+    assert not helpers.anonymous_session().cookies
+
+def test_settings_save_invalidates_sessions(plugin, mocker):
+    invalidate_sessions = mocker.patch('octoprint_authentise.settings.helpers.invalidate_sessions')
+
+    plugin.on_settings_save({'frame_src': 'https://somewhere.com/'})
+    assert invalidate_sessions.call_count == 0
+
+    plugin.on_settings_save({'api_key': 'a-new-key'})
+    invalidate_sessions.assert_called_once_with()
+
+def test_single_flight_cache_ttl(mocker, set_time):
+    load = mocker.Mock(side_effect=['code-1', 'code-2'])
+    cache = helpers.SingleFlightCache(load, ttl=60)
+
+    set_time(1000)
+    assert cache.get() == 'code-1'
+    set_time(1059)
+    assert cache.get() == 'code-1'
+    set_time(1060)
+    assert cache.get() == 'code-2'
+    assert load.call_count == 2
+
+def test_single_flight_cache_refresh(mocker):
+    load = mocker.Mock(side_effect=['code-1', 'code-2'])
+    cache = helpers.SingleFlightCache(load, ttl=60)
+
+    assert cache.get() == 'code-1'
+    assert cache.get(refresh=True) == 'code-2'
+    assert cache.get() == 'code-2'
+
+@pytest.mark.parametrize("failure", ['', Exception('client crashed')])
+def test_single_flight_cache_failure_not_cached(mocker, failure):
+    load = mocker.Mock(side_effect=[failure, 'code-1'])
+    cache = helpers.SingleFlightCache(load, ttl=60)
+
+    if isinstance(failure, Exception):
+        with pytest.raises(Exception):
+            cache.get()
+    else:
+        assert cache.get() == ''
+    assert cache.get() == 'code-1'
+
+def test_single_flight_cache_concurrent_callers_share_load():
+    release = threading.Event()
+    calls = []
+    def _load():
+        calls.append(1)
+        release.wait(5)
+        return 'code-{}'.format(len(calls))
+    cache = helpers.SingleFlightCache(_load, ttl=60)
+
+    results = []
+    def _get(refresh):
+        results.append(cache.get(refresh))
+    threads = [threading.Thread(target=_get, args=(refresh,)) for refresh in [False, True, False, True]]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert calls == [1]
+    assert results == ['code-1'] * 4
+
+def test_run_client_and_wait_timeout(settings, mocker):
+    logger = mocker.Mock()
+    settings.set(['streamus_client_path'], [sys.executable, '-c', 'import time; time.sleep(10)'])
+
+    started = time.time()
+    assert helpers.run_client_and_wait(settings, logger, args=['--version'], timeout=0.2) is None
+
+    assert time.time() - started < 5
+    assert logger.warning.called
+
+def test_run_client_and_wait_output(settings, mocker):
+    settings.set(['streamus_client_path'], [sys.executable, '-c', 'print("1.2.3")'])
+
+    assert helpers.run_client_and_wait(settings, mocker.Mock(), args=['--version'], timeout=5) == '1.2.3'
@@ -0,0 +1,25 @@
+import pytest
+
+from octoprint_authentise import lines
+
+
+@pytest.mark.parametrize("line, expected", [
+    ('ok', lines.OK),
+    ('ok N12 P15 B3', lines.OK),
+    ('ok T:70', lines.TEMPERATURE),
+    ('T:23.61 /0 @:0 T0:23.61 /0', lines.TEMPERATURE),
+    ('ok T0:210 /210 T1:0 /0', lines.TEMPERATURE),
+    ('T12:40', lines.TEMPERATURE),
+    ('Error:Printer halted. kill() called!', lines.ERROR),
+    ('!! Heater failure', lines.ERROR),
+    ('echo:busy: processing', lines.BUSY),
+    ('busy: paused for user', lines.BUSY),
+    ('X:0.00 Y:0.00 Z:0.00 E:0.00 Count X:0 Y:0 Z:0', lines.POSITION),
+    ('ok X:10.00 Y:5.00 Z:0.20 E:0.00', lines.POSITION),
+    ('echo:SD card ok', lines.OTHER),
+    ('Tool change', lines.OTHER),
+    ('TX:1', lines.OTHER),
+    ('start', lines.OTHER),
+])
+def test_classify(line, expected):
+    assert lines.classify(line) == expected
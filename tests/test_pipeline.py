@@ -0,0 +1,191 @@
+#pylint: disable=redefined-outer-name
+import threading
+
+import pytest
+
+from octoprint_authentise import pipeline
+
+
+@pytest.fixture
+def sent():
+    return []
+
+def test_pipeline_preserves_order_per_key(sent):
+    _pipeline = pipeline.CommandPipeline(lambda key, items: sent.extend((key, item) for item in items), workers=3)
+    _pipeline.start()
+
+    for i in range(50):
+        _pipeline.submit('printer-a', i)
+        _pipeline.submit('printer-b', i)
+    _pipeline.join()
+    _pipeline.stop()
+
+    assert [item for key, item in sent if key == 'printer-a'] == range(50)
+    assert [item for key, item in sent if key == 'printer-b'] == range(50)
+
+def test_pipeline_full():
+    release = threading.Event()
+    _pipeline = pipeline.CommandPipeline(lambda key, items: release.wait(5), workers=1, max_size=1)
+    _pipeline.start()
+
+    _pipeline.submit('printer-a', 'G28')
+    with pytest.raises(pipeline.PipelineFullException):
+        for _ in range(3):
+            _pipeline.submit('printer-a', 'G28')
+
+    release.set()
+    _pipeline.join()
+    _pipeline.stop()
+
+def test_pipeline_not_running():
+    _pipeline = pipeline.CommandPipeline(lambda key, item: None)
+    with pytest.raises(pipeline.PipelineFullException):
+        _pipeline.submit('printer-a', 'G28')
+
+def test_pipeline_reports_errors(mocker):
+    on_error = mocker.Mock()
+    error = ValueError('boom')
+    def _send(key, items): #pylint: disable=unused-argument
+        raise error
+
+    _pipeline = pipeline.CommandPipeline(_send, on_error=on_error)
+    _pipeline.start()
+    _pipeline.submit('printer-a', 'G28')
+    _pipeline.join()
+    _pipeline.stop()
+
+    on_error.assert_called_once_with('printer-a', ['G28'], error)
+
+def test_pipeline_coalesces_batches(sent):
+    _pipeline = pipeline.CommandPipeline(lambda key, items: sent.append((key, items)), workers=1, batch_window=0.1, batch_size=3)
+    _pipeline.start()
+
+    commands = ['M104 S200', 'M140 S60', 'G28', 'M105', 'G1 X10', 'M84']
+    for item in commands:
+        _pipeline.submit('printer-a', item)
+    _pipeline.submit('printer-b', 'G28')
+    _pipeline.join()
+    _pipeline.stop()
+
+    assert [item for key, items in sent if key == 'printer-a' for item in items] == commands
+    assert [items for key, items in sent if key == 'printer-b'] == [['G28']]
+    assert all(len(items) <= 3 for _, items in sent)
+    assert len(sent) < len(commands)
+
+def test_pipeline_discard(sent):
+    started = threading.Event()
+    release = threading.Event()
+    def _send(key, items):
+        started.set()
+        release.wait(5)
+        sent.extend((key, item) for item in items)
+
+    _pipeline = pipeline.CommandPipeline(_send, workers=1)
+    _pipeline.start()
+    _pipeline.submit('printer-a', 'G28')
+    assert started.wait(5)
+    for item in ['G1 X10', 'G1 X20']:
+        _pipeline.submit('printer-a', item)
+    _pipeline.submit('printer-b', 'G28')
+
+    assert _pipeline.discard('printer-a') == 2
+    release.set()
+    _pipeline.join()
+    _pipeline.stop()
+
+    assert sent == [('printer-a', 'G28'), ('printer-b', 'G28')]
+
+def test_pipeline_pending():
+    started = threading.Event()
+    release = threading.Event()
+    def _send(key, items): #pylint: disable=unused-argument
+        started.set()
+        release.wait(5)
+
+    _pipeline = pipeline.CommandPipeline(_send, workers=1)
+    _pipeline.start()
+    _pipeline.submit('printer-a', 'G28')
+    assert started.wait(5)
+    _pipeline.submit('printer-a', 'G1 X10')
+    _pipeline.submit('printer-b', 'G28')
+
+    assert _pipeline.pending('printer-a') == 2
+    assert _pipeline.pending('printer-b') == 1
+    assert _pipeline.discard('printer-b') == 1
+    assert _pipeline.pending('printer-b') == 0
+    release.set()
+    _pipeline.join()
+    _pipeline.stop()
+
+    assert _pipeline.pending('printer-a') == 0
+
+def test_dispatcher_runs_most_urgent_first():
+    ran = []
+    release = threading.Event()
+    dispatcher = pipeline.PriorityDispatcher(workers=1)
+    dispatcher.start()
+
+    dispatcher.submit(pipeline.CONTROL, release.wait, 5)
+    results = [dispatcher.submit(priority, ran.append, name) for priority, name in [
+        (pipeline.CONTROL, 'pause'),
+        (pipeline.CONTROL, 'cancel'),
+        (pipeline.EMERGENCY, 'M112'),
+    ]]
+    release.set()
+    dispatcher.join()
+    dispatcher.stop()
+
+    assert ran == ['M112', 'pause', 'cancel']
+    assert all(result.done() for result in results)
+
+def test_dispatcher_reports_errors():
+    dispatcher = pipeline.PriorityDispatcher()
+    dispatcher.start()
+    error = ValueError('boom')
+    def _fail():
+        raise error
+
+    result = dispatcher.submit(pipeline.EMERGENCY, _fail)
+    dispatcher.join()
+    dispatcher.stop()
+
+    assert result.exception() is error
+
+def test_dispatcher_not_running():
+    dispatcher = pipeline.PriorityDispatcher()
+    with pytest.raises(pipeline.PipelineFullException):
+        dispatcher.submit(pipeline.CONTROL, lambda: None)
+
+def test_dispatcher_stop_cancels_queued_calls():
+    ran = []
+    release = threading.Event()
+    dispatcher = pipeline.PriorityDispatcher(workers=1)
+    dispatcher.start()
+
+    started = threading.Event()
+    running = dispatcher.submit(pipeline.CONTROL, lambda: started.set() or release.wait(5))
+    assert started.wait(5)
+    queued = dispatcher.submit(pipeline.CONTROL, ran.append, 'cancel')
+    dispatcher.stop()
+    release.set()
+
+    assert running.result(5)
+    assert queued.cancelled()
+    assert ran == []
+
+def test_dispatcher_dispatch_not_running():
+    assert not pipeline.PriorityDispatcher().dispatch(pipeline.CONTROL, lambda: None)
+
+def test_dispatcher_on_error():
+    errors = []
+    dispatcher = pipeline.PriorityDispatcher(on_error=lambda call, error: errors.append(error))
+    dispatcher.start()
+    error = ValueError('boom')
+    def _fail():
+        raise error
+
+    assert dispatcher.dispatch(pipeline.EMERGENCY, _fail)
+    dispatcher.join()
+    dispatcher.stop()
+
+    assert errors == [error]
@@ -0,0 +1,44 @@
+import pytest
+
+from octoprint_authentise import printers
+
+
+@pytest.mark.parametrize("temperatures, expected_tools, expected_bed", [
+    ({'extruder1':{'current':0}}, {0: [0, None]}, None),
+    ({'extruder1':{'current':180.9, 'target':200}}, {0: [180.9, 200]}, None),
+    ({'extruder1':{'current':180.9}, 'bed':{'current':30.5, 'target':50.1}}, {0: [180.9, None]}, [30.5, 50.1]),
+    ({}, {0: [None, None]}, None),
+])
+def test_parse_temperatures(temperatures, expected_tools, expected_bed):
+    assert printers.parse_temperatures(temperatures) == (expected_tools, expected_bed)
+
+def test_printer_status_update():
+    status = printers.PrinterStatus('https://not-a-real-url.com/printer/instance/abc-123/', '/dev/tty.derp', 250000)
+
+    status.update({'status': 'ONLINE',
+                   'name': 'Printer 1',
+                   'temperatures': {'extruder1': {'current': 185.9}},
+                   'current_print': {'status': 'WARMING_UP', 'job_uri': 'http://some-job-uri.com/',
+                                     'percent_complete': 0, 'elapsed': 3, 'remaining': 100}}, 10)
+
+    assert status.as_dict() == {
+        'uri'           : 'https://not-a-real-url.com/printer/instance/abc-123/',
+        'port'          : '/dev/tty.derp',
+        'baud_rate'     : 250000,
+        'name'          : 'Printer 1',
+        'status'        : 'online',
+        'print_status'  : 'warming_up',
+        'print_job_uri' : 'http://some-job-uri.com/',
+        'tools'         : {0: [185.9, None]},
+        'bed'           : None,
+        'progress'      : {'percent_complete': 0, 'elapsed': 3, 'remaining': 100},
+        'updated'       : 10,
+    }
+
+    status.update({'status': 'OFFLINE', 'current_print': {'status': 'new'}}, 20)
+
+    assert status.status == 'offline'
+    assert status.print_status is None
+    assert status.progress is None
+    assert status.tools == {0: [185.9, None]}
+    assert status.updated == 20
@@ -0,0 +1,118 @@
+#pylint: disable=redefined-outer-name, protected-access
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from octoprint_authentise import helpers
+
+
+@pytest.fixture
+def client(tmpdir, settings):
+    client_path = tmpdir.join('authentise')
+    client_path.write('#!/bin/sh\n')
+    settings.set(['streamus_client_path'], str(client_path))
+    return client_path
+
+@pytest.fixture
+def startup_plugin(plugin, tmpdir, client): #pylint: disable=unused-argument
+    plugin.get_plugin_data_folder = lambda: str(tmpdir)
+    return plugin
+
+@pytest.fixture
+def run_client_and_wait(mocker):
+    outputs = {'--version': '1.2.3', '--node-uuid': 'some-node-uuid'}
+    return mocker.patch('octoprint_authentise.helpers.run_client_and_wait',
+                        side_effect=lambda settings, args, logger, timeout: outputs[args[0]])
+
+def _probes(run_client_and_wait):
+    # call_count is updated racily when the probes run at once, the list of calls isn't
+    return sorted(call[1]['args'][0] for call in run_client_and_wait.call_args_list)
+
+def _start(startup_plugin):
+    startup_plugin.on_after_startup()
+    if startup_plugin._node_identity_cached:
+        startup_plugin._node_identity_cached.result(5)
+
+def test_on_after_startup_without_cache(startup_plugin, run_client_and_wait, tmpdir, settings):
+    _start(startup_plugin)
+
+    assert _probes(run_client_and_wait) == ['--node-uuid', '--version']
+    assert startup_plugin.node_version == '1.2.3'
+    assert startup_plugin.node_uuid == 'some-node-uuid'
+
+    cached = json.loads(tmpdir.join(helpers.NODE_IDENTITY_FILE).read())
+    assert cached['fingerprint'] == helpers.client_fingerprint(settings)
+
+def test_on_after_startup_with_cache(startup_plugin, run_client_and_wait, plugin):
+    _start(startup_plugin)
+    run_client_and_wait.reset_mock()
+    plugin.node_uuid = plugin.node_version = None
+    plugin._node_identity_cached = None
+
+    _start(startup_plugin)
+
+    assert run_client_and_wait.call_count == 0
+    assert startup_plugin.node_version == '1.2.3'
+    assert startup_plugin.node_uuid == 'some-node-uuid'
+
+def test_on_after_startup_client_changed(startup_plugin, run_client_and_wait, client):
+    _start(startup_plugin)
+    run_client_and_wait.reset_mock()
+    startup_plugin._node_identity_cached = None
+    stat = os.stat(str(client))
+    os.utime(str(client), (stat.st_atime, stat.st_mtime + 10))
+
+    _start(startup_plugin)
+
+    assert _probes(run_client_and_wait) == ['--node-uuid', '--version']
+
+def test_on_after_startup_nothing_cached_on_failure(startup_plugin, mocker, tmpdir):
+    mocker.patch('octoprint_authentise.helpers.run_client_and_wait', return_value='')
+
+    _start(startup_plugin)
+
+    assert not startup_plugin.node_uuid
+    assert not tmpdir.join(helpers.NODE_IDENTITY_FILE).check()
+
+@pytest.mark.parametrize("contents", ['', 'not json', '[]', '{"fingerprint": null}'])
+def test_load_node_identity_invalid(tmpdir, settings, contents):
+    path = tmpdir.join(helpers.NODE_IDENTITY_FILE)
+    path.write(contents)
+
+    assert helpers.load_node_identity(str(path), helpers.client_fingerprint(settings)) is None
+
+def test_probes_run_concurrently(startup_plugin, mocker):
+    started = threading.Event()
+    release = threading.Event()
+    def _run_client_and_wait(settings, args, logger, timeout): #pylint: disable=unused-argument
+        if args == ['--version']:
+            return '1.2.3' if started.wait(1) else None
+        started.set()
+        release.wait(5)
+        return 'some-node-uuid'
+    mocker.patch('octoprint_authentise.helpers.run_client_and_wait', side_effect=_run_client_and_wait)
+
+    startup_plugin.on_after_startup()
+
+    assert startup_plugin.node_version == '1.2.3'
+    release.set()
+    assert startup_plugin.node_uuid == 'some-node-uuid'
+
+def test_probe_timeout(startup_plugin, settings, mocker):
+    release = threading.Event()
+    run_client_and_wait = mocker.patch('octoprint_authentise.helpers.run_client_and_wait',
+                                       side_effect=lambda *args, **kwargs: release.wait(5))
+    settings.set(['client_control_channel'], False)
+    settings.set(['client_probe_timeout'], 0.05)
+
+    startup_plugin.on_after_startup()
+
+    assert startup_plugin.node_uuid is None
+    started = time.time()
+    assert startup_plugin.node_uuid is None
+    assert time.time() - started < 0.05
+    release.set()
+    assert run_client_and_wait.call_args[1]['timeout'] == 0.05
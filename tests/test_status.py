@@ -0,0 +1,305 @@
+#pylint: disable=line-too-long, protected-access
+import json
+import threading
+
+import mock
+import pytest
+import requests
+
+import tests.helpers
+from octoprint_authentise import comm as _comm
+
+
+@pytest.mark.parametrize("response, expected_state", [
+    ({'status': 'new'     , 'current_print': {'status':'new'}}        , _comm.PRINTER_STATE['CONNECTING']),
+    ({'status': 'OFFLINE' , 'current_print': None}                    , _comm.PRINTER_STATE['CONNECTING']),
+    ({'status': 'ONLINE'  , 'current_print': None}                    , _comm.PRINTER_STATE['OPERATIONAL']),
+    ({'status': 'ONLINE'  , 'current_print': {'status':'new'}}        , _comm.PRINTER_STATE['OPERATIONAL']),
+    ({'status': 'ONLINE'  , 'current_print': {'status':'PRINTING'}}   , _comm.PRINTER_STATE['PRINTING']),
+    ({'status': 'ONLINE'  , 'current_print': {'status':'WARMING_UP'}} , _comm.PRINTER_STATE['PRINTING']),
+    ({'status': 'ONLINE'  , 'current_print': {'status':'PAUSED'}}     , _comm.PRINTER_STATE['PAUSED']),
+    ({'status': 'ONLINE'  , 'current_print': {'status':'WAT?'}}       , _comm.PRINTER_STATE['OFFLINE']),
+])
+def test_update_state(response, expected_state, comm):
+    comm._state = _comm.PRINTER_STATE['OFFLINE']
+    comm._update_state(response)
+    assert comm._state == expected_state
+
+@pytest.mark.parametrize("response, expected_progress, expected_callback", [
+    ({'current_print': {'status':'new'}}, None, [None, None, None, None]),
+    ({'current_print': {'status':'PRINTING', 'percent_complete': 23.55, 'elapsed': 54, 'remaining': 66.3}}, {'percent_complete': 0.2355, 'elapsed': 54, 'remaining': 66.3}, [23.55, 2355, 54, 66.3]),
+    ({'current_print': {'status':'WARMING_UP', 'percent_complete': 43.1, 'elapsed': 40, 'remaining': 66.3}}, {'percent_complete': 0.431, 'elapsed': 40, 'remaining': 66.3}, [43.1, 4310, 40, 66.3]),
+    ({'current_print': {'status':'PAUSED', 'percent_complete': 23.56, 'elapsed': 54, 'remaining': 66.3}}, {'percent_complete': 0.2356, 'elapsed': 54, 'remaining': 66.3}, [23.56, 2356, 54, 66.3]),
+])
+def test_update_progress(response, expected_progress, expected_callback, comm, assert_almost_equal):
+    comm._update_progress(response)
+    assert_almost_equal(comm._print_progress, expected_progress)
+    comm._callback.on_comm_set_progress_data.assert_called_once_with(*expected_callback)
+
+@pytest.mark.parametrize("response, expected_temps, expected_bed", [
+    ({'temperatures':{'extruder1':{'current':0}}}, {0: [0, None]}, None),
+    ({'temperatures':{'extruder1':{'current':180.9, 'target':200}}}, {0: [180.9, 200]}, None),
+    ({'temperatures':{'extruder1':{'current':180.9}, 'bed':{'current':30.5, 'target':50.1}}}, {0: [180.9, None]}, [30.5, 50.1]),
+])
+def test_update_temps(response, expected_temps, expected_bed, comm):
+    comm._update_temps(response)
+    assert comm._tool_tempuratures == expected_temps
+    assert comm._bed_tempurature == expected_bed
+
+@pytest.mark.usefixtures('connect_printer')
+def test_update_printer_data_ok_response(comm, httpretty, assert_almost_equal):
+    comm._state = _comm.PRINTER_STATE['CONNECTING']
+    comm._tool_tempuratures = None
+    comm._bed_tempurature = None
+    comm._print_progress = None
+
+    printer_payload = {"baud_rate": 250000,
+                       "port": "/dev/tty.derp",
+                       "uri": comm._printer_uri,
+                       'status': 'ONLINE',
+                       'temperatures':{'extruder1': {'current':185.9}},
+                       'current_print': {
+                           'status': 'PRINTING',
+                           'percent_complete': 10.55,
+                           'elapsed': 30,
+                           'remaining': 0.4,
+                           'job_uri': 'http://some-job-uri.com/',
+                       }}
+
+    httpretty.register_uri(httpretty.GET,
+                           comm._printer_uri,
+                           status=200,
+                           body=json.dumps(printer_payload),
+                           content_type='application/json')
+
+    comm._update_printer_data()
+
+    assert comm._state == _comm.PRINTER_STATE['PRINTING']
+    assert comm._tool_tempuratures == {0: [185.9, None]}
+    assert comm._bed_tempurature == None
+    assert comm._print_job_uri == 'http://some-job-uri.com/'
+    assert_almost_equal(comm._print_progress, {'percent_complete': 0.1055, 'elapsed': 30, 'remaining': 0.4})
+
+@pytest.mark.usefixtures('connect_printer')
+def test_update_printer_data_not_printing(comm, httpretty):
+    comm._state = _comm.PRINTER_STATE['CONNECTING']
+    comm._tool_tempuratures = None
+    comm._bed_tempurature = None
+    comm._print_progress = None
+    comm._print_job_uri = 'http://some-job-uri.com/'
+
+    printer_payload = {"baud_rate": 250000,
+                       "port": "/dev/tty.derp",
+                       "uri": comm._printer_uri,
+                       'status': 'ONLINE',
+                       'temperatures':{'extruder1': {'current':185.9}},
+                       'current_print': None}
+
+    httpretty.register_uri(httpretty.GET,
+                           comm._printer_uri,
+                           status=200,
+                           body=json.dumps(printer_payload),
+                           content_type='application/json')
+
+    comm._update_printer_data()
+
+    assert comm._state == _comm.PRINTER_STATE['OPERATIONAL']
+    assert comm._tool_tempuratures == {0: [185.9, None]}
+    assert comm._bed_tempurature == None
+    assert comm._print_job_uri == None
+    assert comm._print_progress == None
+
+@pytest.mark.usefixtures('connect_printer')
+def test_update_printer_data_bad_response(comm, httpretty):
+    comm._state = _comm.PRINTER_STATE['CONNECTING']
+    comm._tool_tempuratures = None
+    comm._bed_tempurature = None
+    comm._print_progress = None
+
+    printer_payload = {}
+
+    httpretty.register_uri(httpretty.GET,
+                           comm._printer_uri,
+                           status=400,
+                           body=json.dumps(printer_payload),
+                           content_type='application/json')
+
+    comm._update_printer_data()
+
+    assert comm._state == _comm.PRINTER_STATE['CONNECTING']
+    assert comm._tool_tempuratures == None
+    assert comm._bed_tempurature == None
+    assert comm._print_progress == None
+    assert comm._print_job_uri == None
+
+@pytest.mark.usefixtures('connect_printer')
+def test_update_printer_data_timeout(comm, mocker):
+    comm._state = _comm.PRINTER_STATE['OPERATIONAL']
+    get = mocker.patch.object(comm._session, 'get', side_effect=requests.exceptions.ReadTimeout("Read timed out"))
+
+    comm._update_printer_data()
+
+    assert get.call_args[1]['timeout'] == (3.05, 10)
+    assert comm._state == _comm.PRINTER_STATE['OPERATIONAL']
+
+@pytest.mark.usefixtures('connect_printer')
+def test_update_printer_data_not_modified(comm, httpretty):
+    printer_payload = {'status': 'ONLINE',
+                       'temperatures': {'extruder1': {'current': 185.9}},
+                       'current_print': None}
+
+    httpretty.register_uri(httpretty.GET,
+                           comm._printer_uri,
+                           responses=[
+                               httpretty.Response(json.dumps(printer_payload), status=200, adding_headers={'ETag': '"abc"'}),
+                               httpretty.Response('', status=304),
+                           ],
+                           content_type='application/json')
+
+    comm._update_printer_data()
+    assert 'If-None-Match' not in httpretty.last_request().headers
+    comm._callback.reset_mock()
+
+    comm._update_printer_data()
+    assert httpretty.last_request().headers['If-None-Match'] == '"abc"'
+    assert comm._state == _comm.PRINTER_STATE['OPERATIONAL']
+    assert comm._callback.on_comm_temperature_update.call_count == 0
+    assert comm._callback.on_comm_set_progress_data.call_count == 0
+
+def test_update_temps_only_dispatches_changes(comm):
+    comm._update_temps({'temperatures':{'extruder1':{'current':180.9, 'target':200}}})
+    comm._update_temps({'temperatures':{'extruder1':{'current':180.9, 'target':200}}})
+    comm._update_temps({'temperatures':{'extruder1':{'current':181.2, 'target':200}}})
+
+    assert comm._callback.on_comm_temperature_update.call_args_list == [
+        mock.call({0: [180.9, 200]}, None),
+        mock.call({0: [181.2, 200]}, None),
+    ]
+
+def test_update_progress_only_dispatches_changes(comm):
+    current_print = {'status':'PRINTING', 'percent_complete': 23.55, 'elapsed': 54, 'remaining': 66.3}
+    comm._update_progress({'current_print': current_print})
+    comm._update_progress({'current_print': current_print})
+    comm._update_progress({'current_print': None})
+    comm._update_progress({'current_print': None})
+
+    assert comm._callback.on_comm_set_progress_data.call_args_list == [
+        mock.call(23.55, 2355, 54, 66.3),
+        mock.call(None, None, None, None),
+    ]
+
+@pytest.mark.parametrize("state, print_status, fast_until, previous_interval, expected_interval", [
+    ('OPERATIONAL' , None         , 0   , None , 20),
+    ('OPERATIONAL' , None         , 0   , 20   , 40),
+    ('OPERATIONAL' , None         , 0   , 40   , 60),
+    ('CONNECTING'  , None         , 0   , 60   , 60),
+    ('PRINTING'    , 'printing'   , 0   , 60   , 10),
+    ('PAUSED'      , 'paused'     , 0   , 60   , 10),
+    ('PRINTING'    , 'warming_up' , 0   , 10   , 1),
+    ('OPERATIONAL' , None         , 110 , 60   , 1),
+    ('OPERATIONAL' , None         , 90  , 1    , 10),
+])
+def test_status_poll_interval(state, print_status, fast_until, previous_interval, expected_interval, comm, set_time): #pylint: disable=too-many-arguments
+    set_time(100)
+    comm._state = _comm.PRINTER_STATE[state]
+    comm._current_print_status = print_status
+    comm._status_fast_until = fast_until
+    comm._status_interval = previous_interval
+
+    assert comm._status_poll_interval() == expected_interval
+
+@pytest.mark.usefixtures('connect_printer')
+def test_send_pause_cancel_request_polls_soon(comm, httpretty, set_time, mocker):
+    set_time(100)
+    comm._state = _comm.PRINTER_STATE['PRINTING']
+    comm._print_job_uri = 'http://test.uri.com/job/1234/'
+    comm._status_interval = 60
+    httpretty.register_uri(httpretty.PUT, comm._print_job_uri, status=204)
+    old_timer = comm._printer_status_timer
+    repeated_timer = mocker.patch('octoprint_authentise.comm.RepeatedTimer')
+
+    comm._send_pause_cancel_request('cancel')
+
+    old_timer.cancel.assert_called_once_with()
+    assert comm._status_fast_until == 100 + _comm.STATUS_TRANSITION_WINDOW
+    repeated_timer.return_value.start.assert_called_once_with()
+
+@pytest.mark.usefixtures('connect_printer')
+def test_poll_status_soon_after_close(comm, mocker):
+    comm._status_interval = 60
+    comm.close()
+    repeated_timer = mocker.patch('octoprint_authentise.comm.RepeatedTimer')
+
+    comm._poll_status_soon()
+
+    assert comm._printer_status_timer is None
+    assert not repeated_timer.called
+
+@pytest.mark.usefixtures('connect_printer')
+def test_poll_status_soon_while_streaming(comm, mocker):
+    comm._status_interval = 60
+    timer = comm._printer_status_timer
+    comm._printer_status_stream = mocker.Mock()
+    repeated_timer = mocker.patch('octoprint_authentise.comm.RepeatedTimer')
+
+    comm._poll_status_soon()
+
+    assert not timer.cancel.called
+    assert not repeated_timer.called
+
+def _falls_back_to_polling(mocker):
+    polling = threading.Event()
+    mocker.patch('octoprint_authentise.comm.RepeatedTimer').return_value.start.side_effect = polling.set
+    return polling
+
+def test_update_printer_data_streaming(comm, printer, settings, httpretty, mocker):
+    events = [
+        tests.helpers.printer_event('OFFLINE'),
+        tests.helpers.printer_event('ONLINE'),
+        tests.helpers.printer_event('ONLINE', {'status': 'PRINTING', 'percent_complete': 10.55, 'elapsed': 30, 'remaining': 0.4,
+                                  'job_uri': 'http://some-job-uri.com/'}),
+    ]
+    httpretty.register_uri(httpretty.GET,
+                           printer['uri'],
+                           body=''.join('data: {}\n\n'.format(json.dumps(event)) for event in events),
+                           content_type='text/event-stream')
+    settings.set(['status_streaming'], True)
+    tests.helpers.patch_connect(mocker)
+    polling = _falls_back_to_polling(mocker)
+
+    comm.connect(port=printer['port'], baudrate=printer['baud_rate'])
+
+    assert polling.wait(5)
+
+    assert httpretty.last_request().headers['Accept'] == 'text/event-stream'
+    assert comm._state == _comm.PRINTER_STATE['PRINTING']
+    assert comm._print_job_uri == 'http://some-job-uri.com/'
+    assert comm._tool_tempuratures == {0: [185.9, None]}
+    comm._printer_status_timer.start.assert_called_once_with()
+
+@pytest.mark.usefixtures('printer')
+def test_update_printer_data_streaming_unsupported(comm, settings, mocker):
+    settings.set(['status_streaming'], True)
+    tests.helpers.patch_connect(mocker)
+    polling = _falls_back_to_polling(mocker)
+
+    comm.connect(port='/dev/tty.derp', baudrate=250000)
+
+    assert polling.wait(5)
+
+    comm._printer_status_timer.start.assert_called_once_with()
+
+def test_update_printer_data_no_print_uri(comm):
+    comm._state = _comm.PRINTER_STATE['CONNECTING']
+    comm._printer_uri = None
+    comm._tool_tempuratures = None
+    comm._bed_tempurature = None
+    comm._print_progress = None
+
+    comm._update_printer_data()
+
+    assert comm._state == _comm.PRINTER_STATE['CONNECTING']
+    assert comm._tool_tempuratures == None
+    assert comm._bed_tempurature == None
+    assert comm._print_progress == None
+    assert comm._print_job_uri == None
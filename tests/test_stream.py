@@ -0,0 +1,47 @@
+#pylint: disable=protected-access
+import pytest
+
+from octoprint_authentise import stream
+
+
+@pytest.mark.parametrize("lines, expected", [
+    (['data: {"a": 1}', ''], ['{"a": 1}']),
+    (['data: {"a": 1}', '', 'data: {"b": 2}', ''], ['{"a": 1}', '{"b": 2}']),
+    ([': keep-alive', '', 'event: printer', 'data: {"a":', 'data: 1}', ''], ['{"a":\n1}']),
+    (['data:{"a": 1}'], ['{"a": 1}']),
+    (['', '', ': keep-alive'], []),
+])
+def test_iter_events(lines, expected):
+    assert list(stream.iter_events(lines)) == expected
+
+def _stream_response(mocker, lines):
+    response = mocker.Mock(ok=True, headers={'Content-Type': stream.EVENT_STREAM_CONTENT_TYPE})
+    response.iter_lines.return_value = iter(lines)
+    return response
+
+def test_stream_reads_events_unbuffered(mocker):
+    session = mocker.Mock()
+    session.get.return_value = _stream_response(mocker, ['data: {"uri": "a", "status": "ONLINE"}', ''])
+    on_data, on_failure = mocker.Mock(), mocker.Mock()
+    status_stream = stream.PrinterStatusStream(session, 'https://not-a-real-url.com/printer/instance/a/', on_data, on_failure)
+    status_stream._running = True
+
+    status_stream._run()
+
+    session.get.return_value.iter_lines.assert_called_once_with(chunk_size=1)
+    on_data.assert_called_once_with({'uri': 'a', 'status': 'ONLINE'})
+    on_failure.assert_called_once_with('Printer status stream from https://not-a-real-url.com/printer/instance/a/ ended')
+
+def test_stream_handler_error(mocker):
+    session = mocker.Mock()
+    session.get.return_value = _stream_response(mocker, ['data: {"uri": "a"}', ''])
+    on_failure = mocker.Mock()
+    status_stream = stream.PrinterStatusStream(session, 'https://not-a-real-url.com/printer/instance/a/',
+                                               mocker.Mock(side_effect=KeyError('current_print')), on_failure)
+    status_stream._running = True
+
+    status_stream._run()
+
+    assert on_failure.call_count == 1
+    assert 'failed' in on_failure.call_args[0][0]
+    assert session.get.return_value.close.called
@@ -0,0 +1,105 @@
+#pylint: disable=redefined-outer-name, protected-access
+import sys
+import threading
+import time
+
+import pytest
+
+from octoprint_authentise import supervisor
+
+
+def _client(script):
+    return [sys.executable, '-c', script]
+
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+@pytest.yield_fixture
+def supervise(mocker):
+    supervisors = []
+    def _supervise(script, **kwargs):
+        kwargs.setdefault('on_exit', mocker.Mock())
+        client_supervisor = supervisor.ClientSupervisor(_client(script), **kwargs)
+        supervisors.append(client_supervisor)
+        client_supervisor.start()
+        return client_supervisor
+    yield _supervise
+    for client_supervisor in supervisors:
+        client_supervisor.stop()
+
+def test_restarts_crashed_client(supervise):
+    client_supervisor = supervise("import sys; sys.stderr.write('boom\\n'); sys.exit(3)", backoff=0.01)
+
+    _wait_for(lambda: client_supervisor.metrics()['starts'] >= 3)
+    client_supervisor.stop()
+
+    metrics = client_supervisor.metrics()
+    assert metrics['crashes'] >= 2
+    assert metrics['last_exit_code'] == 3
+    assert metrics['last_restart_latency'] >= 0.01
+    client_supervisor._on_exit.assert_any_call(3, ['boom'])
+
+@pytest.mark.parametrize("stable_after, expected_delays", [
+    (60, [0.5, 1, 2, 2, 2]),
+    (0, [0, 0, 0, 0, 0]),
+])
+def test_restart_backoff(stable_after, expected_delays):
+    client_supervisor = supervisor.ClientSupervisor(_client("import sys; sys.exit(1)"),
+                                                    backoff=0.5, max_backoff=2, stable_after=stable_after)
+    delays = []
+    def _wait(delay):
+        delays.append(delay)
+        if len(delays) == len(expected_delays):
+            client_supervisor._stopped.set()
+    client_supervisor._stopped.wait = _wait
+
+    client_supervisor.start()
+    client_supervisor._thread.join(10)
+
+    assert delays == expected_delays
+    assert client_supervisor.metrics()['starts'] == len(expected_delays)
+
+def test_stderr_ring_buffer(supervise):
+    client_supervisor = supervise("import sys\nfor i in range(50): sys.stderr.write('line %d\\n' % i)\nsys.exit(1)",
+                                  backoff=10, stderr_lines=10)
+
+    _wait_for(lambda: client_supervisor.metrics()['crashes'] == 1)
+
+    assert client_supervisor.stderr() == ['line {}'.format(i) for i in range(40, 50)]
+
+def test_on_exit_gets_all_stderr(supervise, mocker):
+    exited = threading.Event()
+    on_exit = mocker.Mock(side_effect=lambda returncode, stderr: exited.set())
+    supervise("import sys\nfor i in range(500): sys.stderr.write('line %d\\n' % i)\nsys.exit(3)",
+              backoff=10, stderr_lines=10, on_exit=on_exit)
+
+    assert exited.wait(5)
+
+    on_exit.assert_called_once_with(3, ['line {}'.format(i) for i in range(490, 500)])
+
+def test_stop_interrupts_client(supervise):
+    client_supervisor = supervise("import time; time.sleep(30)")
+    _wait_for(lambda: client_supervisor.metrics()['running'])
+    process = client_supervisor._process
+
+    client_supervisor.stop(timeout=5)
+
+    assert process.poll() is not None
+    assert not client_supervisor.metrics()['running']
+    assert client_supervisor.metrics()['crashes'] == 0
+    assert client_supervisor._on_exit.call_count == 0
+
+def test_stop_kills_stuck_client(supervise):
+    client_supervisor = supervise("import signal, sys, time\n"
+                                  "signal.signal(signal.SIGINT, signal.SIG_IGN)\n"
+                                  "sys.stderr.write('ready\\n')\n"
+                                  "time.sleep(30)")
+    _wait_for(lambda: client_supervisor.stderr() == ['ready'])
+    process = client_supervisor._process
+
+    client_supervisor.stop(timeout=0.2)
+
+    assert process.poll() == -9
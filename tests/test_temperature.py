@@ -0,0 +1,25 @@
+import pytest
+
+from octoprint_authentise import temperature
+
+
+@pytest.mark.parametrize("tools, bed, expected", [
+    ({0: [210, 215]}, [60, 60.5], 'ok T:210.0 /215.0 B:60.0 /60.5'),
+    ({0: [21.04, None]}, None, 'ok T:21.0'),
+    ({0: [21, 0]}, [None, None], 'ok T:21.0 /0.0'),
+    ({0: [210, 215], 1: [190, 200]}, None, 'ok T:210.0 /215.0 T0:210.0 /215.0 T1:190.0 /200.0'),
+    ({0: [None, 215]}, [60, 60], None),
+    ({}, None, None),
+    (None, None, None),
+])
+def test_format_temps(tools, bed, expected):
+    assert temperature.format_temps(tools, bed) == expected
+
+def test_format_temps_parses():
+    report = temperature.format_temps({0: [210, 215], 1: [190, None]}, [60, 65])
+
+    assert temperature.parse_temps(report) == {
+        'tools': [{'actual': 210, 'target': 215}, {'actual': 190, 'target': None}],
+        'bed': {'actual': 60, 'target': 65},
+        'chamber': None,
+    }
@@ -0,0 +1,128 @@
+import threading
+import time
+
+from octoprint_authentise import tracker
+
+
+def _resource(uri, status, response=''):
+    return {'uri': uri, 'command': 'G28', 'response': response, 'status': status}
+
+def test_tracker_due():
+    _tracker = tracker.CommandTracker(poll_interval=2, backoff=1)
+    _tracker.add('a', 0)
+    _tracker.add('b', 1)
+
+    assert _tracker.due(1) == []
+    assert _tracker.due(2) == ['a']
+    assert _tracker.due(3) == ['b']
+    assert _tracker.due(3) == []
+    assert _tracker.due(5) == ['a', 'b']
+
+def test_tracker_backoff():
+    _tracker = tracker.CommandTracker(poll_interval=1, backoff=2, max_interval=4)
+    _tracker.add('a', 0)
+
+    polls = [now for now in range(20) if _tracker.due(now)]
+    assert polls == [1, 3, 7, 11, 15, 19]
+
+def test_tracker_only_returns_due_commands():
+    _tracker = tracker.CommandTracker(poll_interval=1, backoff=2, max_interval=8)
+    _tracker.add('a', 0)
+    for now in [1, 3, 7]:
+        _tracker.due(now)
+    _tracker.add('b', 7)
+
+    assert _tracker.due(8) == ['b']
+    assert sorted(_tracker.due(15)) == ['a', 'b']
+
+def test_tracker_expires_commands():
+    _tracker = tracker.CommandTracker(expiry=120)
+    _tracker.add('a', 0)
+    _tracker.add('b', 100)
+
+    assert _tracker.due(120) == ['b']
+    assert len(_tracker) == 1
+
+def test_tracker_submission_order():
+    _tracker = tracker.CommandTracker()
+    for uri in ['a', 'b', 'c']:
+        _tracker.add(uri, 0)
+
+    _tracker.update([_resource('b', 'ok', 'ok B'), _resource('c', 'error')])
+    assert _tracker.pop() is None
+
+    _tracker.update([_resource('a', 'ok', 'ok A')])
+    assert _tracker.pop()['response'] == 'ok A'
+    assert _tracker.pop()['response'] == 'ok B'
+    assert _tracker.pop() is None
+    assert len(_tracker) == 0
+
+def test_tracker_ignores_unknown_commands():
+    _tracker = tracker.CommandTracker()
+    _tracker.add('a', 0)
+
+    _tracker.update([_resource('z', 'ok', 'ok')])
+    assert _tracker.pop() is None
+    assert len(_tracker) == 1
+
+def test_tracker_wait_returns_when_response_ready():
+    _tracker = tracker.CommandTracker()
+    _tracker.add('a', 0)
+    _tracker.update([_resource('a', 'ok', 'ok')])
+
+    start = time.time()
+    _tracker.wait(start, timeout=5)
+    assert time.time() - start < 1
+
+def test_tracker_wait_until_next_due():
+    _tracker = tracker.CommandTracker(poll_interval=2)
+    now = time.time()
+    _tracker.add('a', now - 1.9)
+
+    _tracker.wait(now, timeout=5)
+    assert 0.05 < time.time() - now < 1
+
+def test_tracker_wait_wakes_on_add():
+    _tracker = tracker.CommandTracker()
+    adder = threading.Timer(0.1, _tracker.add, args=('a', 0))
+    adder.start()
+
+    start = time.time()
+    _tracker.wait(start, timeout=5)
+    assert time.time() - start < 1
+    adder.join()
+
+def test_tracker_wait_wakes_on_stop():
+    _tracker = tracker.CommandTracker()
+    stopper = threading.Timer(0.1, _tracker.stop)
+    stopper.start()
+
+    start = time.time()
+    _tracker.wait(start)
+    assert time.time() - start < 1
+    stopper.join()
+
+    _tracker.wait(time.time())
+
+def test_tracker_add_resolved_keeps_order():
+    _tracker = tracker.CommandTracker()
+    _tracker.add('a', 0)
+    _tracker.add_resolved({'command': 'M105', 'response': 'ok T:20.0'})
+
+    assert _tracker.pop() is None
+
+    _tracker.update([_resource('a', 'ok', 'ok')])
+
+    assert _tracker.pop()['uri'] == 'a'
+    assert _tracker.pop()['response'] == 'ok T:20.0'
+    assert _tracker.pop() is None
+
+def test_tracker_add_resolved_wakes_waiters():
+    _tracker = tracker.CommandTracker()
+    waiter = threading.Thread(target=_tracker.wait, args=(0,))
+    waiter.start()
+
+    _tracker.add_resolved({'command': 'M105', 'response': 'ok T:20.0'})
+    waiter.join(1)
+
+    assert not waiter.is_alive()
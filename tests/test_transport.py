@@ -0,0 +1,254 @@
+#pylint: disable=redefined-outer-name, protected-access, unused-argument
+import datetime
+import email.utils
+import threading
+import time
+
+import mock
+import pytest
+import requests
+
+from octoprint_authentise import transport
+
+
+def _response(elapsed, body='{}'):
+    response = mock.Mock(spec=requests.Response)
+    response.status_code = 200
+    response.elapsed = datetime.timedelta(seconds=elapsed)
+    response.content = body
+    return response
+
+def _warm_up(policy, endpoint, elapsed=0.01):
+    with mock.patch.object(policy._session, 'get', return_value=_response(elapsed)):
+        for _ in range(transport.HEDGE_MIN_SAMPLES):
+            policy.get(endpoint, 'https://not-a-real-url.com/')
+
+@pytest.yield_fixture
+def policy(settings):
+    # Warming up the latencies takes more requests than the rate limit lets through at once
+    settings.set(['http_rate_limit'], 0)
+    session = mock.Mock(spec=requests.Session)
+    policy = transport.RequestPolicy(session, settings)
+    yield policy
+    policy.close()
+
+def test_timeout_defaults(settings):
+    assert transport.timeout(settings, 'status') == (transport.HTTP_CONNECT_TIMEOUT, 10)
+    assert transport.timeout(settings, 'printers') == (transport.HTTP_CONNECT_TIMEOUT, 30)
+    assert transport.timeout(settings, 'not-a-kind-of-request') == (transport.HTTP_CONNECT_TIMEOUT, 30)
+
+def test_timeout_settings(settings):
+    settings.set(['http_connect_timeout'], 1.5)
+    settings.set(['http_read_timeouts'], {'status': 2})
+
+    assert transport.timeout(settings, 'status') == (1.5, 2)
+    assert transport.timeout(settings, 'command') == (1.5, 10)
+
+def test_send_passes_timeout(policy):
+    policy._session.post.return_value = _response(0.01)
+
+    policy.post('command', 'https://not-a-real-url.com/', json={'command': 'M105'})
+
+    policy._session.post.assert_called_once_with('https://not-a-real-url.com/', json={'command': 'M105'},
+                                                 timeout=(transport.HTTP_CONNECT_TIMEOUT, 10))
+
+def test_no_hedging_before_enough_samples(policy):
+    policy._session.get.return_value = _response(0.01)
+
+    for _ in range(transport.HEDGE_MIN_SAMPLES - 1):
+        policy.get('status', 'https://not-a-real-url.com/', hedge=True)
+
+    assert policy.hedge_delay('status') is None
+    assert policy._session.get.call_count == transport.HEDGE_MIN_SAMPLES - 1
+    assert policy._executor is None
+
+def test_hedge_delay(policy):
+    _warm_up(policy, 'status', elapsed=0.01)
+    assert policy.hedge_delay('status') == transport.HEDGE_MIN_DELAY
+    assert policy.hedge_delay('command') is None
+
+    _warm_up(policy, 'command', elapsed=0.2)
+    assert policy.hedge_delay('command') == 0.2
+
+def test_hedged_get_sends_again_when_slow(policy):
+    _warm_up(policy, 'status')
+    release = threading.Event()
+    slow, fast = _response(5, body='slow'), _response(0.01, body='fast')
+
+    def _get(url, **kwargs):
+        if policy._session.get.call_count == 1:
+            release.wait(5)
+            return slow
+        return fast
+
+    with mock.patch.object(policy._session, 'get', side_effect=_get):
+        response = policy.get('status', 'https://not-a-real-url.com/', hedge=True)
+        assert policy._session.get.call_count == 2
+    assert response is fast
+
+    # The slower answer is thrown away once it arrives
+    executor = policy._executor
+    release.set()
+    executor.shutdown(wait=True)
+    assert slow.close.called
+    assert not fast.close.called
+
+def test_hedged_get_not_sent_again_when_fast(policy):
+    _warm_up(policy, 'status', elapsed=0.2)
+    answer = _response(0.01)
+
+    with mock.patch.object(policy._session, 'get', return_value=answer):
+        assert policy.get('status', 'https://not-a-real-url.com/', hedge=True) is answer
+        assert policy._session.get.call_count == 1
+
+def test_hedge_delay_starts_after_rate_limit(policy, mocker):
+    _warm_up(policy, 'status')
+    answer = _response(0.01)
+    mocker.patch.object(transport.RateLimiter, 'acquire', side_effect=lambda priority: time.sleep(0.3))
+
+    with mock.patch.object(policy._session, 'get', return_value=answer):
+        assert policy.get('status', 'https://not-a-real-url.com/', hedge=True) is answer
+        policy._executor.shutdown(wait=True)
+        assert policy._session.get.call_count == 1
+
+def test_hedged_get_falls_back_on_failure(policy):
+    _warm_up(policy, 'status')
+    answer = _response(0.01)
+
+    def _get(url, **kwargs):
+        if policy._session.get.call_count == 1:
+            threading.Event().wait(0.2)
+            raise requests.exceptions.ConnectionError("Connection reset")
+        return answer
+
+    with mock.patch.object(policy._session, 'get', side_effect=_get):
+        assert policy.get('status', 'https://not-a-real-url.com/', hedge=True) is answer
+
+def test_hedged_get_raises_when_both_fail(policy):
+    _warm_up(policy, 'status')
+
+    def _get(url, **kwargs):
+        threading.Event().wait(0.1)
+        raise requests.exceptions.ReadTimeout("Read timed out")
+
+    with mock.patch.object(policy._session, 'get', side_effect=_get):
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            policy.get('status', 'https://not-a-real-url.com/', hedge=True)
+
+def test_hedging_disabled(settings):
+    settings.set(['http_hedging'], False)
+    session = mock.Mock(spec=requests.Session)
+    policy = transport.RequestPolicy(session, settings)
+    _warm_up(policy, 'status')
+
+    with mock.patch.object(session, 'get', return_value=_response(0.01)):
+        policy.get('status', 'https://not-a-real-url.com/', hedge=True)
+
+    assert policy._executor is None
+
+def test_retry_after():
+    response = requests.Response()
+    assert transport.retry_after(response) == transport.RETRY_AFTER_DEFAULT
+
+    response.headers['Retry-After'] = '7'
+    assert transport.retry_after(response) == 7
+
+    response.headers['Retry-After'] = '3600'
+    assert transport.retry_after(response) == transport.RETRY_AFTER_MAX
+
+    response.headers['Retry-After'] = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 28 < transport.retry_after(response) <= 30
+
+    response.headers['Retry-After'] = 'not a date'
+    assert transport.retry_after(response) == transport.RETRY_AFTER_DEFAULT
+
+def test_rate_limiter_burst():
+    limiter = transport.RateLimiter(rate=20, burst=3)
+
+    waits = [limiter.acquire() for _ in range(4)]
+
+    assert max(waits[:3]) < 0.01
+    assert 0.03 < waits[3] < 0.2
+    assert limiter.metrics()['waits']['normal']['requests'] == 4
+    assert limiter.metrics()['waits']['normal']['waited'] == 1
+
+def test_rate_limiter_disabled():
+    limiter = transport.RateLimiter(rate=0, burst=1)
+
+    assert max(limiter.acquire() for _ in range(50)) < 0.01
+
+def test_rate_limiter_defer():
+    limiter = transport.RateLimiter(rate=100, burst=10)
+
+    limiter.defer(0.2)
+
+    assert limiter.metrics()['throttled'] == 1
+    assert limiter.acquire(transport.CONTROL) > 0.15
+
+def test_rate_limiter_defer_holds_control_briefly(monkeypatch):
+    monkeypatch.setattr(transport, 'CONTROL_MAX_HOLD', 0.2)
+    limiter = transport.RateLimiter(rate=100, burst=10)
+
+    limiter.defer(30)
+
+    assert 0.15 < limiter.acquire(transport.CONTROL) < 1
+    assert limiter.metrics()['blocked_for'] > 25
+
+def test_rate_limiter_priority():
+    limiter = transport.RateLimiter(rate=5, burst=1)
+    limiter.acquire()
+    order = []
+
+    def _acquire(priority):
+        limiter.acquire(priority)
+        order.append(priority)
+
+    threads = [threading.Thread(target=_acquire, args=(transport.BACKGROUND,))]
+    threads[0].start()
+    time.sleep(0.05)
+    threads.append(threading.Thread(target=_acquire, args=(transport.CONTROL,)))
+    threads[1].start()
+    for thread in threads:
+        thread.join(5)
+
+    assert order == [transport.CONTROL, transport.BACKGROUND]
+    assert limiter.metrics()['waits']['control']['max_wait'] < limiter.metrics()['waits']['background']['max_wait']
+
+def test_rate_limited_request_sent_again(policy):
+    throttled = _response(0.01)
+    throttled.status_code = 429
+    throttled.headers = {'Retry-After': '0.1'}
+    answer = _response(0.01)
+    policy._session.put.side_effect = [throttled, answer]
+
+    started = time.time()
+    response = policy.put('command', 'https://not-a-real-url.com/job/1/', priority=transport.CONTROL,
+                          json={'status': 'cancel'})
+
+    assert response is answer
+    assert time.time() - started >= 0.1
+    assert throttled.close.called
+    metrics = transport.rate_limit_metrics()['not-a-real-url.com']
+    assert metrics['throttled'] == 1
+    assert metrics['waits']['control']['requests'] == 2
+
+def test_rate_limited_request_gives_up(policy):
+    throttled = _response(0.01)
+    throttled.status_code = 429
+    throttled.headers = {'Retry-After': '0'}
+    policy._session.get.return_value = throttled
+
+    assert policy.get('status', 'https://not-a-real-url.com/').status_code == 429
+    assert policy._session.get.call_count == transport.RATE_LIMIT_RETRIES + 1
+
+def test_rate_limit_metrics_after_settings_change(settings):
+    settings.set(['http_rate_limit'], 5)
+    transport.limiter(settings, 'https://not-a-real-url.com/printer/').acquire()
+    settings.set(['http_rate_limit'], 7)
+    transport.limiter(settings, 'https://not-a-real-url.com/command/')
+
+    metrics = transport.rate_limit_metrics()
+
+    assert metrics.keys() == ['not-a-real-url.com']
+    assert metrics['not-a-real-url.com']['rate'] == 7
+    assert metrics['not-a-real-url.com']['waits']['normal']['requests'] == 0